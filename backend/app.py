@@ -1,19 +1,40 @@
 from fastapi import FastAPI, Request, UploadFile, HTTPException
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 import uvicorn
-from query_engine import answer
+from query_engine import answer, answer_batch, answer_modes, iter_answer_modes
+import query_engine
+import ingest
+import followups
+import related
+import index_arms
+import index_store
+import shards
+import snapshots
+import typeahead
+import profiler
+import attributes
+import interview_cache
+import sessions
+import singleflight
+import bulkheads
+import deadlines
+from metrics import render_metrics, TRANSCRIBE_SECONDS, REBUILD_PHASE_SECONDS, MOCK_FALLBACKS
+import upstream
 from dotenv import load_dotenv
 import os
-from openai import OpenAI
+import io
+import math
 import pickle
 import json
 import uuid
 from datetime import datetime
 from typing import List, Optional
+from contextlib import asynccontextmanager
+import threading
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # Interview data storage (in production, use a proper database)
 INTERVIEWS_FILE = "backend/interviews.json"
@@ -30,25 +51,86 @@ def load_interviews():
         return {}
 
 def save_interviews(interviews_data):
-    """Save interviews to JSON file"""
+    """Save interviews to JSON file; returns True on success"""
     try:
         os.makedirs(os.path.dirname(INTERVIEWS_FILE), exist_ok=True)
-        with open(INTERVIEWS_FILE, 'w') as f:
+        tmp_path = INTERVIEWS_FILE + ".tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(interviews_data, f, indent=2)
+        os.replace(tmp_path, INTERVIEWS_FILE)
+        return True
     except Exception as e:
         print(f"Error saving interviews: {e}")
+        return False
+
+# Parsed interviews.json for read-only lookups, keyed by the file's mtime and size
+_interviews_snapshot = (None, {})
 
 def get_interview_by_id(interview_id: str):
-    """Get interview by ID"""
-    interviews = load_interviews()
-    return interviews.get(interview_id)
+    """Get interview by ID; re-reads the file only when it has changed, so don't modify the result"""
+    global _interviews_snapshot
+    try:
+        stat = os.stat(INTERVIEWS_FILE)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    if _interviews_snapshot[0] != version:
+        _interviews_snapshot = (version, load_interviews())
+    return _interviews_snapshot[1].get(interview_id)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the worker accepts connections immediately
+    if query_engine.WARMUP_ON_STARTUP:
+        threading.Thread(target=query_engine.warm_up, name="warm-up", daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def health():
     return {"status": "ok"}
 
+@app.get("/livez")
+def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readiness():
+    """Readiness probe: the index is loaded (and warmed up, if enabled)"""
+    if not query_engine.WARMUP_ON_STARTUP and query_engine.index is None:
+        try:
+            query_engine.load_index()
+        except Exception:
+            pass
+    status = query_engine.get_readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+# Default deadline budget per endpoint; a batch item gets its own /query budget on top of the batch's
+DEADLINE_BUDGETS = {"/query": deadlines.DEFAULT_DEADLINE_SECONDS, "/query/batch": deadlines.BATCH_DEADLINE_SECONDS}
+
+@app.middleware("http")
+async def query_deadline(request: Request, call_next):
+    """Give /query requests a deadline from the X-Deadline-Ms header or the endpoint's default budget"""
+    budget = DEADLINE_BUDGETS.get(request.url.path)
+    if budget is None:
+        return await call_next(request)
+    token = deadlines.start(deadlines.from_header(request.headers.get(deadlines.DEADLINE_HEADER), default=budget))
+    try:
+        return await call_next(request)
+    finally:
+        deadlines.reset(token)
+
+@app.exception_handler(bulkheads.Overloaded)
+def overloaded_handler(request: Request, exc: bulkheads.Overloaded):
+    # Fast rejection lets the client retry elsewhere instead of timing out in the queue
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(max(1, math.ceil(exc.estimated_wait)))})
+
+# Counts requests only while a profiling run limited by requests is active
+app.add_middleware(profiler.RequestCounter)
+
 # Optional: allow frontend to access backend from another port
 app.add_middleware(
     CORSMiddleware,
@@ -59,35 +141,88 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.post(profiler.PROFILE_PATH)
+@bulkheads.run_in(bulkheads.ADMIN)
+def profile_worker(request: Request, seconds: float = 10, requests: int = 0, interval_ms: float = 5,
+                   format: str = "json"):
+    """Sample where this worker's threads spend time for `seconds`, or for the next `requests` requests.
+
+    Returns the top functions and folded stacks for a flame graph (format=folded for the stacks alone).
+    """
+    if not profiler.authorized(request.headers.get(profiler.ADMIN_TOKEN_HEADER)):
+        raise HTTPException(status_code=403, detail="Admin token required (set ADMIN_TOKEN to enable profiling)")
+    try:
+        report = profiler.profile(seconds=seconds, requests=requests, interval_ms=interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    print(f"Profiled worker {os.getpid()} for {report['seconds']}s ({report['requests']} requests, "
+          f"{report['busy_samples']} busy samples)")
+    if format == "folded":
+        return PlainTextResponse(report["folded"] + "\n")
+    return {"pid": os.getpid(), **report}
+
+@app.get("/metrics")
+def get_metrics():
+    """Expose latency histograms and counters in Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/transcribe")
 async def transcribe(file: UploadFile):
+    with TRANSCRIBE_SECONDS.time():
+        return await _transcribe(file)
+
+async def _transcribe(file: UploadFile):
     try:
         # Check if we're in mock mode (no valid API key or quota)
         if not os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY") == "your-openai-api-key-here":
             print("Using mock transcription (no valid API key)")
+            MOCK_FALLBACKS.inc(endpoint="transcribe")
             return {"text": "This is a mock transcription for testing. The audio would normally be transcribed by OpenAI Whisper."}
         
-        with open("temp_audio.webm", "wb") as f:
-            f.write(await file.read())
-
-        with open("temp_audio.webm", "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="text"
-            )
+        audio = await file.read()
+        # The Whisper call blocks, so it runs on its own pool instead of the event loop
+        transcript = await bulkheads.TRANSCRIPTION.run(_transcribe_audio, audio)
         print("Transcript", transcript)
         return {"text": transcript}
     except Exception as e:
         print(f"Transcription error: {e}")
+        MOCK_FALLBACKS.inc(endpoint="transcribe")
         # Fallback to mock if API fails (quota exceeded, etc.)
         print("Falling back to mock transcription")
         return {"text": "Mock transcription (API error): The audio would be transcribed here with a working OpenAI API key and credits."}
 
+def _transcribe_audio(audio):
+    # In memory rather than a shared temp file, since several transcriptions can now run at once
+    audio_file = io.BytesIO(audio)
+    audio_file.name = "audio.webm"
+    return upstream.create_transcription(audio_file, model="whisper-1", response_format="text")
+
+class QueryFilters(BaseModel):
+    # Sources containing any of these substrings (case-insensitive)
+    sources: Optional[List[str]] = None
+    # "corpus" or "interview"
+    doc_type: Optional[str] = None
+    interview_ids: Optional[List[str]] = None
+    # ISO timestamps bounding when a document was added
+    added_after: Optional[str] = None
+    added_before: Optional[str] = None
+
 class QueryRequest(BaseModel):
     text: str
     mode: str = "explain"
     history: list[dict[str, str]] = []
+    conversation_id: Optional[str] = None
+    # Several modes share one retrieval; stream=True sends NDJSON events as each completes
+    modes: Optional[List[str]] = None
+    stream: bool = False
+    # Only retrieve from indexed rows matching these
+    filters: Optional[QueryFilters] = None
+
+class QueryBatchRequest(BaseModel):
+    inputs: List[str]
+    mode: str = "explain"
+    max_concurrency: int = 4
+    filters: Optional[QueryFilters] = None
 
 class InterviewCreateRequest(BaseModel):
     title: str
@@ -120,28 +255,175 @@ class Interview(BaseModel):
     created_at: str
     updated_at: str
 
+QUERY_MODES = ("explain", "followup", query_engine.EXTRACTIVE_MODE)
+
+def _mock_query_response(text, mode):
+    mock_response = f"Mock response for '{text}': "
+    if mode == "explain":
+        mock_response += "This would normally be an AI explanation of what you heard, powered by OpenAI GPT and RAG search."
+    else:
+        mock_response += "Here would be a suggested follow-up question to continue the conversation."
+    return mock_response
+
 @app.post("/query")
+@bulkheads.run_in(bulkheads.QUERY, admission=True)
 def query_api(req: QueryRequest):
+    filters = _query_filters(req.filters)
+    if req.modes:
+        return _multi_mode_query(req, filters)
     try:
-        response = answer(req.text, mode=req.mode, history=req.history)
-        return {"response": response["answer"], "sources": response["sources"]}
+        response = answer(req.text, mode=req.mode, history=req.history,
+                          conversation_id=req.conversation_id, filters=filters)
+        return {"response": response["answer"], "sources": response["sources"],
+                "answer_type": response["answer_type"]}
+    except deadlines.DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"Query error: {e}")
+        MOCK_FALLBACKS.inc(endpoint="query")
         # Fallback response for API errors
-        mock_response = f"Mock response for '{req.text}': "
-        if req.mode == "explain":
-            mock_response += "This would normally be an AI explanation of what you heard, powered by OpenAI GPT and RAG search."
+        return {"response": _mock_query_response(req.text, req.mode), "sources": ["Mock Source 1", "Mock Source 2"]}
+
+def _query_filters(filters):
+    """Validated filters as a plain dict, or None when none were given"""
+    if filters is None:
+        return None
+    filters = filters.model_dump(exclude_none=True)
+    if filters.get("doc_type") and filters["doc_type"] not in attributes.DOC_TYPES:
+        raise HTTPException(status_code=400, detail=f"doc_type must be one of: {', '.join(attributes.DOC_TYPES)}")
+    for field in ("added_after", "added_before"):
+        if filters.get(field) and attributes.parse_time(filters[field]) is None:
+            raise HTTPException(status_code=400, detail=f"{field} must be an ISO timestamp")
+    return filters or None
+
+def _multi_mode_query(req: QueryRequest, filters=None):
+    """Retrieve once for all requested modes and run their completions concurrently"""
+    modes = list(dict.fromkeys(req.modes))
+    unknown = [mode for mode in modes if mode not in QUERY_MODES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown modes: {', '.join(unknown)}")
+
+    if req.stream:
+        def events():
+            try:
+                for event in iter_answer_modes(req.text, modes, history=req.history,
+                                               conversation_id=req.conversation_id, filters=filters):
+                    if "error" in event:
+                        MOCK_FALLBACKS.inc(endpoint="query")
+                        event = {"mode": event["mode"], "response": _mock_query_response(req.text, event["mode"]), "error": event["error"]}
+                    elif "answer" in event:
+                        event = {"mode": event["mode"], "response": event["answer"], "answer_type": event["answer_type"]}
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                print(f"Query error: {e}")
+                MOCK_FALLBACKS.inc(endpoint="query")
+                yield json.dumps({"sources": ["Mock Source 1", "Mock Source 2"]}) + "\n"
+                for mode in modes:
+                    yield json.dumps({"mode": mode, "response": _mock_query_response(req.text, mode), "error": str(e)}) + "\n"
+            yield json.dumps({"done": True}) + "\n"
+        # The body is produced on the query pool too, not Starlette's default threadpool
+        return StreamingResponse(bulkheads.QUERY.iterate(events()), media_type="application/x-ndjson")
+
+    try:
+        result = answer_modes(req.text, modes, history=req.history, conversation_id=req.conversation_id,
+                              filters=filters)
+        sources = result["sources"]
+    except deadlines.DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        print(f"Query error: {e}")
+        result = {"answers": {}, "answer_types": {}, "errors": {mode: str(e) for mode in modes}}
+        sources = ["Mock Source 1", "Mock Source 2"]
+
+    responses = {}
+    for mode in modes:
+        if mode in result["answers"]:
+            responses[mode] = result["answers"][mode]
+        else:
+            MOCK_FALLBACKS.inc(endpoint="query")
+            responses[mode] = _mock_query_response(req.text, mode)
+    return {
+        "responses": responses,
+        "answer_types": result["answer_types"],
+        "errors": result["errors"],
+        # First requested mode, for clients that read a single response
+        "response": responses[modes[0]],
+        "sources": sources
+    }
+
+# Upper bounds for /query/batch so one request can't monopolize the upstream quota
+BATCH_QUERY_MAX_INPUTS = int(os.getenv("BATCH_QUERY_MAX_INPUTS", "100"))
+BATCH_QUERY_MAX_CONCURRENCY = int(os.getenv("BATCH_QUERY_MAX_CONCURRENCY", "8"))
+
+@app.post("/query/batch")
+@bulkheads.run_in(bulkheads.QUERY, admission=True)
+def query_batch_api(req: QueryBatchRequest):
+    """Answer many inputs with one embedding call and one index search"""
+    if not req.inputs:
+        return {"results": []}
+    if len(req.inputs) > BATCH_QUERY_MAX_INPUTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_QUERY_MAX_INPUTS} inputs per batch")
+
+    concurrency = min(max(req.max_concurrency, 1), BATCH_QUERY_MAX_CONCURRENCY)
+    filters = _query_filters(req.filters)
+    try:
+        answers = answer_batch(req.inputs, mode=req.mode, max_concurrency=concurrency, filters=filters)
+    except Exception as e:
+        # Retrieval is shared, so its failure fails every item
+        print(f"Batch query retrieval error: {e}")
+        answers = [{"error": f"Retrieval failed: {e}", "sources": []} for _ in req.inputs]
+
+    results = []
+    for i, (text, item) in enumerate(zip(req.inputs, answers)):
+        if "error" in item:
+            results.append({"index": i, "text": text, "status": "error", "error": item["error"], "sources": item["sources"]})
         else:
-            mock_response += "Here would be a suggested follow-up question to continue the conversation."
-        return {"response": mock_response, "sources": ["Mock Source 1", "Mock Source 2"]}
+            results.append({"index": i, "text": text, "status": "ok", "response": item["answer"],
+                            "sources": item["sources"], "answer_type": item["answer_type"]})
+    return {
+        "results": results,
+        "succeeded": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] == "error")
+    }
+
+@app.get("/suggest")
+async def suggest_api(q: str = "", limit: int = typeahead.TYPEAHEAD_LIMIT):
+    """Typeahead completions for the query box: corpus terms and sources, from a prefix index"""
+    # Sub-millisecond and CPU-only, so it runs on the event loop instead of queueing behind
+    # /query completions; only a first call that has to load the index goes to a pool
+    if query_engine.index is None:
+        await bulkheads.ADMIN.run(query_engine.load_index)
+    try:
+        suggestions = query_engine.suggest(q, limit=max(1, min(limit, 25)))
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"query": q, "suggestions": suggestions}
+
+@app.get("/sessions/{conversation_id}")
+@bulkheads.run_in(bulkheads.ADMIN)
+def get_conversation_session(conversation_id: str):
+    """Get the rolling summary and recent turns stored for a conversation"""
+    session = sessions.get_session(conversation_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"conversation_id": conversation_id, **session}
+
+@app.delete("/sessions/{conversation_id}")
+@bulkheads.run_in(bulkheads.ADMIN)
+def delete_conversation_session(conversation_id: str):
+    """Forget the server-side state for a conversation"""
+    if not sessions.delete_session(conversation_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session deleted successfully"}
 
 @app.get("/corpus")
+@bulkheads.run_in(bulkheads.ADMIN)
 def get_corpus():
     """Get the corpus information - documents, sources, and metadata including interview documents"""
     try:
-        # Load the original corpus from the pickle file
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        meta_path = os.path.join(BASE_DIR, "index/metadata.pkl")
+        # Load the original corpus from the current index snapshot
+        from config import get_index_paths
+        meta_path = get_index_paths()["metadata"]
         
         corpus_data = []
         total_words = 0
@@ -216,9 +498,22 @@ def get_corpus():
             }
         }
 
+@app.get("/corpus/{document_id}/similar")
+@bulkheads.run_in(bulkheads.ADMIN)
+def get_similar_documents(document_id: str, k: int = related.RELATED_K):
+    """Documents related to a corpus or interview document, from the graph computed at rebuild"""
+    try:
+        similar = query_engine.similar_documents(document_id, k=max(1, min(k, related.RELATED_K)))
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Document not found in the index")
+    return {"id": document_id, "similar": similar}
+
 # Interview Management Endpoints
 
 @app.get("/interviews")
+@bulkheads.run_in(bulkheads.ADMIN)
 def get_interviews():
     """Get all interviews"""
     try:
@@ -246,6 +541,7 @@ def get_interviews():
         return {"interviews": []}
 
 @app.post("/interviews")
+@bulkheads.run_in(bulkheads.ADMIN)
 def create_interview(request: InterviewCreateRequest):
     """Create a new interview"""
     try:
@@ -268,12 +564,16 @@ def create_interview(request: InterviewCreateRequest):
         interviews[interview_id] = interview_data
         save_interviews(interviews)
         
+        # Embed the topics and generate suggestions before the first question is asked
+        interview_cache.warm_up(interview_data, _generate_paper_suggestions)
+        
         return {"interview": interview_data}
     except Exception as e:
         print(f"Error creating interview: {e}")
         raise HTTPException(status_code=500, detail="Failed to create interview")
 
 @app.get("/interviews/{interview_id}")
+@bulkheads.run_in(bulkheads.ADMIN)
 def get_interview(interview_id: str):
     """Get specific interview with documents"""
     try:
@@ -281,6 +581,7 @@ def get_interview(interview_id: str):
         if not interview:
             raise HTTPException(status_code=404, detail="Interview not found")
         
+        interview_cache.warm_up(interview, _generate_paper_suggestions)
         return {"interview": interview}
     except HTTPException:
         raise
@@ -289,6 +590,7 @@ def get_interview(interview_id: str):
         raise HTTPException(status_code=500, detail="Failed to get interview")
 
 @app.post("/interviews/{interview_id}/documents")
+@bulkheads.run_in(bulkheads.ADMIN)
 def add_document_to_interview(interview_id: str, request: DocumentAddRequest):
     """Add a document to an interview"""
     try:
@@ -323,18 +625,147 @@ def add_document_to_interview(interview_id: str, request: DocumentAddRequest):
         print(f"Error adding document to interview {interview_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to add document")
 
+def _prepare_bulk_document(line_number, payload, error, now):
+    """Validate one parsed JSONL document and chunk it; returns (outcome, document, chunks)"""
+    if error:
+        return {"line": line_number, "status": "error", "error": error}, None, []
+    try:
+        request = DocumentAddRequest(**payload)
+    except Exception as e:
+        return {"line": line_number, "status": "error", "error": f"Invalid document: {e}"}, None, []
+
+    chunks, word_count = ingest.chunk_text(request.content)
+    if not chunks:
+        return {"line": line_number, "status": "error", "title": request.title, "error": "Document is empty"}, None, []
+
+    document = {
+        "id": str(uuid.uuid4()),
+        "title": request.title,
+        "content": request.content,
+        "source": request.source or request.title,
+        "word_count": word_count,
+        "created_at": now
+    }
+    outcome = {"line": line_number, "status": "pending", "document_id": document["id"],
+               "title": document["title"], "word_count": word_count, "chunks": len(chunks)}
+    return outcome, document, chunks
+
+@app.post("/interviews/{interview_id}/documents/bulk")
+async def bulk_add_documents_to_interview(interview_id: str, request: Request):
+    """Add many documents from a JSONL body or multipart JSONL upload in one transaction"""
+    # Only the body is read on the event loop; parsing, chunking and indexing run on the maintenance pool
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None:
+            raise HTTPException(status_code=400, detail="Multipart upload needs a 'file' field")
+        lines = upload.file
+    else:
+        lines = (await request.body()).split(b"\n")
+    return await bulkheads.MAINTENANCE.run(_bulk_add_documents, interview_id, lines)
+
+def _bulk_add_documents(interview_id, lines):
+    """Parse, validate, count words and chunk in a single pass over the lines, then commit the documents"""
+    if not get_interview_by_id(interview_id):
+        raise HTTPException(status_code=404, detail="Interview not found")
+
+    now = datetime.now().isoformat()
+    outcomes, documents, chunk_batches = [], [], []
+    for line_number, payload, error in ingest.iter_jsonl(lines):
+        outcome, document, chunks = _prepare_bulk_document(line_number, payload, error, now)
+        outcomes.append(outcome)
+        if document:
+            documents.append(document)
+            chunk_batches.append(chunks)
+
+    if not documents:
+        return {"added": 0, "failed": len(outcomes), "index_status": "unchanged", "documents": outcomes}
+
+    result = _commit_bulk_documents(interview_id, documents, chunk_batches, now)
+    for outcome in outcomes:
+        if outcome["status"] == "pending":
+            outcome["status"] = "added"
+    return {
+        "added": len(documents),
+        "failed": len(outcomes) - len(documents),
+        "index_status": result["index_status"],
+        "documents": outcomes
+    }
+
+def _commit_bulk_documents(interview_id, documents, chunk_batches, now):
+    """Embed all chunks in batches, then write the interview store and the index together"""
+    interview_title = get_interview_by_id(interview_id)["title"]
+    texts, sources, ids = [], [], []
+    for document, chunks in zip(documents, chunk_batches):
+        texts.extend(chunks)
+        sources.extend([f"{document['source']} (Interview: {interview_title})"] * len(chunks))
+        ids.extend(ingest.chunk_ids(f"interview_{document['id']}", len(chunks)))
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    mock_mode = not api_key or api_key == "your-openai-api-key-here"
+
+    with ingest.index_write_lock:
+        staged = None
+        if mock_mode:
+            print("Skipping bulk embedding (no valid API key); documents need an index rebuild")
+            index_status = "rebuild_required"
+        else:
+            try:
+                # Only chunks that aren't near-duplicates of indexed ones are embedded
+                keep, signatures, aliases = ingest.plan_dedup(texts, sources, ids)
+                new_texts = [texts[i] for i in keep]
+                vectors = ingest.embed_texts(new_texts) if new_texts else None
+                staged = ingest.IndexAppend(new_texts, [sources[i] for i in keep], [ids[i] for i in keep], vectors,
+                                            signatures=signatures, aliases=aliases,
+                                            chunks_seen=len(texts), interview_id=interview_id, added_at=now)
+                index_status = "indexed"
+            except Exception as e:
+                print(f"Bulk ingest embedding/index error: {e}")
+                raise HTTPException(status_code=502, detail=f"Failed to embed and index documents: {e}")
+
+        interviews = load_interviews()
+        interview = interviews.get(interview_id)
+        if not interview:
+            if staged:
+                staged.abort()
+            raise HTTPException(status_code=404, detail="Interview not found")
+        interview["documents"].extend(documents)
+        interview["updated_at"] = now
+
+        if not save_interviews(interviews):
+            if staged:
+                staged.abort()
+            raise HTTPException(status_code=500, detail="Failed to save documents")
+        if staged:
+            staged.commit()
+
+    if staged:
+        query_engine.reload_index()
+        # Follow-up questions take a chat call per few chunks, so they are filled in after the
+        # documents are searchable rather than holding the request and the index write lock
+        if followups.FOLLOWUP_PRECOMPUTE and new_texts:
+            ingest.schedule_followups([ids[i] for i in keep], new_texts, on_published=query_engine.reload_index)
+    print(f"Bulk ingested {len(documents)} documents ({len(texts)} chunks) into interview {interview_id}")
+    return {"index_status": index_status}
+
 @app.post("/interviews/{interview_id}/suggest-papers")
+@bulkheads.run_in(bulkheads.ADMIN)
 def suggest_papers_for_interview(interview_id: str):
     """Generate AI suggestions for relevant papers based on interview details"""
+    print(f"POST /interviews/{interview_id}/suggest-papers - Getting suggestions...")
+    interview = get_interview_by_id(interview_id)
+    if not interview:
+        print("Interview not found, returning 404")
+        raise HTTPException(status_code=404, detail="Interview not found")
+    
+    # Cached until the company, role, topics or description change
+    return interview_cache.get_suggestions(interview, _generate_paper_suggestions)
+
+def _generate_paper_suggestions(interview):
+    """Generate suggestions for an interview; returns (result, cacheable)"""
+    interview_id = interview["id"]
     try:
-        print(f"POST /interviews/{interview_id}/suggest-papers - Getting suggestions...")
-        interview = get_interview_by_id(interview_id)
-        print(f"Interview found: {interview is not None}")
-        
-        if not interview:
-            print("Interview not found, returning 404")
-            raise HTTPException(status_code=404, detail="Interview not found")
-        
         print(f"Interview details: {interview}")
         
         # Check if we're in mock mode
@@ -343,6 +774,7 @@ def suggest_papers_for_interview(interview_id: str):
         
         if not api_key or api_key == "your-openai-api-key-here":
             print("Using mock suggestions (no valid API key)")
+            MOCK_FALLBACKS.inc(endpoint="suggest-papers")
             return {
                 "suggestions": [
                     {
@@ -354,7 +786,7 @@ def suggest_papers_for_interview(interview_id: str):
                         "reason": "Important for senior engineering roles"
                     }
                 ]
-            }
+            }, False
         
         print("Making OpenAI API request for suggestions...")
         
@@ -374,17 +806,14 @@ Example: [{{"title": "Paper/Topic Name", "reason": "Why this is relevant"}}]
         
         print(f"OpenAI prompt: {prompt}")
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
-        )
+        response = upstream.create_chat_completion([{"role": "user", "content": prompt}], model="gpt-3.5-turbo")
         
         print(f"OpenAI response received: {response.choices[0].message.content}")
         
         try:
             suggestions = json.loads(response.choices[0].message.content)
             print(f"Parsed suggestions: {suggestions}")
-            return {"suggestions": suggestions}
+            return {"suggestions": suggestions}, True
         except json.JSONDecodeError as json_error:
             print(f"JSON decode error: {json_error}")
             print(f"Raw response content: {response.choices[0].message.content}")
@@ -396,7 +825,7 @@ Example: [{{"title": "Paper/Topic Name", "reason": "Why this is relevant"}}]
                         "reason": "Based on your interview description, studying core technical concepts would be beneficial"
                     }
                 ]
-            }
+            }, False
         
     except HTTPException:
         raise
@@ -405,9 +834,10 @@ Example: [{{"title": "Paper/Topic Name", "reason": "Why this is relevant"}}]
         print(f"Exception type: {type(e).__name__}")
         import traceback
         traceback.print_exc()
-        return {"suggestions": []}
+        return {"suggestions": []}, False
 
 @app.delete("/interviews/{interview_id}/documents/{document_id}")
+@bulkheads.run_in(bulkheads.MAINTENANCE)
 def delete_document_from_interview(interview_id: str, document_id: str):
     """Delete a document from an interview"""
     try:
@@ -430,6 +860,12 @@ def delete_document_from_interview(interview_id: str, document_id: str):
         interviews[interview_id] = interview
         save_interviews(interviews)
         
+        try:
+            with ingest.index_write_lock:
+                query_engine.remove_related([f"interview_{document_id}"])
+        except Exception as e:
+            print(f"Error updating related documents for {document_id}: {e}")
+        
         print(f"Document {document_id} deleted successfully")
         return {"message": "Document deleted successfully"}
     
@@ -440,50 +876,32 @@ def delete_document_from_interview(interview_id: str, document_id: str):
         raise HTTPException(status_code=500, detail="Failed to delete document")
 
 @app.delete("/corpus/{document_id}")
+@bulkheads.run_in(bulkheads.MAINTENANCE)
 def delete_corpus_document(document_id: str):
-    """Delete an original corpus document and rebuild the index"""
+    """Delete an original corpus document, publishing an index snapshot without its rows"""
     try:
         print(f"DELETE /corpus/{document_id}")
         
-        # Load existing metadata
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        meta_path = os.path.join(BASE_DIR, "index/metadata.pkl")
+        from config import get_index_paths
+        meta_path = get_index_paths()["metadata"]
         
         if not os.path.exists(meta_path):
             raise HTTPException(status_code=404, detail="Corpus not found")
         
-        with open(meta_path, "rb") as f:
-            metadata = pickle.load(f)
-        
-        texts = metadata.get("texts", [])
-        sources = metadata.get("sources", [])
-        ids = metadata.get("ids", [])
-        
-        # Find the document to delete
-        doc_index = None
-        for i, doc_id in enumerate(ids):
-            if f"corpus_{doc_id}" == document_id:
-                doc_index = i
-                break
-        
-        if doc_index is None:
-            raise HTTPException(status_code=404, detail="Document not found")
-        
-        # Remove the document from metadata
-        del texts[doc_index]
-        del sources[doc_index]  
-        del ids[doc_index]
-        
-        # Update metadata
-        updated_metadata = {
-            "texts": texts,
-            "sources": sources,
-            "ids": ids
-        }
+        with ingest.index_write_lock:
+            # Re-read under the lock, in case an ingest published a snapshot meanwhile
+            with open(get_index_paths()["metadata"], "rb") as f:
+                ids = pickle.load(f).get("ids", [])
+            
+            # Find the rows to delete
+            rows = [i for i, doc_id in enumerate(ids) if f"corpus_{doc_id}" == document_id]
+            if not rows:
+                raise HTTPException(status_code=404, detail="Document not found")
+            
+            removal = ingest.IndexRemoval(rows)
+            removal.commit()
         
-        # Save updated metadata
-        with open(meta_path, "wb") as f:
-            pickle.dump(updated_metadata, f)
+        query_engine.reload_index()
         
         print(f"Document {document_id} deleted from corpus successfully")
         return {"message": "Document deleted successfully"}
@@ -494,14 +912,32 @@ def delete_corpus_document(document_id: str):
         print(f"Error deleting document {document_id} from corpus: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete document")
 
+@app.get("/stats/pools")
+def get_pool_stats():
+    """Get queue depth and utilization for each executor pool"""
+    return {"pools": bulkheads.get_stats()}
+
+@app.get("/stats/index-arms")
+def get_index_arm_stats():
+    """Get shadow/A-B serving configuration, per-arm retrieval latency and result overlap"""
+    return index_arms.get_stats()
+
+@app.get("/stats/coalescing")
+@bulkheads.run_in(bulkheads.ADMIN)
+def get_coalescing_stats():
+    """Get upstream call and coalesced-request counts per request type"""
+    return {"groups": singleflight.get_stats()}
+
 # Index Management Endpoints
 
 @app.get("/index/status")
+@bulkheads.run_in(bulkheads.ADMIN)
 def get_index_status():
     """Get the current status of the search index"""
     try:
+        from config import get_index_paths
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        status_path = os.path.join(BASE_DIR, "index/rebuild_status.json")
+        status_path = get_index_paths()["rebuild_status"]
         
         if os.path.exists(status_path):
             with open(status_path, 'r') as f:
@@ -541,6 +977,14 @@ def get_index_status():
         
         status["needs_rebuild"] = needs_rebuild
         status["rebuild_reason"] = rebuild_reason
+        # Ingest updates the dedup counts after the last rebuild, so prefer the loaded index's
+        if query_engine.metadata.get("dedup"):
+            status["dedup"] = query_engine.metadata["dedup"]
+        from config import get_index_directory
+        status["snapshot"] = snapshots.current_id(get_index_directory())
+        if isinstance(query_engine.index, shards.ShardedIndex):
+            status["shards"] = [{"shard": number, "rows": shard.ntotal}
+                                for number, shard in enumerate(query_engine.index.shards)]
         
         return status
         
@@ -566,11 +1010,13 @@ def progress_callback(progress, message):
     }
 
 @app.get("/index/progress")
+@bulkheads.run_in(bulkheads.ADMIN)
 def get_rebuild_progress():
     """Get the current rebuild progress"""
     return rebuild_progress
 
 @app.post("/index/rebuild")
+@bulkheads.run_in(bulkheads.MAINTENANCE)
 def rebuild_search_index():
     """Manually trigger a search index rebuild"""
     global rebuild_progress
@@ -588,6 +1034,10 @@ def rebuild_search_index():
         # Start rebuild with progress callback
         result = rebuild_index(progress_callback=progress_callback)
         
+        # Serve the new index from this worker without a restart
+        if result.get("status") == "success":
+            query_engine.reload_index()
+        
         # Mark as complete
         rebuild_progress["active"] = False
         
@@ -595,4 +1045,62 @@ def rebuild_search_index():
         
     except Exception as e:
         rebuild_progress = {"progress": 0, "message": f"Error: {str(e)}", "active": False}
-        raise HTTPException(status_code=500, detail=f"Failed to rebuild index: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild index: {str(e)}")
+
+@app.post("/index/shards/{shard}/rebuild")
+@bulkheads.run_in(bulkheads.MAINTENANCE)
+def rebuild_index_shard(shard: int):
+    """Rebuild one shard of a sharded index from its stored vectors; other shards are untouched"""
+    from config import get_index_paths
+    paths = get_index_paths()
+    with ingest.index_write_lock:
+        with open(paths["metadata"], "rb") as f:
+            metadata = pickle.load(f)
+        count = (metadata.get("shards") or {}).get("count")
+        if not count:
+            raise HTTPException(status_code=400, detail="Index is not sharded")
+        if not 0 <= shard < count:
+            raise HTTPException(status_code=404, detail="Shard not found")
+        # Published as a new snapshot sharing every other file with the current one
+        snapshot = snapshots.SnapshotBuilder(paths["index_dir"], parent_dir=paths["snapshot_dir"])
+        try:
+            with REBUILD_PHASE_SECONDS.time(phase="shard"):
+                rows = shards.rebuild_shard(paths["snapshot_dir"], snapshot.paths["snapshot_dir"], shard, metadata,
+                                            index_store.load_vectors(paths["vectors"]))
+            snapshot.publish(metadata, kind="shard_rebuild", stats={"shard": shard, "rows": rows})
+        except ValueError as e:
+            snapshot.abort()
+            raise HTTPException(status_code=409, detail=str(e))
+        except Exception:
+            snapshot.abort()
+            raise
+    query_engine.reload_index()
+    print(f"Rebuilt index shard {shard} ({rows} rows)")
+    return {"shard": shard, "rows": rows}
+
+@app.get("/index/snapshots")
+@bulkheads.run_in(bulkheads.ADMIN)
+def list_index_snapshots():
+    """Published index snapshots, newest first, with their manifests' summaries"""
+    from config import get_index_directory
+    return {"snapshots": snapshots.list_snapshots(get_index_directory())}
+
+@app.post("/index/snapshots/{snapshot_id}/activate")
+@bulkheads.run_in(bulkheads.MAINTENANCE)
+def activate_index_snapshot(snapshot_id: str):
+    """Serve an earlier (or later) snapshot, e.g. to roll back a bad rebuild; no re-embedding"""
+    from config import get_index_directory, get_index_paths
+    with ingest.index_write_lock:
+        try:
+            manifest = snapshots.activate(get_index_directory(), snapshot_id)
+        except LookupError:
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        # /index/status reports the activated snapshot's counts, not those of the one rolled away from
+        paths = get_index_paths()
+        with open(paths["metadata"], "rb") as f:
+            ingest.record_status(paths, pickle.load(f), manifest, kind="activate")
+    query_engine.reload_index()
+    print(f"Activated index snapshot {snapshot_id} ({manifest['documents']} documents)")
+    return {"snapshot": snapshot_id, "documents": manifest["documents"]}
\ No newline at end of file
@@ -0,0 +1,122 @@
+import time
+from datetime import datetime
+import faiss
+import numpy as np
+
+# Values of the doc_type filter, stored per row as their position
+DOC_TYPES = ("corpus", "interview")
+
+def parse_time(value):
+    """Epoch seconds for an ISO timestamp, or None when missing or unparseable"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def interview_documents(interviews):
+    """{document id: (interview id, created_at)} for every interview document"""
+    return {doc["id"]: (interview_id, doc.get("created_at"))
+            for interview_id, interview in interviews.items() for doc in interview.get("documents", [])}
+
+def _document(row_id):
+    return row_id.split("#", 1)[0]
+
+def build(ids, sources, interview_docs, previous=None):
+    """Per-row attribute columns for filtered search.
+
+    Interview rows take their interview and creation time from interview_docs; corpus rows keep the
+    time they were first indexed, carried over from previous ({"ids", "attributes"} metadata).
+    """
+    first_seen = {}
+    if previous and previous.get("attributes") is not None:
+        for row_id, added_at in zip(previous.get("ids", []), previous["attributes"]["added_at"]):
+            first_seen[row_id] = float(added_at)
+
+    interview_ids, added_at = [], []
+    for row_id in ids:
+        if row_id.startswith("interview_"):
+            interview_id, created_at = interview_docs.get(_document(row_id)[len("interview_"):], (None, None))
+            interview_ids.append(interview_id)
+            added_at.append(parse_time(created_at))
+        else:
+            interview_ids.append(None)
+            added_at.append(first_seen.get(row_id))
+    return append(empty(), ids, sources, interview_ids, added_at)
+
+def empty():
+    return {
+        "doc_type": np.zeros(0, dtype="int8"),
+        "source": np.zeros(0, dtype="int32"),
+        "source_vocab": [],
+        "interview": np.zeros(0, dtype="int32"),
+        "interview_vocab": [],
+        "added_at": np.zeros(0, dtype="float64")
+    }
+
+def _codes(values, vocab):
+    """Codes for values in a growing vocabulary; None becomes -1"""
+    positions = {value: code for code, value in enumerate(vocab)}
+    codes = []
+    for value in values:
+        if value is None:
+            codes.append(-1)
+            continue
+        if value not in positions:
+            positions[value] = len(vocab)
+            vocab.append(value)
+        codes.append(positions[value])
+    return np.array(codes, dtype="int32")
+
+def append(attributes, ids, sources, interview_ids, added_at, default_time=None):
+    """Attribute columns extended with new rows (returns a new dict; the input is not modified)"""
+    default_time = time.time() if default_time is None else default_time
+    source_vocab = list(attributes["source_vocab"])
+    interview_vocab = list(attributes["interview_vocab"])
+    doc_types = [DOC_TYPES.index("interview" if row_id.startswith("interview_") else "corpus") for row_id in ids]
+    return {
+        "doc_type": np.concatenate([attributes["doc_type"], np.array(doc_types, dtype="int8")]),
+        "source": np.concatenate([attributes["source"], _codes(sources, source_vocab)]),
+        "source_vocab": source_vocab,
+        "interview": np.concatenate([attributes["interview"], _codes(interview_ids, interview_vocab)]),
+        "interview_vocab": interview_vocab,
+        "added_at": np.concatenate([attributes["added_at"], np.array(
+            [default_time if value is None else value for value in added_at], dtype="float64")])
+    }
+
+def row_mask(attributes, filters):
+    """Boolean mask of rows matching every given filter.
+
+    filters may hold sources (substrings, any of which the source must contain, case-insensitive),
+    doc_type ("corpus" or "interview"), interview_ids, and added_after / added_before (ISO times).
+    """
+    mask = np.ones(len(attributes["doc_type"]), dtype=bool)
+    if filters.get("sources"):
+        needles = [needle.lower() for needle in filters["sources"]]
+        codes = [code for code, source in enumerate(attributes["source_vocab"])
+                 if any(needle in source.lower() for needle in needles)]
+        mask &= np.isin(attributes["source"], codes)
+    if filters.get("doc_type"):
+        mask &= attributes["doc_type"] == DOC_TYPES.index(filters["doc_type"])
+    if filters.get("interview_ids"):
+        codes = [code for code, interview_id in enumerate(attributes["interview_vocab"])
+                 if interview_id in filters["interview_ids"]]
+        mask &= np.isin(attributes["interview"], codes)
+    if filters.get("added_after"):
+        mask &= attributes["added_at"] >= parse_time(filters["added_after"])
+    if filters.get("added_before"):
+        mask &= attributes["added_at"] < parse_time(filters["added_before"])
+    return mask
+
+def search_params(mask):
+    """FAISS search parameters restricting results to the rows set in mask.
+
+    The packed bitmap and selector are kept on the returned object, since FAISS only holds pointers to them.
+    """
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+    params = faiss.SearchParameters(sel=selector)
+    params.bitmap = bitmap
+    params.selector = selector
+    return params
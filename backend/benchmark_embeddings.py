@@ -5,11 +5,14 @@ import json
 import pickle
 import os
 import psutil
+import subprocess
+import sys
 from datetime import datetime
 from typing import List, Dict, Any, Tuple
 from openai import OpenAI
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
+import index_store
 
 # Prevent tokenizer multiprocessing issues
 os.environ['TOKENIZERS_PARALLELISM'] = 'false'
@@ -115,6 +118,51 @@ class EmbeddingsBenchmark:
         process = psutil.Process(os.getpid())
         return process.memory_info().rss / 1024 / 1024
     
+    def benchmark_startup(self, workers: int = 2) -> Dict[str, Any]:
+        """Measure cold-start time and per-worker memory, with and without a memory-mapped index"""
+        # Each worker is a fresh interpreter that imports the engine and loads the index
+        worker_script = (
+            "import json, os, time, psutil\n"
+            "start = time.perf_counter()\n"
+            "import query_engine\n"
+            "import_time = time.perf_counter() - start\n"
+            "query_engine.warm_up()\n"
+            "total = time.perf_counter() - start\n"
+            "mem = psutil.Process(os.getpid()).memory_full_info()\n"
+            "print(json.dumps({'import_s': import_time, 'ready_s': total,"
+            " 'rss_mb': mem.rss / 1024 / 1024, 'pss_mb': getattr(mem, 'pss', mem.rss) / 1024 / 1024}))\n"
+        )
+        backend_dir = os.path.dirname(os.path.abspath(__file__))
+        results = {}
+        
+        for mmap_setting in ("1", "0"):
+            env = dict(os.environ, INDEX_MMAP=mmap_setting)
+            procs = [
+                subprocess.Popen([sys.executable, "-c", worker_script], cwd=backend_dir, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                for _ in range(workers)
+            ]
+            samples = []
+            for proc in procs:
+                out, _ = proc.communicate()
+                lines = out.strip().splitlines()
+                if proc.returncode == 0 and lines:
+                    samples.append(json.loads(lines[-1]))
+            
+            label = "mmap" if mmap_setting == "1" else "in_memory"
+            if not samples:
+                results[label] = {"error": "Worker failed to start"}
+                continue
+            results[label] = {
+                "workers": len(samples),
+                "avg_import_s": float(np.mean([w["import_s"] for w in samples])),
+                "avg_ready_s": float(np.mean([w["ready_s"] for w in samples])),
+                "avg_rss_mb": float(np.mean([w["rss_mb"] for w in samples])),
+                "avg_pss_mb": float(np.mean([w["pss_mb"] for w in samples]))
+            }
+        
+        return results
+    
     def build_faiss_index(self, embeddings: np.ndarray, index_type: str = "IndexFlatL2") -> Tuple[Any, float, float]:
         """Build FAISS index and measure performance"""
         start_time = time.time()
@@ -152,6 +200,11 @@ class EmbeddingsBenchmark:
             else:
                 # Fallback to flat index if PQ parameters don't work
                 index = faiss.IndexFlatL2(dimension)
+        elif index_type in ("SQ8", "SQfp16"):
+            # Scalar-quantized storage; searched with exact re-ranking like the served index
+            index = index_store.build_index(embeddings, mode="sq8" if index_type == "SQ8" else "fp16")
+            build_time = time.time() - start_time
+            return index, build_time, self.measure_memory_usage() - start_memory
         else:
             raise ValueError(f"Unknown index type: {index_type}")
         
@@ -162,12 +215,13 @@ class EmbeddingsBenchmark:
         
         return index, build_time, memory_usage
     
-    def search_index(self, index: Any, query_embedding: np.ndarray, k: int = 3) -> Tuple[List[int], List[float], float]:
+    def search_index(self, index: Any, query_embedding: np.ndarray, k: int = 3,
+                     full_vectors: np.ndarray = None) -> Tuple[List[int], List[float], float]:
         """Search index and measure query time"""
         start_time = time.time()
         
         query_embedding = query_embedding.reshape(1, -1).astype('float32')
-        distances, indices = index.search(query_embedding, k)
+        distances, indices = index_store.search(index, query_embedding, k, full_vectors=full_vectors)
         
         query_time = time.time() - start_time
         
@@ -202,7 +256,21 @@ class EmbeddingsBenchmark:
         # Test different FAISS index types
         index_results = {}
         
-        for index_type in ["IndexFlatL2", "IndexFlatIP", "IndexHNSW", "IndexIVFFlat", "IndexLSH", "IndexPQ"]:
+        # Query embeddings are shared across index types; exact L2 results are the recall baseline
+        query_embeddings = []
+        for query in self.test_queries[:10]:  # Test subset for speed
+            if model_type == "openai":
+                query_emb = self.get_openai_embedding(query, model_config.get("model", "text-embedding-3-small"))
+            else:
+                query_emb = self.get_sentence_transformer_embedding(query, model_config.get("model", "all-MiniLM-L6-v2"))
+            if query_emb is not None:
+                query_embeddings.append(np.array(query_emb, dtype="float32"))
+        
+        exact_index = faiss.IndexFlatL2(embeddings.shape[1])
+        exact_index.add(embeddings.astype('float32'))
+        ground_truth = [set(self.search_index(exact_index, q, k=3)[0]) for q in query_embeddings]
+        
+        for index_type in ["IndexFlatL2", "IndexFlatIP", "IndexHNSW", "IndexIVFFlat", "IndexLSH", "IndexPQ", "SQ8", "SQfp16"]:
             try:
                 print(f"  Testing {index_type}...")
                 
@@ -212,28 +280,24 @@ class EmbeddingsBenchmark:
                 # Test queries
                 query_times = []
                 relevance_scores = []
+                recalls = []
+                full_vectors = embeddings.astype('float32') if index_type in ("SQ8", "SQfp16") else None
                 
-                for query in self.test_queries[:10]:  # Test subset for speed
-                    if model_type == "openai":
-                        query_emb = self.get_openai_embedding(query, model_config.get("model", "text-embedding-3-small"))
-                    else:
-                        query_emb = self.get_sentence_transformer_embedding(query, model_config.get("model", "all-MiniLM-L6-v2"))
-                    
-                    if query_emb is None:
-                        continue
-                    
-                    query_emb = np.array(query_emb)
-                    _, distances, query_time = self.search_index(index, query_emb, k=3)
+                for query_emb, expected in zip(query_embeddings, ground_truth):
+                    indices, distances, query_time = self.search_index(index, query_emb, k=3, full_vectors=full_vectors)
                     
                     query_times.append(query_time)
                     # Simple relevance score (inverse of average distance)
                     relevance_scores.append(1.0 / (np.mean(distances) + 1e-6))
+                    recalls.append(len(expected & set(indices)) / max(len(expected), 1))
                 
                 index_results[index_type] = {
                     "build_time": build_time,
                     "build_memory_mb": build_memory,
+                    "bytes_per_vector": float(index_store.bytes_per_vector(index)),
                     "avg_query_time_ms": np.mean(query_times) * 1000,
                     "avg_relevance_score": np.mean(relevance_scores),
+                    "recall_at_3": float(np.mean(recalls)) if recalls else 0.0,
                     "total_queries": len(query_times)
                 }
                 
@@ -245,9 +309,40 @@ class EmbeddingsBenchmark:
             "embedding_time": embedding_time,
             "embedding_dimension": embeddings.shape[1],
             "document_count": len(embeddings),
-            "index_results": index_results
+            "index_results": index_results,
+            "dimension_results": self.benchmark_search_dimensions(embeddings, query_embeddings, ground_truth)
         }
     
+    def benchmark_search_dimensions(self, embeddings: np.ndarray, query_embeddings: List[np.ndarray],
+                                    ground_truth: List[set]) -> Dict[str, Any]:
+        """Compare reduced-dimension first-pass search (with full re-scoring) at several prefix sizes"""
+        full_vectors = embeddings.astype('float32')
+        results = {}
+        
+        for dims in [64, 128, 256, 512, embeddings.shape[1]]:
+            if dims > embeddings.shape[1] or str(dims) in results:
+                continue
+            index = index_store.build_index(full_vectors, mode="flat", dimensions=dims)
+            query_times = []
+            recalls = []
+            coarse_recalls = []
+            
+            for query_emb, expected in zip(query_embeddings, ground_truth):
+                indices, _, query_time = self.search_index(index, query_emb, k=3, full_vectors=full_vectors)
+                coarse_indices, _, _ = self.search_index(index, query_emb, k=3)
+                query_times.append(query_time)
+                recalls.append(len(expected & set(indices)) / max(len(expected), 1))
+                coarse_recalls.append(len(expected & set(coarse_indices)) / max(len(expected), 1))
+            
+            results[str(dims)] = {
+                "bytes_per_vector": float(index_store.bytes_per_vector(index)),
+                "avg_query_time_ms": np.mean(query_times) * 1000 if query_times else 0.0,
+                "recall_at_3": float(np.mean(recalls)) if recalls else 0.0,
+                "coarse_recall_at_3": float(np.mean(coarse_recalls)) if coarse_recalls else 0.0
+            }
+        
+        return results
+    
     def run_benchmark(self) -> Dict[str, Any]:
         """Run complete benchmark suite"""
         print("Starting Embeddings Benchmark")
@@ -259,6 +354,9 @@ class EmbeddingsBenchmark:
         self.generate_test_queries()
         print(f"Generated {len(self.test_queries)} test queries")
         
+        print("\nMeasuring worker startup time and memory...")
+        startup_results = self.benchmark_startup()
+        
         # Define models to test
         models_to_test = [
             {
@@ -287,6 +385,7 @@ class EmbeddingsBenchmark:
             "timestamp": datetime.now().isoformat(),
             "document_count": len(self.documents),
             "test_query_count": len(self.test_queries),
+            "startup": startup_results,
             "models": {}
         }
         
@@ -317,6 +416,17 @@ class EmbeddingsBenchmark:
         print(f"Documents tested: {results['document_count']}")
         print(f"Test queries: {results['test_query_count']}")
         
+        if results.get("startup"):
+            print("\nWorker Startup:")
+            print(f"{'Index Load':<12} {'Import (s)':<12} {'Ready (s)':<12} {'RSS (MB)':<10} {'PSS (MB)':<10}")
+            print("-" * 56)
+            for label, startup in results["startup"].items():
+                if "error" in startup:
+                    print(f"{label:<12} ERROR: {startup['error']}")
+                else:
+                    print(f"{label:<12} {startup['avg_import_s']:<12.3f} {startup['avg_ready_s']:<12.3f} "
+                          f"{startup['avg_rss_mb']:<10.1f} {startup['avg_pss_mb']:<10.1f}")
+        
         for model_name, model_results in results["models"].items():
             print(f"\n{'-' * 60}")
             print(f"MODEL: {model_name}")
@@ -330,8 +440,8 @@ class EmbeddingsBenchmark:
             print(f"Total embedding time: {model_results['embedding_time']:.2f}s")
             
             print("\nFAISS Index Comparison:")
-            print(f"{'Index Type':<15} {'Build Time':<12} {'Memory (MB)':<12} {'Query Time (ms)':<15} {'Relevance':<10}")
-            print("-" * 70)
+            print(f"{'Index Type':<15} {'Build Time':<12} {'Memory (MB)':<12} {'Bytes/Vec':<10} {'Query Time (ms)':<15} {'Relevance':<10} {'Recall@3':<8}")
+            print("-" * 90)
             
             for index_type, index_results in model_results["index_results"].items():
                 if "error" in index_results:
@@ -339,8 +449,20 @@ class EmbeddingsBenchmark:
                 else:
                     print(f"{index_type:<15} {index_results['build_time']:.3f}s{'':<6} "
                           f"{index_results['build_memory_mb']:.1f}{'':<7} "
+                          f"{index_results['bytes_per_vector']:<10.0f} "
                           f"{index_results['avg_query_time_ms']:.2f}{'':<10} "
-                          f"{index_results['avg_relevance_score']:.3f}")
+                          f"{index_results['avg_relevance_score']:.3f}{'':<5} "
+                          f"{index_results['recall_at_3']:.3f}")
+            
+            if model_results.get("dimension_results"):
+                print("\nSearch Dimensions (first pass on prefix, re-scored at full dimension):")
+                print(f"{'Dims':<8} {'Bytes/Vec':<10} {'Query Time (ms)':<16} {'Coarse Recall@3':<16} {'Recall@3':<8}")
+                print("-" * 62)
+                for dims, dim_results in model_results["dimension_results"].items():
+                    print(f"{dims:<8} {dim_results['bytes_per_vector']:<10.0f} "
+                          f"{dim_results['avg_query_time_ms']:<16.3f} "
+                          f"{dim_results['coarse_recall_at_3']:<16.3f} "
+                          f"{dim_results['recall_at_3']:.3f}")
     
     def save_results(self, results: Dict[str, Any], filename: str = "benchmark_results.json"):
         """Save results to JSON file"""
@@ -1,49 +1,205 @@
+import argparse
 import faiss
 import json
 import numpy as np
 import pickle
-from openai import OpenAI
+from datetime import datetime
 from dotenv import load_dotenv
 import os
+import index_store
+import upstream
+import followups
+import dedup
+import attributes
+import related
+import snapshots
+import typeahead
+from config import get_index_paths
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# Load the documents
-with open("backend/data/ai_docs.json", "r") as f:
-    docs = json.load(f)
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Documents embedded per API call and written to the vector shard per step
+BATCH_SIZE = int(os.getenv("BUILD_BATCH_SIZE", "100"))
 
-texts = [doc["text"] for doc in docs]
-sources = [doc["source"] for doc in docs]
-ids = [doc["id"] for doc in docs]
+def count_documents(docs_path):
+    """Count JSONL documents without parsing them"""
+    with open(docs_path, "rb") as f:
+        return sum(1 for line in f if line.strip())
 
-# Generate embeddings using OpenAI
-print("Generating embeddings with OpenAI...")
-embeddings = []
+def iter_documents(docs_path, offset=0):
+    """Yield (document, end_offset) from a JSONL file, starting at a byte offset"""
+    with open(docs_path, "rb") as f:
+        f.seek(offset)
+        for line in iter(f.readline, b""):
+            end_offset = f.tell()
+            if line.strip():
+                yield json.loads(line), end_offset
 
-for i, text in enumerate(texts):
-    print(f"Embedding document {i+1}/{len(texts)}")
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    embeddings.append(response.data[0].embedding)
+def iter_batches(docs_path, offset, batch_size):
+    batch = []
+    for doc, end_offset in iter_documents(docs_path, offset):
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch, end_offset
+            batch = []
+    if batch:
+        yield batch, end_offset
 
-embeddings = np.array(embeddings)
+def embed_batch(texts, model=EMBEDDING_MODEL):
+    """Embed a batch of texts in one API call"""
+    response = upstream.create_embedding(texts, model=model, lane=upstream.BACKGROUND)
+    return np.array([item.embedding for item in sorted(response.data, key=lambda d: d.index)], dtype="float32")
 
-# Build the FAISS index
-print("Building index...")
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(np.array(embeddings))
+def load_checkpoint(checkpoint_path, docs_path, model=EMBEDDING_MODEL):
+    """Resume state for an interrupted build of the same input file and model"""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as f:
+        checkpoint = json.load(f)
+    source = os.stat(docs_path)
+    if checkpoint.get("docs_path") != os.path.abspath(docs_path) or checkpoint.get("docs_size") != source.st_size:
+        print("Input changed since the checkpoint was written; starting over")
+        return None
+    if checkpoint.get("model", EMBEDDING_MODEL) != model:
+        print("Embedding model changed since the checkpoint was written; starting over")
+        return None
+    return checkpoint
 
-# Get paths using persistent disk configuration
-from config import get_index_paths
-paths = get_index_paths()
+def save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def build(docs_path, batch_size=BATCH_SIZE, model=EMBEDDING_MODEL, index_dir=None):
+    """Stream documents into an on-disk vector shard, then build the index from it in batches.
+
+    Embedding keeps only one batch in memory; the index and metadata are held in full at the end.
+    The snapshot is published in index_dir (the serving index directory by default).
+    """
+    index_dir = index_dir or get_index_paths()["index_dir"]
+    os.makedirs(index_dir, exist_ok=True)
+    checkpoint_path = os.path.join(index_dir, "build_checkpoint.json")
+    shard_path = os.path.join(index_dir, "build_vectors.partial.npy")
+    rows_path = os.path.join(index_dir, "build_rows.partial.jsonl")
+
+    checkpoint = load_checkpoint(checkpoint_path, docs_path, model)
+    if checkpoint:
+        print(f"Resuming build at document {checkpoint['done']}/{checkpoint['total']}")
+    else:
+        checkpoint = {
+            "docs_path": os.path.abspath(docs_path),
+            "docs_size": os.stat(docs_path).st_size,
+            "model": model,
+            "total": count_documents(docs_path),
+            "dimension": None,
+            "done": 0,
+            "offset": 0,
+            "rows_offset": 0
+        }
+    total = checkpoint["total"]
+    if total == 0:
+        raise Exception("No documents found to build index")
+
+    shard = None
+    if checkpoint["dimension"]:
+        shard = np.load(shard_path, mmap_mode="r+")
+
+    # Drop any rows written after the last checkpoint
+    with open(rows_path, "ab") as rows_file:
+        rows_file.truncate(checkpoint["rows_offset"])
+
+    print("Generating embeddings with OpenAI...")
+    with open(rows_path, "a") as rows_file:
+        for batch, end_offset in iter_batches(docs_path, checkpoint["offset"], batch_size):
+            batch_texts = [doc["text"] for doc in batch]
+            vectors = embed_batch(batch_texts, model)
+            if followups.FOLLOWUP_PRECOMPUTE:
+                questions = followups.generate(batch_texts)
+            else:
+                questions = [[] for _ in batch]
+
+            if shard is None:
+                # The shard is sized once the embedding dimension is known
+                checkpoint["dimension"] = int(vectors.shape[1])
+                shard = np.lib.format.open_memmap(shard_path, mode="w+", dtype="float32",
+                                                  shape=(total, checkpoint["dimension"]))
+
+            done = checkpoint["done"]
+            shard[done:done + len(batch)] = vectors
+            shard.flush()
+            for doc, doc_questions in zip(batch, questions):
+                rows_file.write(json.dumps({"id": doc["id"], "source": doc["source"], "text": doc["text"],
+                                            "followups": doc_questions}) + "\n")
+            rows_file.flush()
+
+            checkpoint["done"] = done + len(batch)
+            checkpoint["offset"] = end_offset
+            checkpoint["rows_offset"] = rows_file.tell()
+            save_checkpoint(checkpoint_path, checkpoint)
+            print(f"Embedded {checkpoint['done']}/{total} documents")
+
+    # Build the FAISS index from the memory-mapped shard
+    print("Building index...")
+    vectors = shard[:checkpoint["done"]]
+    index = index_store.build_index(vectors, batch_size=batch_size * 100)
+
+    texts, sources, ids, questions = [], [], [], []
+    with open(rows_path, "r") as rows_file:
+        for line in rows_file:
+            row = json.loads(line)
+            texts.append(row["text"])
+            sources.append(row["source"])
+            ids.append(row["id"])
+            questions.append(row.get("followups", []))
+
+    # Everything else the server reads comes from the texts and the shard, with no API calls
+    print("Computing signatures, related documents and typeahead counts...")
+    signatures = dedup.signatures(texts)
+    related_graph = related.build_graph(index, vectors, full_vectors=vectors)
+    counts = typeahead.count(texts, sources)
+
+    # Save the index and metadata as a new snapshot; the shard becomes its full-precision vector file
+    snapshot = snapshots.SnapshotBuilder(index_dir)
+    faiss.write_index(index, snapshot.paths["vector_index"])
+    np.save(snapshot.paths["signatures"], signatures)
+    related.write(related_graph, snapshot.paths["related_graph"])
+    typeahead.write(counts, snapshot.paths["typeahead"])
+    shard.flush()
+    del shard, vectors
+    os.replace(shard_path, snapshot.paths["vectors"])
+    metadata = {"texts": texts, "ids": ids, "sources": sources,
+                "last_rebuilt": datetime.now().isoformat(), "total_documents": len(texts),
+                "index_mode": index_store.INDEX_MODE, "dimension": checkpoint["dimension"],
+                "search_dimensions": int(index.d), "followups": questions,
+                "embedding_model": model,
+                # Near-duplicates aren't collapsed here; the next rebuild does that
+                "dedup": dedup.make_stats(len(texts), len(texts)),
+                "attributes": attributes.build(ids, sources, {})}
+    with open(snapshot.paths["metadata"], "wb") as f:
+        pickle.dump(metadata, f)
+    snapshot.publish(metadata, kind="build", stats={"source": os.path.abspath(docs_path)})
+
+    os.remove(rows_path)
+    os.remove(checkpoint_path)
+    print(f"Index built and saved to snapshot {snapshot.snapshot_id} ({len(texts)} documents).")
 
-# Save the index and metadata
-faiss.write_index(index, paths["vector_index"])
-with open(paths["metadata"], "wb") as f:
-    pickle.dump({"texts": texts, "ids": ids, "sources": sources}, f)
+def main():
+    parser = argparse.ArgumentParser(description="Build the search index from a JSONL corpus")
+    parser.add_argument("docs", nargs="?", default="backend/data/ai_docs.jsonl",
+                        help="JSONL file with one {id, source, text} document per line")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Documents per embedding call")
+    parser.add_argument("--model", default=EMBEDDING_MODEL,
+                        help="Embedding model, e.g. to build a secondary index for shadow/A-B serving")
+    parser.add_argument("--index-dir", default=None,
+                        help="Index directory to publish into (default: the serving index); "
+                             "required with a non-default --model")
+    args = parser.parse_args()
+    # A secondary arm must not replace the index being served
+    if args.model != EMBEDDING_MODEL and not args.index_dir:
+        parser.error("--index-dir is required when --model differs from the serving model")
+    build(args.docs, batch_size=args.batch_size, model=args.model, index_dir=args.index_dir)
 
-print("Index built and saved.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Counter, Gauge, Histogram
+import deadlines
+
+POOL_QUEUE_DEPTH = Gauge(
+    "sidekick_pool_queue_depth", "Tasks waiting for a thread in each executor pool", labels=("pool",))
+POOL_ACTIVE_THREADS = Gauge(
+    "sidekick_pool_active_threads", "Threads currently running a task in each executor pool", labels=("pool",))
+POOL_UTILIZATION = Gauge(
+    "sidekick_pool_utilization", "Share of each executor pool's threads that are busy", labels=("pool",))
+POOL_QUEUE_WAIT_SECONDS = Histogram(
+    "sidekick_pool_queue_wait_seconds", "Time tasks spent queued before a thread picked them up", labels=("pool",))
+REQUESTS_SHED = Counter(
+    "sidekick_requests_shed_total", "Requests rejected at admission because they could not start before their deadline", labels=("pool",))
+
+class Overloaded(Exception):
+    """A pool's estimated queue wait is longer than the request has left"""
+
+    def __init__(self, pool, estimated_wait):
+        super().__init__(f"{pool} pool overloaded: estimated wait {estimated_wait:.2f}s")
+        self.pool = pool
+        self.estimated_wait = estimated_wait
+
+class Bulkhead:
+    """A fixed-size thread pool for one class of work, with queue depth and utilization tracking"""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        # Moving average of task run time, used to estimate queue wait
+        self.service_seconds = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"pool-{name}")
+        self._publish()
+
+    def _publish(self):
+        POOL_QUEUE_DEPTH.set(self.queued, pool=self.name)
+        POOL_ACTIVE_THREADS.set(self.active, pool=self.name)
+        POOL_UTILIZATION.set(self.active / self.size, pool=self.name)
+
+    def _run(self, submitted, fn, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self._publish()
+        POOL_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - submitted, pool=self.name)
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self.service_seconds = elapsed if self.completed == 1 else 0.8 * self.service_seconds + 0.2 * elapsed
+                self._publish()
+
+    def estimated_wait(self):
+        """Expected seconds before a newly submitted task starts running"""
+        with self._lock:
+            ahead = self.queued + self.active - self.size + 1
+            if ahead <= 0:
+                return 0.0
+            return ahead * self.service_seconds / self.size
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn on this pool, carrying over the caller's context variables"""
+        with self._lock:
+            self.queued += 1
+            self._publish()
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._run, time.perf_counter(), fn, args, kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn on this pool from the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    async def iterate(self, iterator):
+        """Drive a blocking iterator (e.g. a streaming response body) on this pool"""
+        done = object()
+        while True:
+            item = await self.run(next, iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "queued": self.queued,
+                "active": self.active,
+                "utilization": round(self.active / self.size, 3),
+                "completed": self.completed,
+                "avg_service_seconds": round(self.service_seconds, 4)
+            }
+
+# One pool per class of work, so a slow class can only exhaust its own threads
+QUERY = Bulkhead("query", int(os.getenv("QUERY_POOL_SIZE", "32")))
+TRANSCRIPTION = Bulkhead("transcription", int(os.getenv("TRANSCRIPTION_POOL_SIZE", "4")))
+ADMIN = Bulkhead("admin", int(os.getenv("ADMIN_POOL_SIZE", "8")))
+MAINTENANCE = Bulkhead("maintenance", int(os.getenv("MAINTENANCE_POOL_SIZE", "2")))
+# Mirrored retrievals against the index arm that didn't answer; never on the response path
+SHADOW = Bulkhead("shadow", int(os.getenv("SHADOW_POOL_SIZE", "2")))
+
+POOLS = {pool.name: pool for pool in (QUERY, TRANSCRIPTION, ADMIN, MAINTENANCE, SHADOW)}
+
+def admit(pool):
+    """Shed a request up front when it would still be queued at its deadline"""
+    left = deadlines.remaining()
+    if left is None:
+        return
+    estimated_wait = pool.estimated_wait()
+    if estimated_wait >= left:
+        REQUESTS_SHED.inc(pool=pool.name)
+        raise Overloaded(pool.name, estimated_wait)
+
+def run_in(pool, admission=False):
+    """Run a sync endpoint on the given pool instead of the shared default threadpool"""
+    def decorator(fn):
+        # wraps() keeps the original signature, which FastAPI uses for request parsing
+        @functools.wraps(fn)
+        async def endpoint(*args, **kwargs):
+            if admission:
+                admit(pool)
+            return await pool.run(fn, *args, **kwargs)
+        return endpoint
+    return decorator
+
+def get_stats():
+    return {name: pool.stats() for name, pool in POOLS.items()}
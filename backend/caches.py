@@ -0,0 +1,44 @@
+import threading
+from collections import OrderedDict
+from metrics import CACHE_HITS, CACHE_MISSES
+
+class LRUCache:
+    """Thread-safe bounded cache; hits and misses are counted under the cache's name"""
+
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            hit = key in self._entries
+            if hit:
+                self._entries.move_to_end(key)
+                value = self._entries[key]
+        if not hit:
+            CACHE_MISSES.inc(cache=self.name)
+            return default
+        CACHE_HITS.inc(cache=self.name)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
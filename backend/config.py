@@ -1,4 +1,5 @@
 import os
+import snapshots
 
 def get_index_directory():
     """
@@ -27,12 +28,15 @@ def get_index_directory():
     return index_dir
 
 def get_index_paths():
-    """Get the full paths for index files"""
+    """Get the full paths for index files
+    
+    Index files live in the snapshot named by index/CURRENT (or directly in the index
+    directory before the first snapshot); status, sessions and caches stay in the index directory.
+    """
     index_dir = get_index_directory()
     
     return {
         "index_dir": index_dir,
-        "vector_index": os.path.join(index_dir, "vector.index"),
-        "metadata": os.path.join(index_dir, "metadata.pkl"),
+        **snapshots.file_paths(snapshots.data_dir(index_dir)),
         "rebuild_status": os.path.join(index_dir, "rebuild_status.json")
     }
\ No newline at end of file
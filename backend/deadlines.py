@@ -0,0 +1,90 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from metrics import Counter
+
+# Budget for a /query request when the client doesn't send one; the UI stops waiting after ~8s
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("QUERY_DEADLINE_SECONDS", "8"))
+# Budget for a whole /query/batch request (admission and the shared retrieval); each item's
+# completion also gets its own DEFAULT_DEADLINE_SECONDS once it starts
+BATCH_DEADLINE_SECONDS = float(os.getenv("BATCH_QUERY_DEADLINE_SECONDS", "60"))
+# Remaining budget in milliseconds, set by clients that know how long they will wait
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+DEADLINES_EXCEEDED = Counter(
+    "sidekick_deadlines_exceeded_total", "Requests abandoned because their deadline passed", labels=("stage",))
+
+_deadline = contextvars.ContextVar("sidekick_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before or during the named stage"""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded at {stage}")
+        self.stage = stage
+
+def from_header(value, default=DEFAULT_DEADLINE_SECONDS):
+    """Deadline budget in seconds from the request header, falling back to the default"""
+    try:
+        budget = float(value) / 1000
+    except (TypeError, ValueError):
+        return default
+    return budget if budget > 0 else default
+
+def start(seconds):
+    """Set the deadline for the current context; returns a token for reset()"""
+    return _deadline.set(time.monotonic() + seconds)
+
+def reset(token):
+    _deadline.reset(token)
+
+def remaining():
+    """Seconds left before the current deadline, or None when there is no deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+@contextmanager
+def reserve(seconds):
+    """Run the block against a deadline `seconds` earlier, keeping that time for a fallback"""
+    deadline = _deadline.get()
+    if deadline is None:
+        yield
+        return
+    token = _deadline.set(deadline - seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+@contextmanager
+def own(seconds=DEFAULT_DEADLINE_SECONDS):
+    """Run the block against its own deadline `seconds` from now, never later than the current one"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(deadline, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+@contextmanager
+def detached():
+    """Run the block with no deadline, for background work that outlives the request"""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def expire(stage):
+    DEADLINES_EXCEEDED.inc(stage=stage)
+    raise DeadlineExceeded(stage)
+
+def check(stage):
+    """Stop work nobody will read: raise if the deadline passed before this stage"""
+    left = remaining()
+    if left is not None and left <= 0:
+        expire(stage)
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import re
+import numpy as np
+
+# Collapse near-duplicate chunks into one stored row at rebuild/ingest time
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+# Estimated Jaccard similarity of word shingles above which two chunks are treated as the same
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+SHINGLE_WORDS = 5
+
+# 128 permutations split into 16 LSH bands of 8 rows: pairs above ~0.7 similarity almost always
+# share a band and are then checked against DEDUP_THRESHOLD
+NUM_PERM = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Fixed seed so signatures computed in different processes and builds are comparable
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_WORD = re.compile(r"\w+")
+
+def _shingles(text):
+    words = _WORD.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def signature(text):
+    """MinHash signature (NUM_PERM uint32 values) of a text's word shingles"""
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                       for shingle in _shingles(text)], dtype=np.uint64)
+    # Universal hashing (a*x + b mod p) applied to every shingle hash at once, one column per permutation
+    with np.errstate(over="ignore"):
+        permuted = ((hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+def signatures(texts):
+    if not texts:
+        return np.zeros((0, NUM_PERM), dtype=np.uint32)
+    return np.stack([signature(text) for text in texts])
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity from two signatures"""
+    return float(np.mean(sig_a == sig_b))
+
+class NearDuplicateIndex:
+    """LSH buckets over MinHash signatures of canonical rows"""
+
+    def __init__(self, threshold=DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.signatures = {}
+        self._buckets = [{} for _ in range(BANDS)]
+
+    def _band_keys(self, sig):
+        return [sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes() for band in range(BANDS)]
+
+    def add(self, row, sig):
+        self.signatures[row] = sig
+        for band, key in enumerate(self._band_keys(sig)):
+            self._buckets[band].setdefault(key, []).append(row)
+
+    def find(self, sig):
+        """Most similar canonical row at or above the threshold, or None"""
+        candidates = set()
+        for band, key in enumerate(self._band_keys(sig)):
+            candidates.update(self._buckets[band].get(key, ()))
+        best, best_score = None, self.threshold
+        for row in candidates:
+            score = similarity(sig, self.signatures[row])
+            if score >= best_score:
+                best, best_score = row, score
+        return best
+
+    @classmethod
+    def from_signatures(cls, sigs):
+        index = cls()
+        for row, sig in enumerate(sigs):
+            index.add(row, sig)
+        return index
+
+def collapse(texts, sources, ids):
+    """Map near-duplicate chunks onto the first copy.
+
+    Returns (texts, sources, ids, aliases, signatures, stats) for the canonical rows, where
+    aliases[row] lists {"id", "source"} of every duplicate folded into that row.
+    """
+    index = NearDuplicateIndex()
+    kept_texts, kept_sources, kept_ids, aliases, kept_sigs = [], [], [], [], []
+    for text, source, doc_id in zip(texts, sources, ids):
+        sig = signature(text)
+        row = index.find(sig) if DEDUP_ENABLED else None
+        if row is None:
+            index.add(len(kept_ids), sig)
+            kept_texts.append(text)
+            kept_sources.append(source)
+            kept_ids.append(doc_id)
+            aliases.append([])
+            kept_sigs.append(sig)
+        else:
+            aliases[row].append({"id": doc_id, "source": source})
+    stats = make_stats(len(texts), len(kept_ids))
+    sigs = np.stack(kept_sigs) if kept_sigs else np.zeros((0, NUM_PERM), dtype=np.uint32)
+    return kept_texts, kept_sources, kept_ids, aliases, sigs, stats
+
+def make_stats(chunks_seen, unique_chunks):
+    duplicates = chunks_seen - unique_chunks
+    return {
+        "chunks_seen": chunks_seen,
+        "unique_chunks": unique_chunks,
+        "duplicates_collapsed": duplicates,
+        "dedup_ratio": round(duplicates / chunks_seen, 4) if chunks_seen else 0.0
+    }
+
+def load_signatures(path, texts):
+    """Stored signatures for the index rows, recomputed when missing or out of step with the metadata"""
+    if os.path.exists(path):
+        sigs = np.load(path)
+        if len(sigs) == len(texts):
+            return sigs
+        print("Stored MinHash signatures don't match the index rows; recomputing")
+    return signatures(texts)
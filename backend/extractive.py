@@ -0,0 +1,78 @@
+import math
+import os
+import re
+from collections import Counter
+
+# Sentences returned by an extractive answer
+EXTRACTIVE_SENTENCES = int(os.getenv("EXTRACTIVE_SENTENCES", "3"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[])")
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in into is it its
+just like more most not of on or our so some such than that the their them then there these they this to
+was we were what when where which who why will with would you your
+""".split())
+
+def split_sentences(text):
+    """Split text into sentences on terminal punctuation followed by a capitalized start"""
+    sentences = []
+    for paragraph in text.split("\n"):
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            sentence = sentence.strip()
+            if len(sentence.split()) >= 4:
+                sentences.append(sentence)
+    return sentences
+
+def _terms(text):
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+def rank_sentences(query, chunks):
+    """Score every sentence of the retrieved chunks against the query, best first"""
+    return rank_texts(query, [(rank, sentence) for rank, chunk in enumerate(chunks)
+                              for sentence in split_sentences(chunk["text"])])
+
+def rank_texts(query, texts):
+    """Score (chunk_rank, text) candidates by TF-IDF cosine similarity to the query.
+
+    Returns (score, chunk_rank, text) tuples, best first. IDF is taken over the candidates
+    themselves, and earlier (closer) chunks win ties.
+    """
+    candidates = [(rank, text, Counter(_terms(text))) for rank, text in texts]
+    if not candidates:
+        return []
+    chunk_count = max(rank for rank, _, _ in candidates) + 1
+
+    document_frequency = Counter()
+    for _, _, terms in candidates:
+        document_frequency.update(terms.keys())
+    idf = {term: math.log((1 + len(candidates)) / (1 + count)) + 1 for term, count in document_frequency.items()}
+
+    query_weights = {term: count * idf.get(term, 0.0) for term, count in Counter(_terms(query)).items()}
+    query_norm = math.sqrt(sum(weight * weight for weight in query_weights.values())) or 1.0
+
+    scored = []
+    for rank, text, terms in candidates:
+        weights = {term: count * idf[term] for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        dot = sum(weight * weights.get(term, 0.0) for term, weight in query_weights.items())
+        # Small prior for retrieval rank so the best chunk leads when nothing overlaps the query
+        score = dot / (query_norm * norm) + 0.01 * (chunk_count - rank)
+        scored.append((score, rank, text))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return scored
+
+def answer(query, chunks, max_sentences=EXTRACTIVE_SENTENCES):
+    """Answer from the retrieved chunks alone: the best-matching sentences and their sources"""
+    ranked = rank_sentences(query, chunks)[:max_sentences]
+    if not ranked:
+        if not chunks:
+            raise ValueError("No retrieved context to answer from")
+        # Chunks without usable sentences (fragments, lists): fall back to the top chunk's opening
+        return {"answer": " ".join(chunks[0]["text"].split()[:60]), "sources": [chunks[0]["source"]]}
+
+    sources = []
+    for _, rank, _ in ranked:
+        if chunks[rank]["source"] not in sources:
+            sources.append(chunks[rank]["source"])
+    return {"answer": " ".join(sentence for _, _, sentence in ranked), "sources": sources}
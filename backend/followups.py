@@ -0,0 +1,76 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import upstream
+
+# Generate follow-up questions for each chunk when the index is built or documents are ingested
+FOLLOWUP_PRECOMPUTE = os.getenv("FOLLOWUP_PRECOMPUTE", "1") == "1"
+FOLLOWUPS_PER_CHUNK = int(os.getenv("FOLLOWUPS_PER_CHUNK", "3"))
+# Chunks sent per chat call, and calls in flight at once (the upstream limiter still applies)
+FOLLOWUP_BATCH_SIZE = int(os.getenv("FOLLOWUP_BATCH_SIZE", "8"))
+FOLLOWUP_CONCURRENCY = int(os.getenv("FOLLOWUP_CONCURRENCY", "4"))
+# Characters of each chunk included in the generation prompt
+FOLLOWUP_CHUNK_CHARS = 2000
+
+def _batch_prompt(texts):
+    passages = "\n\n".join(f"Passage {n}:\n{text[:FOLLOWUP_CHUNK_CHARS]}" for n, text in enumerate(texts, start=1))
+    return f"""
+You are helping a student prepare for a conversation about the passages below.
+For each passage, write {FOLLOWUPS_PER_CHUNK} insightful follow-up questions someone could ask after hearing about it.
+
+{passages}
+
+Respond with only a JSON object mapping each passage number to a list of questions.
+Example: {{"1": ["Question?", "Question?"], "2": ["Question?"]}}
+"""
+
+def _parse_batch(content, count):
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").split("\n", 1)[-1]
+    parsed = json.loads(content)
+    questions = []
+    for n in range(1, count + 1):
+        items = parsed.get(str(n), [])
+        questions.append([str(item).strip() for item in items if str(item).strip()][:FOLLOWUPS_PER_CHUNK])
+    return questions
+
+def _generate_batch(texts):
+    try:
+        response = upstream.create_chat_completion([{"role": "user", "content": _batch_prompt(texts)}],
+                                                   model="gpt-3.5-turbo", lane=upstream.BACKGROUND)
+        return _parse_batch(response.choices[0].message.content, len(texts))
+    except Exception as e:
+        # Chunks without questions fall back to a live completion at query time
+        print(f"Follow-up generation failed for a batch of {len(texts)} chunks: {e}")
+        return [[] for _ in texts]
+
+def generate(texts, batch_size=FOLLOWUP_BATCH_SIZE):
+    """Follow-up questions for each text (a list per text, in order), several chunks per chat call"""
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    if not batches:
+        return []
+    with ThreadPoolExecutor(max_workers=min(FOLLOWUP_CONCURRENCY, len(batches)), thread_name_prefix="followups") as pool:
+        results = list(pool.map(_generate_batch, batches))
+    return [questions for batch in results for questions in batch]
+
+def precompute(texts, ids, previous_metadata=None):
+    """Questions for every chunk, generating only those not already stored for the same text"""
+    questions = reuse(previous_metadata or {}, texts, ids)
+    missing = [i for i, stored in enumerate(questions) if stored is None]
+    for i, generated in zip(missing, generate([texts[i] for i in missing])):
+        questions[i] = generated
+    print(f"Follow-up questions: generated for {len(missing)} chunks, reused for {len(texts) - len(missing)}")
+    return questions
+
+def reuse(metadata, texts, ids):
+    """Questions already stored for unchanged chunks, or None where they still need generating"""
+    previous = {}
+    for doc_id, text, questions in zip(metadata.get("ids", []), metadata.get("texts", []), metadata.get("followups") or []):
+        if questions:
+            previous[doc_id] = (text, questions)
+    reused = []
+    for doc_id, text in zip(ids, texts):
+        stored = previous.get(doc_id)
+        reused.append(stored[1] if stored and stored[0] == text else None)
+    return reused
@@ -0,0 +1,180 @@
+import os
+import pickle
+import random
+import threading
+import time
+import numpy as np
+from metrics import Counter, Histogram
+import bulkheads
+import deadlines
+import index_store
+import shards
+import snapshots
+import upstream
+
+# Directory with a second vector.index + metadata.pkl (e.g. built with another embedding model
+# or index mode); empty disables the secondary arm
+SECONDARY_INDEX_DIR = os.getenv("SECONDARY_INDEX_DIR", "")
+# shadow - the primary index answers; queries are mirrored to the secondary in the background
+# ab     - SECONDARY_AB_SHARE of queries are answered from the secondary; the other arm is mirrored
+SECONDARY_MODE = os.getenv("SECONDARY_MODE", "shadow")
+SECONDARY_AB_SHARE = float(os.getenv("SECONDARY_AB_SHARE", "0.1"))
+# Share of queries mirrored to the arm that didn't answer, and how many may wait for the shadow pool
+SHADOW_SAMPLE = float(os.getenv("SHADOW_SAMPLE", "1.0"))
+SHADOW_MAX_QUEUE = int(os.getenv("SHADOW_MAX_QUEUE", "32"))
+
+PRIMARY = "primary"
+SECONDARY = "secondary"
+
+ARM_RETRIEVAL_SECONDS = Histogram(
+    "sidekick_arm_retrieval_seconds", "Embedding and search time per index arm, when answering or mirrored",
+    labels=("arm", "role"))
+ARM_OVERLAP = Histogram(
+    "sidekick_arm_overlap", "Share of top-k document ids returned by both index arms for the same query",
+    buckets=(0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+ARM_ERRORS = Counter(
+    "sidekick_arm_errors_total", "Failed retrievals per index arm", labels=("arm", "role"))
+SHADOW_DROPPED = Counter(
+    "sidekick_shadow_dropped_total", "Mirrored retrievals skipped because the shadow pool was backed up")
+
+class IndexArm:
+    """An index and metadata loaded from their own directory, queried with their own embedding model"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        # A directory with snapshots serves its current one
+        paths = snapshots.file_paths(snapshots.data_dir(index_dir))
+        with open(paths["metadata"], "rb") as f:
+            self.metadata = pickle.load(f)
+        # Single-file or sharded, as its metadata describes
+        self.index = shards.read_index(paths["vector_index"], self.metadata, reader=index_store.read_index)
+        self.texts = self.metadata.get("texts", [])
+        self.sources = self.metadata.get("sources", [])
+        self.ids = self.metadata.get("ids", [])
+        self.model = self.metadata.get("embedding_model", "text-embedding-3-small")
+        self.full_vectors = None
+        if index_store.needs_full_vectors(self.metadata):
+            self.full_vectors = index_store.load_vectors(paths["vectors"])
+
+    def retrieve(self, query, k, lane=upstream.INTERACTIVE):
+        """Row numbers of the top-k chunks for a query"""
+        response = upstream.create_embedding(query, model=self.model, lane=lane)
+        query_vec = np.array([response.data[0].embedding], dtype="float32")
+        _, I = index_store.search(self.index, query_vec, k, full_vectors=self.full_vectors)
+        return [int(i) for i in I[0] if i >= 0]
+
+    def chunk(self, i):
+        return {"text": self.texts[i], "source": self.sources[i], "followups": []}
+
+    def describe(self):
+        return {
+            "index_dir": self.index_dir,
+            "embedding_model": self.model,
+            "index_mode": self.metadata.get("index_mode", "flat"),
+            "documents": len(self.texts)
+        }
+
+_lock = threading.Lock()
+_arm = None
+_load_error = None
+_stats = {}
+_overlap = {"count": 0, "total": 0.0}
+
+def get_arm():
+    """The secondary arm, loaded on first use; None when disabled or unloadable"""
+    global _arm, _load_error
+    if not SECONDARY_INDEX_DIR or _load_error:
+        return None
+    if _arm is None:
+        with _lock:
+            if _arm is None and not _load_error:
+                try:
+                    _arm = IndexArm(SECONDARY_INDEX_DIR)
+                    print(f"Loaded secondary index ({_arm.model}, {len(_arm.texts)} documents) for {SECONDARY_MODE} serving")
+                except Exception as e:
+                    _load_error = str(e)
+                    print(f"Error loading secondary index from {SECONDARY_INDEX_DIR}: {e}")
+    return _arm
+
+def enabled():
+    return get_arm() is not None
+
+def choose_arm():
+    """Arm that answers the current query"""
+    if SECONDARY_MODE == "ab" and random.random() < SECONDARY_AB_SHARE and get_arm() is not None:
+        return SECONDARY
+    return PRIMARY
+
+def record(arm, role, seconds):
+    ARM_RETRIEVAL_SECONDS.observe(seconds, arm=arm, role=role)
+    with _lock:
+        entry = _stats.setdefault((arm, role), {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+
+def mirror(query, k, served_arm, served_ids, retrieve_primary):
+    """Queue the other arm's retrieval for this query, off the response path.
+
+    retrieve_primary(query, k) returns the primary index's top-k document ids; it is only
+    called when the secondary arm answered.
+    """
+    if not enabled() or random.random() >= SHADOW_SAMPLE:
+        return False
+    # Shadow traffic is dropped rather than queued without bound when the secondary is slow
+    if bulkheads.SHADOW.queued >= SHADOW_MAX_QUEUE:
+        SHADOW_DROPPED.inc()
+        return False
+    shadow_arm = PRIMARY if served_arm == SECONDARY else SECONDARY
+    bulkheads.SHADOW.submit(_shadow, query, k, shadow_arm, served_ids, retrieve_primary)
+    return True
+
+def _shadow(query, k, arm, served_ids, retrieve_primary):
+    # The request may be long gone; only the upstream limiter's background lane applies
+    with deadlines.detached():
+        started = time.perf_counter()
+        try:
+            if arm == SECONDARY:
+                shadow_ids = [_arm.ids[i] for i in _arm.retrieve(query, k, lane=upstream.BACKGROUND)]
+            else:
+                shadow_ids = retrieve_primary(query, k)
+        except Exception as e:
+            ARM_ERRORS.inc(arm=arm, role="shadow")
+            print(f"Shadow retrieval on the {arm} index failed: {e}")
+            return
+        record(arm, "shadow", time.perf_counter() - started)
+
+    overlap = overlap_at_k(served_ids, shadow_ids)
+    ARM_OVERLAP.observe(overlap)
+    with _lock:
+        _overlap["count"] += 1
+        _overlap["total"] += overlap
+
+def overlap_at_k(a, b):
+    """Share of document ids the two result lists have in common"""
+    if not a and not b:
+        return 1.0
+    return len(set(a) & set(b)) / max(len(a), len(b))
+
+def get_stats():
+    """Configuration, per-arm retrieval latency and mean result overlap"""
+    arm = get_arm()
+    with _lock:
+        arms = {}
+        for (name, role), entry in sorted(_stats.items()):
+            arms.setdefault(name, {})[role] = {
+                "count": entry["count"],
+                "avg_seconds": round(entry["seconds"] / entry["count"], 4)
+            }
+        overlap = {
+            "compared": _overlap["count"],
+            "mean": round(_overlap["total"] / _overlap["count"], 4) if _overlap["count"] else None
+        }
+    return {
+        "mode": SECONDARY_MODE if arm is not None else "off",
+        "ab_share": SECONDARY_AB_SHARE if SECONDARY_MODE == "ab" else 0.0,
+        "shadow_sample": SHADOW_SAMPLE,
+        "secondary": arm.describe() if arm is not None else None,
+        "error": _load_error,
+        "arms": arms,
+        "overlap": overlap
+    }
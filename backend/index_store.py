@@ -0,0 +1,133 @@
+import faiss
+import numpy as np
+import os
+
+# Index storage mode used by rebuilds:
+#   flat - full-precision float32 vectors (IndexFlatL2)
+#   sq8  - int8 scalar-quantized vectors, ~4x smaller, re-ranked against full vectors
+#   fp16 - float16 scalar-quantized vectors, ~2x smaller, re-ranked against full vectors
+INDEX_MODE = os.getenv("INDEX_MODE", "flat")
+# First-pass candidates per requested result when re-ranking quantized search results
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+# Leading dimensions kept in the index for the coarse first pass (0 keeps all of them);
+# text-embedding-3 models are trained so a renormalized prefix is still a usable embedding
+SEARCH_DIMENSIONS = int(os.getenv("EMBEDDING_SEARCH_DIMS", "0"))
+
+# Rows used to train scalar quantizer ranges
+TRAIN_SAMPLE_SIZE = 100000
+
+_QUANTIZERS = {
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+    "fp16": faiss.ScalarQuantizer.QT_fp16
+}
+
+def truncate(vectors, dimensions):
+    """Keep the first `dimensions` components of each vector and renormalize to unit length"""
+    vectors = np.asarray(vectors, dtype="float32")
+    if not dimensions or dimensions >= vectors.shape[1]:
+        return np.ascontiguousarray(vectors)
+    prefix = np.ascontiguousarray(vectors[:, :dimensions])
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.maximum(norms, 1e-12)
+
+def needs_full_vectors(metadata):
+    """Whether an index built with this metadata is searched with full-vector re-scoring"""
+    dimension = metadata.get("dimension")
+    search_dimensions = metadata.get("search_dimensions", dimension)
+    return metadata.get("index_mode", "flat") != "flat" or search_dimensions != dimension
+
+def build_index(embeddings, mode=None, dimensions=None, batch_size=10000, ids=None, train_sample=None):
+    """Build a FAISS index over embeddings (an array or np.memmap), adding them in fixed-size batches.
+
+    With ids, rows are stored and returned under those ids (an IndexIDMap2) instead of their position.
+    train_sample overrides the rows quantizer ranges are learned from (shards share one sample).
+    """
+    mode = mode or INDEX_MODE
+    dimensions = SEARCH_DIMENSIONS if dimensions is None else dimensions
+    total = embeddings.shape[0]
+    dimension = min(dimensions or embeddings.shape[1], embeddings.shape[1])
+
+    if mode == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif mode in _QUANTIZERS:
+        index = faiss.IndexScalarQuantizer(dimension, _QUANTIZERS[mode], faiss.METRIC_L2)
+        # Learns per-dimension ranges for int8 from a bounded sample; a no-op for fp16
+        sample = embeddings[:TRAIN_SAMPLE_SIZE] if train_sample is None else train_sample
+        index.train(truncate(sample, dimensions))
+    else:
+        raise ValueError(f"Unknown index mode: {mode}")
+
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        ids = np.asarray(ids, dtype="int64")
+
+    # Only one batch is converted/truncated at a time, so memmapped input isn't copied whole; the
+    # index itself still grows with the rows added (all of them in memory for flat)
+    for start in range(0, total, batch_size):
+        batch = truncate(embeddings[start:start + batch_size], dimensions)
+        if ids is None:
+            index.add(batch)
+        else:
+            index.add_with_ids(batch, ids[start:start + batch_size])
+    return index
+
+def read_index(path, mmap=True):
+    """Read an index, memory-mapped and read-only when possible so processes share its pages"""
+    if mmap:
+        try:
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            return faiss.read_index(path, flags)
+        except Exception as e:
+            print(f"Memory-mapped index load failed, reading into memory: {e}")
+    return faiss.read_index(path)
+
+def save_vectors(embeddings, path):
+    """Persist full-precision vectors for exact re-ranking"""
+    np.save(path, np.ascontiguousarray(embeddings, dtype="float32"))
+
+def load_vectors(path):
+    """Memory-map full-precision vectors; only re-ranked rows are paged in"""
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+def bytes_per_vector(index):
+    """In-memory size of one stored vector"""
+    if isinstance(index, faiss.IndexFlatCodes):
+        return index.code_size
+    return faiss.serialize_index(index).nbytes / max(index.ntotal, 1)
+
+def rerank(query_vecs, candidate_ids, full_vectors, k):
+    """Re-score candidate rows with exact L2 distance against full-precision vectors"""
+    distances = np.full((len(query_vecs), k), np.inf, dtype="float32")
+    labels = np.full((len(query_vecs), k), -1, dtype="int64")
+
+    for row, (query_vec, candidates) in enumerate(zip(query_vecs, candidate_ids)):
+        candidates = candidates[candidates >= 0]
+        if len(candidates) == 0:
+            continue
+        # Sorted row order keeps mmap reads sequential
+        order = np.sort(candidates)
+        exact = np.asarray(full_vectors[order], dtype="float32")
+        row_distances = ((exact - query_vec) ** 2).sum(axis=1)
+        best = np.argsort(row_distances)[:k]
+        distances[row, :len(best)] = row_distances[best]
+        labels[row, :len(best)] = order[best]
+
+    return distances, labels
+
+def search(index, query_vecs, k, full_vectors=None, params=None):
+    """Search the index, re-scoring coarse candidates when full vectors are available.
+
+    params (faiss.SearchParameters) restricts the rows searched, e.g. to a metadata filter.
+    """
+    query_vecs = np.ascontiguousarray(query_vecs, dtype="float32")
+    # Reduced-dimension indexes are queried with the same truncated, renormalized prefix
+    coarse_vecs = truncate(query_vecs, index.d)
+    exact_first_pass = isinstance(index, faiss.IndexFlat) and index.d == query_vecs.shape[1]
+    if full_vectors is None or exact_first_pass:
+        return index.search(coarse_vecs, k, params=params)
+
+    candidates = min(index.ntotal, k * RERANK_FACTOR)
+    _, candidate_ids = index.search(coarse_vecs, candidates, params=params)
+    return rerank(query_vecs, candidate_ids, full_vectors, k)
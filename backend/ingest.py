@@ -0,0 +1,384 @@
+import faiss
+import json
+import numpy as np
+import os
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+from config import get_index_paths
+import index_store
+import upstream
+import followups
+import dedup
+import attributes
+import related
+import shards
+import snapshots
+import typeahead
+
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Chunk size/overlap in words for indexed interview documents
+CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "300"))
+CHUNK_OVERLAP_WORDS = int(os.getenv("CHUNK_OVERLAP_WORDS", "50"))
+# Texts per embedding API call
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+
+# Serializes writers of the on-disk index (ingest, deletes)
+index_write_lock = threading.Lock()
+
+# Follow-up questions for ingested rows are generated after the ingest is published, one job at a time
+_followup_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="followup-fill")
+
+def chunk_text(text, max_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP_WORDS):
+    """Split text into overlapping word windows; returns (chunks, word_count) in one pass over the words"""
+    words = text.split()
+    if len(words) <= max_words:
+        return ([text.strip()] if words else []), len(words)
+
+    step = max(max_words - overlap, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + max_words]))
+        if start + max_words >= len(words):
+            break
+    return chunks, len(words)
+
+def chunk_ids(doc_id, count):
+    """Index ids for a document's chunks; single-chunk documents keep the plain id"""
+    if count == 1:
+        return [doc_id]
+    return [f"{doc_id}#{n}" for n in range(count)]
+
+def embed_texts(texts, batch_size=EMBED_BATCH_SIZE):
+    """Embed texts with one API call per batch, preserving order"""
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        response = upstream.create_embedding(texts[start:start + batch_size], model=EMBEDDING_MODEL,
+                                             lane=upstream.BACKGROUND)
+        vectors.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+    return np.array(vectors, dtype="float32")
+
+def iter_jsonl(lines):
+    """Parse JSONL lines, yielding (line_number, document or None, error or None)"""
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+
+def plan_dedup(texts, sources, ids):
+    """Decide which new chunks need indexing; near-duplicates of stored or earlier chunks become aliases.
+
+    Returns (keep, signatures, aliases): positions in texts to embed and append, their MinHash
+    signatures, and {row: [{"id", "source"}]} for duplicates keyed by their canonical row number.
+    """
+    new_signatures = dedup.signatures(texts)
+    if not dedup.DEDUP_ENABLED:
+        return list(range(len(texts))), new_signatures, {}
+
+    paths = get_index_paths()
+    with open(paths["metadata"], "rb") as f:
+        existing_texts = pickle.load(f).get("texts", [])
+    lsh = dedup.NearDuplicateIndex.from_signatures(dedup.load_signatures(paths["signatures"], existing_texts))
+
+    keep, aliases = [], {}
+    for position, signature in enumerate(new_signatures):
+        row = lsh.find(signature)
+        if row is None:
+            lsh.add(len(existing_texts) + len(keep), signature)
+            keep.append(position)
+        else:
+            aliases.setdefault(row, []).append({"id": ids[position], "source": sources[position]})
+    return keep, new_signatures[keep], aliases
+
+def record_status(paths, metadata, manifest, kind=None):
+    """Bring the rebuild status file's document counts up to date with a snapshot published (or
+    activated) between rebuilds; kind defaults to the snapshot's own"""
+    status = {}
+    if os.path.exists(paths["rebuild_status"]):
+        with open(paths["rebuild_status"]) as f:
+            status = json.load(f)
+    interview_docs = sum(1 for row_id in metadata["ids"] if row_id.startswith("interview_"))
+    status.update({
+        "total_documents": len(metadata["ids"]),
+        "original_docs": len(metadata["ids"]) - interview_docs,
+        "interview_docs": interview_docs,
+        "dedup": metadata.get("dedup"),
+        "snapshot": manifest["snapshot"],
+        "last_update": manifest["created_at"] if kind is None else datetime.now().isoformat(),
+        "last_update_kind": kind or manifest["kind"]
+    })
+    with open(paths["rebuild_status"], "w") as f:
+        json.dump(status, f, indent=2)
+
+def schedule_followups(row_ids, texts, on_published=None):
+    """Generate follow-up questions for ingested rows in the background and publish them as a snapshot.
+
+    Runs on the background lane without holding index_write_lock while the chat calls are made;
+    on_published() is called after the snapshot is live (e.g. to reload the index).
+    """
+    return _followup_worker.submit(_fill_followups, list(row_ids), list(texts), on_published)
+
+def _fill_followups(row_ids, texts, on_published):
+    try:
+        questions = dict(zip(row_ids, zip(texts, followups.generate(texts))))
+        with index_write_lock:
+            paths = get_index_paths()
+            with open(paths["metadata"], "rb") as f:
+                metadata = pickle.load(f)
+            stored = metadata.get("followups") or [[] for _ in metadata.get("ids", [])]
+            filled = 0
+            # Rows may have moved or been deleted since the ingest; only unchanged ones are filled
+            for row, (row_id, text) in enumerate(zip(metadata.get("ids", []), metadata.get("texts", []))):
+                if row_id in questions and questions[row_id][0] == text:
+                    stored[row] = questions[row_id][1]
+                    filled += 1
+            if not filled:
+                return 0
+            metadata["followups"] = stored
+            snapshot = snapshots.SnapshotBuilder(paths["index_dir"], parent_dir=paths["snapshot_dir"])
+            try:
+                with open(snapshot.paths["metadata"], "wb") as f:
+                    pickle.dump(metadata, f)
+                snapshot.publish(metadata, kind="followups", stats={"rows_filled": filled})
+            except Exception:
+                snapshot.abort()
+                raise
+        if on_published:
+            on_published()
+        print(f"Follow-up questions filled in for {filled} ingested chunks")
+        return filled
+    except Exception as e:
+        # The rows answer followup mode with a live completion until the next rebuild
+        print(f"Follow-up generation for ingested chunks failed: {e}")
+        return 0
+
+class IndexAppend:
+    """Staged append to the on-disk index, written as a new snapshot; nothing is visible until commit()"""
+
+    def __init__(self, texts, sources, ids, vectors, followups=None, signatures=None, aliases=None, chunks_seen=None,
+                 interview_id=None, added_at=None):
+        self.paths = get_index_paths()
+        self.snapshot = None
+
+        with open(self.paths["metadata"], "rb") as f:
+            metadata = pickle.load(f)
+        existing_texts = metadata.get("texts", [])
+        existing_rows = len(existing_texts)
+        # Read fully (not memory-mapped) so the index can be modified; with shards, only the ones
+        # receiving rows are read into memory and rewritten
+        shard_count = (metadata.get("shards") or {}).get("count")
+        touched = set(int(shard) for shard in shards.assign(ids, shard_count)) if shard_count else set()
+        index = shards.read_index(self.paths["vector_index"], metadata, reader=faiss.read_index if not shard_count
+                                  else index_store.read_index, writable=touched)
+        if len(texts) and vectors.shape[1] != metadata.get("dimension", index.d):
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {metadata.get('dimension', index.d)}")
+
+        # Everything may have collapsed onto existing rows, leaving only aliases to record
+        related_graph = None
+        if len(texts):
+            if shard_count:
+                index.add_rows(index_store.truncate(vectors, index.d), range(existing_rows, existing_rows + len(texts)), ids)
+            else:
+                index.add(index_store.truncate(vectors, index.d))
+            # Indexes without a stored graph get one at the next rebuild
+            related_graph = related.load(self.paths["related_graph"], existing_rows)
+            if related_graph is not None:
+                stored_vectors = index_store.load_vectors(self.paths["vectors"])
+                related_graph = related.add_rows(related_graph, index, vectors, existing_rows, stored_vectors=stored_vectors)
+        if aliases or metadata.get("aliases") is not None:
+            # Row-aligned like texts; duplicates of any row, old or new, are attributed to it
+            merged = [list(row_aliases) for row_aliases in (metadata.get("aliases") or [[] for _ in range(existing_rows)])]
+            merged.extend([] for _ in texts)
+            for row, entries in (aliases or {}).items():
+                merged[row].extend(entries)
+            metadata["aliases"] = merged
+        previous = metadata.get("dedup") or dedup.make_stats(existing_rows, existing_rows)
+        seen = previous["chunks_seen"] + (chunks_seen if chunks_seen is not None else len(texts))
+        metadata["dedup"] = dedup.make_stats(seen, existing_rows + len(texts))
+        if followups is not None or metadata.get("followups") is not None:
+            # Keep follow-up questions row-aligned; rows without any get an empty list
+            existing = metadata.get("followups") or [[] for _ in metadata.get("ids", [])]
+            metadata["followups"] = existing + list(followups or [[] for _ in texts])
+        if metadata.get("attributes") is not None:
+            # Indexes without stored attributes get them at the next rebuild
+            metadata["attributes"] = attributes.append(metadata["attributes"], ids, sources,
+                                                       [interview_id] * len(texts),
+                                                       [attributes.parse_time(added_at)] * len(texts))
+        metadata["texts"] = metadata.get("texts", []) + list(texts)
+        metadata["sources"] = metadata.get("sources", []) + list(sources)
+        metadata["ids"] = metadata.get("ids", []) + list(ids)
+        metadata["total_documents"] = len(metadata["ids"])
+        self.metadata = metadata
+        self.rows_added = len(texts)
+
+        # Changed files go to a new snapshot; unchanged ones (e.g. untouched shards) are linked from the current one
+        self.snapshot = snapshots.SnapshotBuilder(self.paths["index_dir"], parent_dir=self.paths["snapshot_dir"])
+        target = self.snapshot.paths
+        try:
+            if len(texts):
+                if shard_count:
+                    for shard in sorted(touched):
+                        faiss.write_index(index.shards[shard], shards.shard_path(target["snapshot_dir"], shard))
+                else:
+                    faiss.write_index(index, target["vector_index"])
+                if os.path.exists(self.paths["vectors"]):
+                    self._append_vectors(target["vectors"], vectors)
+                elif index_store.needs_full_vectors(metadata):
+                    raise ValueError("Full-precision vectors are missing; rebuild the index")
+            if related_graph is not None:
+                related.write(related_graph, target["related_graph"])
+            if signatures is not None:
+                self._write_signatures(target["signatures"], existing_texts, signatures)
+            # Indexes without stored typeahead counts get them at the next rebuild
+            counts = typeahead.load_counts(self.paths["typeahead"])
+            if counts is not None:
+                alias_sources = [alias["source"] for entries in (aliases or {}).values() for alias in entries]
+                typeahead.write(typeahead.count(texts, list(sources) + alias_sources, counts), target["typeahead"])
+            self._write_metadata(target["metadata"])
+        except Exception:
+            self.abort()
+            raise
+
+    def _append_vectors(self, path, vectors, copy_rows=10000):
+        existing = np.load(self.paths["vectors"], mmap_mode="r")
+        combined = np.lib.format.open_memmap(path, mode="w+", dtype="float32",
+                                             shape=(existing.shape[0] + len(vectors), existing.shape[1]))
+        for start in range(0, existing.shape[0], copy_rows):
+            end = min(start + copy_rows, existing.shape[0])
+            combined[start:end] = existing[start:end]
+        combined[existing.shape[0]:] = vectors
+        combined.flush()
+        del combined
+
+    def _write_signatures(self, path, existing_texts, signatures):
+        combined = np.concatenate([dedup.load_signatures(self.paths["signatures"], existing_texts), signatures])
+        np.save(path, combined)
+
+    def _write_metadata(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self.metadata, f)
+
+    def commit(self):
+        """Publish the snapshot: one pointer swap makes every file of the append visible at once"""
+        manifest = self.snapshot.publish(self.metadata, kind="ingest", stats={"rows_added": self.rows_added})
+        self.snapshot = None
+        record_status(self.paths, self.metadata, manifest)
+
+    def abort(self):
+        if self.snapshot:
+            self.snapshot.abort()
+            self.snapshot = None
+
+class IndexRemoval:
+    """Staged removal of index rows, written as a new snapshot; nothing is visible until commit().
+
+    Later rows move up to close the gap, so the index, full vectors, signatures, related graph and
+    every row-aligned metadata column are rewritten together.
+    """
+
+    def __init__(self, rows):
+        self.paths = get_index_paths()
+        self.snapshot = None
+
+        with open(self.paths["metadata"], "rb") as f:
+            metadata = pickle.load(f)
+        existing_texts = metadata.get("texts", [])
+        rows = sorted(set(int(row) for row in rows))
+        keep = np.ones(len(existing_texts), dtype=bool)
+        keep[rows] = False
+
+        # Read fully (not memory-mapped) so rows can be removed; shards after the first removed row are renumbered
+        index = shards.read_index(self.paths["vector_index"], metadata, reader=faiss.read_index,
+                                  writable=range((metadata.get("shards") or {}).get("count") or 0))
+        related_graph = related.load(self.paths["related_graph"], len(existing_texts))
+        if related_graph is not None:
+            # Rows that listed a removed one are searched again before the index is renumbered
+            stored_vectors = index_store.load_vectors(self.paths["vectors"])
+
+            def row_vectors(affected):
+                if stored_vectors is not None:
+                    return np.asarray(stored_vectors[affected], dtype="float32")
+                return np.vstack([index.reconstruct(int(row)) for row in affected])
+
+            related_graph = related.remove_rows(related_graph, rows, index, row_vectors)
+            related_graph = related.drop_rows(related_graph, keep)
+        if isinstance(index, shards.ShardedIndex):
+            touched = index.remove_rows(rows)
+        else:
+            index.remove_ids(np.asarray(rows, dtype="int64"))
+
+        # Duplicates folded into a removed row go with it
+        row_aliases = metadata.get("aliases") or [[] for _ in existing_texts]
+        removed_aliases = [alias for row in rows for alias in row_aliases[row]]
+        counts = typeahead.load_counts(self.paths["typeahead"])
+        if counts is not None:
+            counts = typeahead.discount([existing_texts[row] for row in rows],
+                                        [metadata["sources"][row] for row in rows] +
+                                        [alias["source"] for alias in removed_aliases], counts)
+
+        for key in ("texts", "sources", "ids", "followups", "aliases"):
+            if metadata.get(key) is not None:
+                metadata[key] = [value for value, kept in zip(metadata[key], keep) if kept]
+        if metadata.get("attributes") is not None:
+            metadata["attributes"] = {key: value[keep] if isinstance(value, np.ndarray) else value
+                                      for key, value in metadata["attributes"].items()}
+        previous = metadata.get("dedup") or dedup.make_stats(len(existing_texts), len(existing_texts))
+        metadata["dedup"] = dedup.make_stats(previous["chunks_seen"] - len(rows) - len(removed_aliases),
+                                             len(metadata["texts"]))
+        metadata["total_documents"] = len(metadata["ids"])
+        self.metadata = metadata
+        self.rows_removed = len(rows)
+
+        self.snapshot = snapshots.SnapshotBuilder(self.paths["index_dir"], parent_dir=self.paths["snapshot_dir"])
+        target = self.snapshot.paths
+        try:
+            if isinstance(index, shards.ShardedIndex):
+                for shard in touched:
+                    faiss.write_index(index.shards[shard], shards.shard_path(target["snapshot_dir"], shard))
+            else:
+                faiss.write_index(index, target["vector_index"])
+            if os.path.exists(self.paths["vectors"]):
+                self._write_vectors(target["vectors"], keep)
+            np.save(target["signatures"], dedup.load_signatures(self.paths["signatures"], existing_texts)[keep])
+            if related_graph is not None:
+                related.write(related_graph, target["related_graph"])
+            if counts is not None:
+                typeahead.write(counts, target["typeahead"])
+            with open(target["metadata"], "wb") as f:
+                pickle.dump(self.metadata, f)
+        except Exception:
+            self.abort()
+            raise
+
+    def _write_vectors(self, path, keep, copy_rows=10000):
+        existing = np.load(self.paths["vectors"], mmap_mode="r")
+        kept = np.lib.format.open_memmap(path, mode="w+", dtype="float32",
+                                         shape=(int(keep.sum()), existing.shape[1]))
+        position = 0
+        for start in range(0, existing.shape[0], copy_rows):
+            block = existing[start:start + copy_rows][keep[start:start + copy_rows]]
+            kept[position:position + len(block)] = block
+            position += len(block)
+        kept.flush()
+        del kept
+
+    def commit(self):
+        """Publish the snapshot with the rows removed"""
+        manifest = self.snapshot.publish(self.metadata, kind="delete", stats={"rows_removed": self.rows_removed})
+        self.snapshot = None
+        record_status(self.paths, self.metadata, manifest)
+
+    def abort(self):
+        if self.snapshot:
+            self.snapshot.abort()
+            self.snapshot = None
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from caches import LRUCache
+from config import get_index_paths
+from metrics import CACHE_HITS, CACHE_MISSES
+from singleflight import get_group
+import query_engine
+
+# Interview fields that paper suggestions depend on
+SUGGESTION_FIELDS = ("company", "role", "topics", "description")
+# Likely questions embedded and retrieved when an interview is created or opened
+WARMUP_MAX_QUERIES = int(os.getenv("INTERVIEW_WARMUP_MAX_QUERIES", "24"))
+# Interviews whose last warm-up is remembered, so reopening them doesn't warm again
+WARMUP_TRACKED = int(os.getenv("INTERVIEW_WARMUP_TRACKED", "1024"))
+
+suggestion_flight = get_group("suggest-papers")
+_lock = threading.Lock()
+_suggestions = None
+# Interview id -> (fields key, index generation) of its last warm-up
+_warmed = LRUCache("interview_warmup", WARMUP_TRACKED)
+# Background suggestion refreshes and cache warm-ups
+_worker = ThreadPoolExecutor(max_workers=2, thread_name_prefix="interview-warmup")
+
+def fields_key(interview):
+    """Hash of the fields suggestions are generated from"""
+    fields = {field: (interview.get(field) or "").strip() for field in SUGGESTION_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _suggestions_path():
+    return os.path.join(get_index_paths()["index_dir"], "paper_suggestions.json")
+
+def _load_suggestions():
+    global _suggestions
+    if _suggestions is None:
+        try:
+            with open(_suggestions_path(), "r") as f:
+                _suggestions = json.load(f)
+        except FileNotFoundError:
+            _suggestions = {}
+        except Exception as e:
+            print(f"Error loading cached paper suggestions: {e}")
+            _suggestions = {}
+    return _suggestions
+
+def _store_suggestions(interview_id, key, suggestions):
+    with _lock:
+        cache = _load_suggestions()
+        cache[interview_id] = {"key": key, "suggestions": suggestions, "generated_at": datetime.now().isoformat()}
+        try:
+            tmp_path = _suggestions_path() + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, _suggestions_path())
+        except Exception as e:
+            print(f"Error saving cached paper suggestions: {e}")
+
+def _cached_entry(interview_id):
+    with _lock:
+        return _load_suggestions().get(interview_id)
+
+def _generate(interview, key, generate):
+    result, cacheable = generate(interview)
+    if cacheable:
+        _store_suggestions(interview["id"], key, result["suggestions"])
+    return result
+
+def _refresh(interview, key, generate):
+    # Clicks and warm-ups for the same interview fields share one generation
+    return suggestion_flight.do((interview["id"], key), _generate, interview, key, generate)
+
+def _refresh_in_background(interview, key, generate):
+    def run():
+        try:
+            _refresh(interview, key, generate)
+        except Exception as e:
+            print(f"Background paper suggestion refresh failed for interview {interview['id']}: {e}")
+    _worker.submit(run)
+
+def get_suggestions(interview, generate):
+    """Paper suggestions for an interview, generated only when its fields change.
+
+    generate(interview) returns (result, cacheable). A stale entry is served immediately while
+    a fresh one is generated in the background.
+    """
+    key = fields_key(interview)
+    entry = _cached_entry(interview["id"])
+    if entry and entry["key"] == key:
+        CACHE_HITS.inc(cache="paper_suggestions")
+        return {"suggestions": entry["suggestions"], "cached": True}
+
+    CACHE_MISSES.inc(cache="paper_suggestions")
+    if entry:
+        _refresh_in_background(interview, key, generate)
+        return {"suggestions": entry["suggestions"], "cached": True, "stale": True}
+    return _refresh(interview, key, generate)
+
+def likely_queries(interview):
+    """Phrases a session for this interview is likely to start with: topics, role, company, document titles"""
+    queries = []
+    for phrase in re.split(r"[,;\n]", interview.get("topics") or ""):
+        phrase = phrase.strip()
+        if phrase:
+            queries.append(phrase)
+    for field in ("role", "company"):
+        if (interview.get(field) or "").strip():
+            queries.append(interview[field].strip())
+    queries.extend(doc["title"] for doc in interview.get("documents", []) if doc.get("title"))
+    return list(dict.fromkeys(queries))[:WARMUP_MAX_QUERIES]
+
+def warm_up(interview, generate):
+    """Start a background warm-up for an interview that was just created or opened"""
+    warm_key = (fields_key(interview), query_engine.index_generation)
+    with _lock:
+        if _warmed.get(interview["id"]) == warm_key:
+            return False
+        _warmed.put(interview["id"], warm_key)
+    _worker.submit(_warm_up, interview, generate, warm_key)
+    return True
+
+def _warm_up(interview, generate, warm_key):
+    try:
+        prefetched = query_engine.prefetch(likely_queries(interview))
+        print(f"Interview {interview['id']} warm-up: {prefetched} queries embedded and retrieved")
+    except Exception as e:
+        print(f"Interview warm-up retrieval failed for {interview['id']}: {e}")
+        # Let the next open try again
+        with _lock:
+            if _warmed.get(interview["id"]) == warm_key:
+                _warmed.put(interview["id"], None)
+
+    key = fields_key(interview)
+    entry = _cached_entry(interview["id"])
+    if not entry or entry["key"] != key:
+        try:
+            _refresh(interview, key, generate)
+        except Exception as e:
+            print(f"Interview warm-up suggestions failed for {interview['id']}: {e}")
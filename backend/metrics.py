@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond FAISS searches to multi-minute rebuilds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_registry = []
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, summed at render time
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = state
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+def get_resident_bytes():
+    """Current RSS of this process (Linux /proc, falling back to peak RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def render_metrics():
+    """Render every registered metric in Prometheus text exposition format"""
+    PROCESS_RESIDENT_BYTES.set(get_resident_bytes())
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# === Shared metrics ===
+
+QUERY_STAGE_SECONDS = Histogram(
+    "sidekick_query_stage_seconds", "Time spent in each stage of answer()", labels=("stage",))
+TRANSCRIBE_SECONDS = Histogram(
+    "sidekick_transcribe_seconds", "Time spent handling /transcribe")
+REBUILD_PHASE_SECONDS = Histogram(
+    "sidekick_rebuild_phase_seconds", "Time spent in each rebuild_index phase", labels=("phase",))
+
+CACHE_HITS = Counter(
+    "sidekick_cache_hits_total", "Requests served from a cache or a shared in-flight call", labels=("cache",))
+CACHE_MISSES = Counter(
+    "sidekick_cache_misses_total", "Requests that had to make their own upstream call", labels=("cache",))
+UPSTREAM_ERRORS = Counter(
+    "sidekick_upstream_errors_total", "Failed calls to OpenAI", labels=("operation",))
+MOCK_FALLBACKS = Counter(
+    "sidekick_mock_fallbacks_total", "Responses served from mock fallbacks", labels=("endpoint",))
+EXTRACTIVE_ANSWERS = Counter(
+    "sidekick_extractive_answers_total", "Answers built from retrieved sentences instead of a completion", labels=("reason",))
+INDEX_DOCUMENTS = Gauge(
+    "sidekick_index_documents", "Documents in the loaded search index")
+INDEX_VECTORS = Gauge(
+    "sidekick_index_vectors", "Vectors in the loaded FAISS index")
+INDEX_LOAD_SECONDS = Gauge(
+    "sidekick_index_load_seconds", "Time this worker spent loading the index and metadata")
+PROCESS_RESIDENT_BYTES = Gauge(
+    "sidekick_process_resident_bytes", "Resident set size of this worker")
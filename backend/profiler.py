@@ -0,0 +1,162 @@
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Shared secret for /admin endpoints (X-Admin-Token header); empty disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Upper bound on one profiling run, whether it is limited by time or by requests
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+# Functions listed in the top-functions summary
+PROFILE_TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP_FUNCTIONS", "25"))
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+# Requests to the profiler itself don't count towards a run's request limit
+PROFILE_PATH = "/admin/profile"
+
+# Innermost Python frames of threads that are waiting rather than working (idle pool workers,
+# the event loop's select); their samples are dropped
+_IDLE_FRAMES = {
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+_THREAD_NUMBER = re.compile(r"[_-]\d+$")
+_MAX_DEPTH = 200
+
+def authorized(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or "", ADMIN_TOKEN)
+
+def _label(code):
+    # Folded-stack frames are separated by ';', so it can't appear in a label
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+def _stack(frame):
+    """Frame labels from the outermost call in, or None when the thread is idle"""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+        return None
+    labels = []
+    while frame is not None and len(labels) < _MAX_DEPTH:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+class _Run:
+    """One profiling run: a thread sampling every other thread's stack at a fixed interval"""
+
+    def __init__(self, seconds, requests, interval):
+        self.seconds = seconds
+        self.requests = requests
+        self.interval = interval
+        self.requests_seen = 0
+        self.ticks = 0
+        self.stacks = Counter()
+        self.done = threading.Event()
+        self.started = time.perf_counter()
+        self.finished = None
+        # The thread that started the run just waits for it
+        self.caller = threading.get_ident()
+
+    def request_done(self, path):
+        if path.startswith(PROFILE_PATH):
+            return
+        self.requests_seen += 1
+        if self.requests and self.requests_seen >= self.requests:
+            self.done.set()
+
+    def sample(self):
+        me = threading.get_ident()
+        deadline = self.started + self.seconds
+        names = {}
+        while not self.done.is_set() and time.perf_counter() < deadline:
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = {thread.ident: _THREAD_NUMBER.sub("", thread.name) for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident in (me, self.caller):
+                    continue
+                stack = _stack(frame)
+                if stack is not None:
+                    self.stacks[(names.get(ident, "thread"),) + stack] += 1
+            self.ticks += 1
+            self.done.wait(self.interval)
+        self.finished = time.perf_counter()
+        self.done.set()
+
+    def report(self, top=PROFILE_TOP_FUNCTIONS):
+        busy = sum(self.stacks.values())
+        self_samples, total_samples = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            self_samples[stack[-1]] += count
+            # Recursive functions count once per sample
+            for label in set(stack[1:]):
+                total_samples[label] += count
+
+        def share(count):
+            return round(100.0 * count / busy, 1) if busy else 0.0
+
+        return {
+            "seconds": round(self.finished - self.started, 3),
+            "requests": self.requests_seen,
+            "interval_ms": self.interval * 1000,
+            "ticks": self.ticks,
+            "busy_samples": busy,
+            "top_functions": [{
+                "function": label,
+                "self_samples": count,
+                "self_pct": share(count),
+                "total_samples": total_samples[label],
+                "total_pct": share(total_samples[label])
+            } for label, count in self_samples.most_common(top)],
+            # Brendan Gregg's folded format (flamegraph.pl, speedscope, inferno), rooted at the thread pool
+            "folded": "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+        }
+
+_lock = threading.Lock()
+_run = None
+
+def profile(seconds=10.0, requests=0, interval_ms=5.0):
+    """Sample this worker's threads for `seconds`, or until `requests` more requests have finished
+    (with `seconds` as the time limit); blocks until done and returns the report.
+
+    Raises RuntimeError when a run is already in progress.
+    """
+    global _run
+    run = _Run(min(max(seconds, 0.1), PROFILE_MAX_SECONDS), max(requests, 0), max(interval_ms, 1.0) / 1000)
+    with _lock:
+        if _run is not None:
+            raise RuntimeError("A profiling run is already in progress")
+        _run = run
+    try:
+        sampler = threading.Thread(target=run.sample, name="profiler", daemon=True)
+        sampler.start()
+        sampler.join()
+    finally:
+        with _lock:
+            _run = None
+    return run.report()
+
+class RequestCounter:
+    """ASGI middleware counting finished requests for a run limited by requests.
+
+    Outside a run it only checks one global before passing the request on.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        run = _run
+        if run is None or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            run.request_done(scope["path"])
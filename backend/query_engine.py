@@ -1,57 +1,399 @@
-import faiss
 import pickle
 import numpy as np
 import os
-from openai import OpenAI
+import json
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from config import get_index_paths
+import sessions
+from singleflight import get_group
+from caches import LRUCache
+from metrics import EXTRACTIVE_ANSWERS, CACHE_HITS, CACHE_MISSES, INDEX_DOCUMENTS, INDEX_VECTORS, INDEX_LOAD_SECONDS
+import tracing
+import index_store
+import upstream
+import deadlines
+import extractive
+import related
+import index_arms
+import shards
+import attributes
+import snapshots
+import typeahead
 
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Memory-map the index so worker processes share its pages through the OS page cache
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") == "1"
+# Background warm-up: load the index and run a dummy search; optionally make one embedding call
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+WARMUP_EMBEDDING = os.getenv("WARMUP_EMBEDDING", "0") == "1"
+# Mode that answers from retrieved sentences only, with no completion
+EXTRACTIVE_MODE = "extractive"
+# Answer when retrieval found nothing, i.e. the filters matched no rows; no completion is made
+NO_MATCH_ANSWER = "No documents match these filters."
+# Time kept back from the completion's deadline so an extractive answer can still be returned
+EXTRACTIVE_RESERVE_SECONDS = float(os.getenv("EXTRACTIVE_RESERVE_MS", "300")) / 1000
+# Followup mode picks from questions precomputed per chunk; FOLLOWUP_LIVE=1 asks the model
+# instead, offering it those questions to refine
+FOLLOWUP_LIVE = os.getenv("FOLLOWUP_LIVE", "0") == "1"
+# Recently embedded texts and their retrieval results; interview warm-up pre-populates both
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+EMBEDDING_MODEL = "text-embedding-3-small"
 
-# Load index + metadata
-print("Loading index and metadata...")
+# Index + metadata are loaded lazily on first use (or by warm_up) rather than at import
+index = None
+# Full-precision vectors (memory-mapped) used to re-rank quantized search results
+full_vectors = None
+metadata = {}
+texts = []
+ids = []
+sources = []
+# Follow-up questions generated per chunk at build/ingest time (None for indexes built without them)
+followups = None
+# Other documents whose near-duplicate chunks were collapsed onto each row
+aliases = None
+# Precomputed nearest neighbours of every row (None until a rebuild has stored them)
+related_graph = None
+rows_by_document = {}
+# Per-row source, doc type, interview and date columns searched by metadata filters
+row_attributes = None
+# Prefix index behind /suggest (None until a rebuild has stored its counts)
+suggester = None
+# Identifies the loaded index so cached/coalesced results never cross a rebuild
+index_generation = None
+load_error = None
+warmed_up = False
+_load_lock = threading.Lock()
 
-# Get paths using persistent disk configuration
-paths = get_index_paths()
-index_path = paths["vector_index"]
-meta_path = paths["metadata"]
+def _read_index(index_path):
+    return index_store.read_index(index_path, mmap=INDEX_MMAP)
 
-index = faiss.read_index(index_path)
-with open(meta_path, "rb") as f:
-    metadata = pickle.load(f)
+def load_index(force=False):
+    """Load index + metadata once per process; force=True reloads after a rebuild"""
+    global index, full_vectors, metadata, texts, ids, sources, followups, aliases, index_generation, load_error
+    global related_graph, rows_by_document, row_attributes, suggester
+    if index is not None and not force:
+        return index
 
-texts = metadata.get("texts", [])
-ids = metadata.get("ids", [])  
-sources = metadata.get("sources", [])
+    with _load_lock:
+        if index is not None and not force:
+            return index
 
-print(f"Loaded {len(texts)} documents from unified index")
-if "last_rebuilt" in metadata:
-    print(f"Index last rebuilt: {metadata['last_rebuilt']}")
+        print("Loading index and metadata...")
+        start = time.perf_counter()
+        try:
+            # Get paths using persistent disk configuration
+            paths = get_index_paths()
+            index_path = paths["vector_index"]
+            meta_path = paths["metadata"]
+
+            # Snapshots are checked against their manifest before anything is loaded from them
+            manifest = snapshots.load_manifest(paths["snapshot_dir"])
+            if manifest is not None:
+                snapshots.validate(paths["snapshot_dir"], manifest, checksums=snapshots.SNAPSHOT_VERIFY_CHECKSUMS)
+            with open(meta_path, "rb") as f:
+                new_metadata = pickle.load(f)
+            new_index = shards.read_index(index_path, new_metadata, reader=_read_index)
+            if manifest is not None:
+                snapshots.check_loaded(manifest, len(new_metadata.get("texts", [])), new_index.ntotal)
+            new_vectors = index_store.load_vectors(paths["vectors"]) if index_store.needs_full_vectors(new_metadata) else None
+            new_graph = related.load(paths["related_graph"], len(new_metadata.get("texts", [])))
+            counts = typeahead.load_counts(paths["typeahead"])
+            new_suggester = typeahead.Typeahead(counts) if counts is not None else None
+        except Exception as e:
+            load_error = str(e)
+            print(f"Error loading index: {e}")
+            raise
+
+        metadata = new_metadata
+        texts = metadata.get("texts", [])
+        ids = metadata.get("ids", [])
+        sources = metadata.get("sources", [])
+        followups = metadata.get("followups")
+        if followups is not None and len(followups) != len(texts):
+            print("Stored follow-up questions don't line up with the index; ignoring them")
+            followups = None
+        aliases = metadata.get("aliases")
+        if aliases is not None and len(aliases) != len(texts):
+            print("Stored duplicate aliases don't line up with the index; ignoring them")
+            aliases = None
+        row_attributes = metadata.get("attributes")
+        if row_attributes is None or len(row_attributes["doc_type"]) != len(texts):
+            # Source and type filters still work; interview and date filters need a rebuild
+            print("Index has no stored row attributes; deriving them from ids and sources")
+            row_attributes = attributes.build(ids, sources, {})
+        related_graph = new_graph
+        suggester = new_suggester
+        rows_by_document = {}
+        for row, row_id in enumerate(ids):
+            rows_by_document.setdefault(related.document_id(row_id), []).append(row)
+        # Every ingest, shard rebuild and rollback publishes a snapshot of its own
+        if manifest is not None:
+            index_generation = manifest["snapshot"]
+        else:
+            index_generation = metadata.get("last_rebuilt") or str(os.path.getmtime(index_path))
+        full_vectors = new_vectors
+        index = new_index
+        load_error = None
+        # Ingest appends rows without a new rebuild timestamp, so cached row ids are dropped on every load
+        retrieval_cache.clear()
+
+        INDEX_DOCUMENTS.set(len(texts))
+        INDEX_VECTORS.set(index.ntotal)
+        INDEX_LOAD_SECONDS.set(time.perf_counter() - start)
+
+        print(f"Loaded {len(texts)} documents from unified index")
+        if "last_rebuilt" in metadata:
+            print(f"Index last rebuilt: {metadata['last_rebuilt']}")
+        return index
+
+def reload_index():
+    """Swap in a freshly rebuilt index"""
+    global warmed_up
+    loaded = load_index(force=True)
+    # The new files are paged in too; a worker whose warm-up failed at boot (e.g. no index yet) becomes ready
+    _touch_index()
+    warmed_up = True
+    return loaded
+
+def _touch_index():
+    # A dummy search pages the vectors in and initializes FAISS internals
+    index.search(np.zeros((1, index.d), dtype="float32"), 1)
+
+def warm_up():
+    """Load the index and touch its pages so the first real query is fast"""
+    global warmed_up
+    try:
+        load_index()
+        _touch_index()
+        if WARMUP_EMBEDDING:
+            get_embedding("warm up")
+        warmed_up = True
+        print("Query engine warm-up complete")
+    except Exception as e:
+        print(f"Warm-up error: {e}")
+
+def get_readiness():
+    """Readiness details for the /readyz probe"""
+    ready = index is not None and (warmed_up or not WARMUP_ON_STARTUP)
+    return {
+        "ready": ready,
+        "index_loaded": index is not None,
+        "warmed_up": warmed_up,
+        "documents": len(texts),
+        "index_generation": index_generation,
+        "error": load_error
+    }
+
+# Concurrent identical requests share one upstream call
+embedding_flight = get_group("embedding")
+answer_flight = get_group("query")
+
+embedding_cache = LRUCache("embedding", EMBEDDING_CACHE_SIZE)
+retrieval_cache = LRUCache("retrieval", RETRIEVAL_CACHE_SIZE)
+
+def _cache_text(text):
+    # Transcribed phrases differ in spacing more often than in words
+    return " ".join(text.split())
+
+def _create_embedding(text, model):
+    response = upstream.create_embedding(text, model=model)
+    return np.array(response.data[0].embedding, dtype="float32")
 
 def get_embedding(text):
     """Get OpenAI embedding for text"""
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return np.array(response.data[0].embedding)
+    key = (EMBEDDING_MODEL, _cache_text(text))
+    vector = embedding_cache.get(key)
+    if vector is None:
+        vector = embedding_flight.do(key, _create_embedding, text, EMBEDDING_MODEL)
+        embedding_cache.put(key, vector)
+    return vector
+
+def get_embeddings(input_texts, lane=upstream.INTERACTIVE):
+    """Embed many texts with a single API call for those not already cached"""
+    keys = [(EMBEDDING_MODEL, _cache_text(text)) for text in input_texts]
+    vectors = [embedding_cache.get(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        response = upstream.create_embedding([input_texts[i] for i in missing], model=EMBEDDING_MODEL, lane=lane)
+        for i, item in zip(missing, sorted(response.data, key=lambda d: d.index)):
+            vectors[i] = np.array(item.embedding, dtype="float32")
+            embedding_cache.put(keys[i], vectors[i])
+    return np.array(vectors, dtype="float32")
+
+def _filter_key(filters):
+    return json.dumps(filters, sort_keys=True) if filters else None
+
+def _filter_params(filters):
+    """FAISS search parameters restricted to the rows matching filters; None when nothing matches"""
+    with tracing.stage("filter"):
+        mask = attributes.row_mask(row_attributes, filters)
+    matched = int(mask.sum())
+    tracing.annotate(filters=filters, filter_rows=matched)
+    return attributes.search_params(mask) if matched else None
+
+def get_rag_context(query, k=3, filters=None):
+    """Embed query and get top-k matching text chunks, optionally only among rows matching filters"""
+    load_index()
+    # The secondary arm has no row attributes, so filtered queries always use the primary
+    if not filters and index_arms.choose_arm() == index_arms.SECONDARY:
+        chunks = _secondary_context(query, k)
+        if chunks is not None:
+            return chunks
+
+    key = (index_generation, _cache_text(query), k, _filter_key(filters))
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        tracing.annotate(retrieval_cache="hit", retrieved_ids=[ids[i] for i in cached])
+        if not filters:
+            index_arms.mirror(query, k, index_arms.PRIMARY, [ids[i] for i in cached], _primary_ids)
+        return [_chunk(i) for i in cached]
+
+    params = None
+    if filters:
+        params = _filter_params(filters)
+        if params is None:
+            retrieval_cache.put(key, [])
+            return []
+
+    started = time.perf_counter()
+    with tracing.stage("embedding"):
+        query_vec = get_embedding(query)
+    with tracing.stage("search"):
+        D, I = index_store.search(index, np.array([query_vec]), k, full_vectors=full_vectors, params=params)
+    rows = [int(i) for i in I[0] if i >= 0]
+    retrieval_cache.put(key, rows)
+    tracing.annotate(retrieved_ids=[ids[i] for i in rows], distances=D[0].tolist())
+    if index_arms.enabled() and not filters:
+        index_arms.record(index_arms.PRIMARY, "served", time.perf_counter() - started)
+        index_arms.mirror(query, k, index_arms.PRIMARY, [ids[i] for i in rows], _primary_ids)
+    return [_chunk(i) for i in rows]
+
+def _secondary_context(query, k):
+    """Chunks from the secondary index arm (A/B serving), or None to fall back to the primary"""
+    arm = index_arms.get_arm()
+    started = time.perf_counter()
+    try:
+        with tracing.stage("secondary_retrieval"):
+            rows = arm.retrieve(query, k)
+    except deadlines.DeadlineExceeded:
+        raise
+    except Exception as e:
+        index_arms.ARM_ERRORS.inc(arm=index_arms.SECONDARY, role="served")
+        print(f"Secondary index retrieval failed, answering from the primary: {e}")
+        return None
+    index_arms.record(index_arms.SECONDARY, "served", time.perf_counter() - started)
+    tracing.annotate(index_arm=index_arms.SECONDARY, retrieved_ids=[arm.ids[i] for i in rows])
+    index_arms.mirror(query, k, index_arms.SECONDARY, [arm.ids[i] for i in rows], _primary_ids)
+    return [arm.chunk(i) for i in rows]
+
+def _primary_ids(query, k):
+    """Primary index top-k ids for a mirrored query (background lane, no retrieval cache)"""
+    query_vecs = get_embeddings([query], lane=upstream.BACKGROUND)
+    _, I = index_store.search(index, query_vecs, k, full_vectors=full_vectors)
+    return [ids[i] for i in I[0] if i >= 0]
+
+def prefetch(queries, k=3):
+    """Embed and retrieve likely queries ahead of time (background lane) so their first /query hits the caches"""
+    load_index()
+    generation = index_generation
+    pending = list(dict.fromkeys(query for query in queries
+                                 if (generation, _cache_text(query), k, None) not in retrieval_cache))
+    if not pending:
+        return 0
+    query_vecs = get_embeddings(pending, lane=upstream.BACKGROUND)
+    _, I = index_store.search(index, query_vecs, k, full_vectors=full_vectors)
+    for query, row in zip(pending, I):
+        retrieval_cache.put((generation, _cache_text(query), k, None), [int(i) for i in row if i >= 0])
+    return len(pending)
+
+def get_rag_contexts(queries, k=3, filters=None):
+    """Embed all queries in one call and retrieve their top-k chunks with one matrix search"""
+    load_index()
+    params = None
+    if filters:
+        params = _filter_params(filters)
+        if params is None:
+            return [[] for _ in queries]
+    with tracing.stage("embedding"):
+        query_vecs = get_embeddings(queries)
+    with tracing.stage("search"):
+        D, I = index_store.search(index, query_vecs, k, full_vectors=full_vectors, params=params)
+    return [[_chunk(i) for i in row if i >= 0] for row in I]
+
+def _chunk(i):
+    chunk = {"text": texts[i], "source": sources[i], "followups": followups[i] if followups else []}
+    if aliases and aliases[i]:
+        chunk["also_in"] = [alias["source"] for alias in aliases[i]]
+    return chunk
+
+def chunk_sources(chunks):
+    """Sources of the retrieved chunks, including documents whose duplicates were collapsed onto them"""
+    return [source for chunk in chunks for source in [chunk["source"]] + chunk.get("also_in", [])]
 
-def get_rag_context(query, k=3):
-    """Embed query and get top-k matching text chunks"""
-    query_vec = get_embedding(query)
-    D, I = index.search(np.array([query_vec]), k)
-    return [{"text": texts[i], "source": sources[i]} for i in I[0]]
+def similar_documents(document_id, k=related.RELATED_K):
+    """Documents related to a /corpus document, read from the precomputed graph (no embedding call).
 
+    Returns None for documents that aren't in the index; raises LookupError when no graph is stored.
+    """
+    load_index()
+    rows = rows_by_document.get(document_id)
+    if not rows:
+        return None
+    if related_graph is None:
+        raise LookupError("Related-documents graph has not been built; rebuild the index")
+    return related.similar(related_graph, rows, ids, sources, texts, k=k)
 
-def make_prompt(user_input, context_chunks, mode="explain", history=[]):
+def suggest(query, limit=typeahead.TYPEAHEAD_LIMIT):
+    """Completions for text being typed, from the prefix index (no embedding or upstream call).
+
+    Raises LookupError when the index has no stored typeahead counts.
+    """
+    load_index()
+    if suggester is None:
+        raise LookupError("Typeahead index has not been built; rebuild the index")
+    with typeahead.SUGGEST_SECONDS.time():
+        return suggester.suggest(query, limit=limit)
+
+def _row_vectors(rows):
+    if full_vectors is not None:
+        return np.asarray(full_vectors[rows], dtype="float32")
+    return np.vstack([index.reconstruct(int(row)) for row in rows])
+
+def remove_related(document_ids):
+    """Take deleted documents out of the related-documents graph and persist it; returns rows removed"""
+    global related_graph
+    if related_graph is None:
+        return 0
+    rows = [row for document_id in document_ids for row in rows_by_document.get(document_id, [])]
+    if not rows:
+        return 0
+    graph = related.remove_rows(related_graph, rows, index, _row_vectors)
+    paths = get_index_paths()
+    snapshot = snapshots.SnapshotBuilder(paths["index_dir"], parent_dir=paths["snapshot_dir"])
+    try:
+        related.write(graph, snapshot.paths["related_graph"])
+        snapshot.publish(kind="related_update", stats={"rows_removed": len(rows)})
+    except Exception:
+        snapshot.abort()
+        raise
+    related_graph = graph
+    return len(rows)
+
+
+def make_prompt(user_input, context_chunks, mode="explain", history=[], summary=""):
     context = "\n".join([chunk["text"] for chunk in context_chunks])
 
     #accounting for the historical q/a's and injects into the prompt
     history_str = ""
-    for prev in history[-3:]:
+    if summary:
+        history_str += f"\nSummary of earlier discussion: {summary}\n"
+    for prev in history[-sessions.RECENT_TURNS:]:
         history_str += f"\nQ: {prev['q']}\nA: {prev['a']}\n"
 
     if mode == "explain":
@@ -77,29 +419,194 @@ Here is some background info:
 
 Here is the previous discussion:
 {history_str}
-
+{_prepared_questions(context_chunks)}
 Suggest one insightful follow-up question they could ask.
 """
 
-def answer(user_input, mode="explain", history=None):
-    if history is None:
-        history = []
+def _prepared_questions(context_chunks):
+    questions = [question for chunk in context_chunks for question in chunk.get("followups", [])]
+    if not questions:
+        return ""
+    listed = "\n".join(f"- {question}" for question in questions)
+    return f"\nQuestions prepared for this background info (pick or refine one if it fits):\n{listed}\n"
+
+def complete(prompt):
+    """Run the chat completion for a prompt"""
+    with tracing.stage("completion"):
+        response = upstream.create_chat_completion([{"role": "user", "content": prompt}], model="gpt-3.5-turbo")
+
+    usage = getattr(response, "usage", None)
+    tracing.annotate(prompt_tokens=usage.prompt_tokens if usage else len(prompt) // 4)
+    return response.choices[0].message.content
+
+def answer_from_chunks(user_input, chunks, mode="explain", history=[], summary=""):
+    """Answer one mode from retrieved chunks.
 
-    chunks = get_rag_context(user_input)
-    prompt = make_prompt(user_input, chunks, mode=mode)
+    Runs the completion, or answers extractively when that mode is requested or the
+    completion fails or misses its deadline. With no chunks (filters that match no rows)
+    it answers NO_MATCH_ANSWER without calling the model.
+    """
+    if not chunks:
+        # Nothing to ground an answer in, whatever the mode
+        tracing.annotate(answer_type="no_match")
+        return {"answer": NO_MATCH_ANSWER, "sources": [], "answer_type": "no_match"}
+    if mode == EXTRACTIVE_MODE:
+        return _extractive_answer(user_input, chunks, reason="requested")
+    if mode == "followup" and not FOLLOWUP_LIVE:
+        picked = _pick_followup(user_input, chunks, history)
+        if picked:
+            return picked
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}]
-    )
+    try:
+        # The prompt stage checks the deadline too; passing it there also falls back
+        with tracing.stage("prompt"):
+            prompt = make_prompt(user_input, chunks, mode=mode, history=history, summary=summary)
+        with deadlines.reserve(EXTRACTIVE_RESERVE_SECONDS):
+            answer_text = complete(prompt)
+    except Exception as e:
+        reason = "deadline" if isinstance(e, deadlines.DeadlineExceeded) else "error"
+        print(f"Completion failed for mode {mode} ({e}); answering extractively")
+        return _extractive_answer(user_input, chunks, reason=reason)
 
     return {
-        "answer": response.choices[0].message.content,
-        "sources": [chunk["source"] for chunk in chunks]
+        "answer": answer_text,
+        "sources": chunk_sources(chunks),
+        "answer_type": "generated"
     }
 
+def _pick_followup(user_input, chunks, history):
+    """Best-matching precomputed question from the retrieved chunks, skipping ones already asked"""
+    with tracing.stage("followup_pick"):
+        asked = {turn.get("a", "").strip() for turn in history}
+        candidates = [(rank, question) for rank, chunk in enumerate(chunks)
+                      for question in chunk.get("followups", []) if question not in asked]
+        ranked = extractive.rank_texts(user_input, candidates)
+    if not ranked:
+        CACHE_MISSES.inc(cache="followups")
+        return None
+    CACHE_HITS.inc(cache="followups")
+    _, rank, question = ranked[0]
+    tracing.annotate(answer_type="precomputed")
+    return {"answer": question, "sources": [chunks[rank]["source"]], "answer_type": "precomputed"}
+
+def _extractive_answer(user_input, chunks, reason):
+    EXTRACTIVE_ANSWERS.inc(reason=reason)
+    tracing.annotate(answer_type="extractive", extractive_reason=reason)
+    with tracing.stage("extractive", enforce_deadline=False):
+        result = extractive.answer(user_input, chunks)
+    return {**result, "answer_type": "extractive"}
+
+def answer(user_input, mode="explain", history=None, conversation_id=None, filters=None):
+    if history is None:
+        history = []
+
+    load_index()
+    # Requests only coalesce when they would build the same prompt
+    context_key = conversation_id or json.dumps(history, sort_keys=True)
+    key = (user_input, mode, index_generation, context_key, _filter_key(filters))
+    # Requests coalesced onto a slower one stop waiting while there is still time to answer extractively
+    left = deadlines.remaining()
+    wait = None if left is None else max(left - EXTRACTIVE_RESERVE_SECONDS, 0)
+    result = answer_flight.do(key, _answer, user_input, mode, history, conversation_id, filters, timeout=wait)
+
+    # Recorded per request, outside the shared call, so a waiter that runs the call itself doesn't record it twice
+    if conversation_id:
+        sessions.record_turn(conversation_id, user_input, result["answer"])
+    return result
+
+def _answer(user_input, mode, history, conversation_id, filters=None):
+    token = tracing.start_trace(user_input, mode, index_generation=index_generation)
+    try:
+        result = _run_answer(user_input, mode, history, conversation_id, filters)
+    except Exception as e:
+        tracing.finish_trace(token, error=e)
+        raise
+    tracing.finish_trace(token)
+    return result
+
+def _resolve_history(history, conversation_id):
+    """Server-side sessions replace the client-sent history when a conversation id is given"""
+    if conversation_id:
+        # A new conversation starts empty; its first recorded turn creates the session
+        session = sessions.get_session(conversation_id) or {"turns": [], "summary": ""}
+        return session["turns"], session["summary"]
+    return history, ""
+
+def _run_answer(user_input, mode, history, conversation_id, filters=None):
+    history, summary = _resolve_history(history, conversation_id)
+
+    chunks = get_rag_context(user_input, filters=filters)
+    return answer_from_chunks(user_input, chunks, mode=mode, history=history, summary=summary)
+
+def iter_answer_modes(user_input, modes, history=None, conversation_id=None, filters=None):
+    """Retrieve once, then run each mode's completion concurrently.
+
+    Yields {"sources": [...]} first, then {"mode", "answer", "answer_type"} or {"mode", "error"}
+    as each completes.
+    """
+    load_index()
+    history, summary = _resolve_history(history or [], conversation_id)
+    chunks = get_rag_context(user_input, filters=filters)
+    yield {"sources": chunk_sources(chunks)}
+
+    answers = {}
+    with ThreadPoolExecutor(max_workers=len(modes), thread_name_prefix="mode-completion") as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, answer_from_chunks,
+                        user_input, chunks, mode, history, summary): mode
+            for mode in modes
+        }
+        for future in as_completed(futures):
+            mode = futures[future]
+            try:
+                result = future.result()
+                answers[mode] = result["answer"]
+                yield {"mode": mode, "answer": result["answer"], "answer_type": result["answer_type"]}
+            except Exception as e:
+                print(f"Completion error for mode {mode}: {e}")
+                yield {"mode": mode, "error": str(e)}
+
+    if conversation_id and answers:
+        sessions.record_turn(conversation_id, user_input,
+                             "\n".join(f"{mode}: {answers[mode]}" for mode in modes if mode in answers))
+
+def answer_modes(user_input, modes, history=None, conversation_id=None, filters=None):
+    """Answer several modes for one input, sharing retrieval; returns answers keyed by mode"""
+    token = tracing.start_trace(user_input, ",".join(modes), index_generation=index_generation)
+    result = {"answers": {}, "answer_types": {}, "errors": {}, "sources": []}
+    try:
+        for event in iter_answer_modes(user_input, modes, history=history, conversation_id=conversation_id,
+                                       filters=filters):
+            if "sources" in event:
+                result["sources"] = event["sources"]
+            elif "answer" in event:
+                result["answers"][event["mode"]] = event["answer"]
+                result["answer_types"][event["mode"]] = event["answer_type"]
+            else:
+                result["errors"][event["mode"]] = event["error"]
+    except Exception as e:
+        tracing.finish_trace(token, error=e)
+        raise
+    tracing.finish_trace(token)
+    return result
+
+def answer_batch(inputs, mode="explain", max_concurrency=4, filters=None):
+    """Answer many inputs: one embedding call, one search, then bounded-concurrency completions"""
+    contexts = get_rag_contexts(inputs, filters=filters)
 
+    def run(item):
+        user_input, chunks = item
+        try:
+            # Items queued behind max_concurrency don't spend their budget waiting
+            with deadlines.own():
+                return answer_from_chunks(user_input, chunks, mode=mode)
+        except Exception as e:
+            return {"error": str(e), "sources": chunk_sources(chunks)}
 
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="batch-query") as pool:
+        # Each item carries the request's context (deadline, trace); results stay in input order
+        futures = [pool.submit(contextvars.copy_context().run, run, item) for item in zip(inputs, contexts)]
+        return [future.result() for future in futures]
 
 # === CLI usage ===
 if __name__ == "__main__":
@@ -4,12 +4,22 @@ import numpy as np
 import pickle
 import os
 from datetime import datetime
+import time
 import uuid
-from openai import OpenAI
 from dotenv import load_dotenv
+from metrics import REBUILD_PHASE_SECONDS
+import index_store
+from ingest import chunk_text, chunk_ids, index_write_lock
+import upstream
+import followups
+import dedup
+import attributes
+import related
+import shards
+import snapshots
+import typeahead
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 def load_interviews():
     """Load interviews from JSON file"""
@@ -44,12 +54,19 @@ def get_all_documents():
             all_texts = metadata.get("texts", [])
             all_sources = metadata.get("sources", [])  
             all_ids = metadata.get("ids", [])
+            all_aliases = metadata.get("aliases") or [[] for _ in all_ids]
             
             for i, doc_id in enumerate(all_ids):
                 if not doc_id.startswith("interview_"):
                     texts.append(all_texts[i])
                     sources.append(all_sources[i])
                     ids.append(all_ids[i])
+                    # Corpus duplicates folded into this row come back as copies and collapse onto it again
+                    for alias in all_aliases[i]:
+                        if not alias["id"].startswith("interview_"):
+                            texts.append(all_texts[i])
+                            sources.append(alias["source"])
+                            ids.append(alias["id"])
             
             print(f"Loaded {len(texts)} original corpus documents")
         except Exception as e:
@@ -63,9 +80,12 @@ def get_all_documents():
     
     for interview_id, interview in interviews_data.items():
         for doc in interview.get("documents", []):
-            texts.append(doc["content"])
-            sources.append(f"{doc.get('source', doc['title'])} (Interview: {interview['title']})")
-            ids.append(f"interview_{doc['id']}")
+            # Chunked the same way as bulk ingest so ids stay stable across rebuilds
+            chunks, _ = chunk_text(doc["content"])
+            source = f"{doc.get('source', doc['title'])} (Interview: {interview['title']})"
+            texts.extend(chunks)
+            sources.extend([source] * len(chunks))
+            ids.extend(chunk_ids(f"interview_{doc['id']}", len(chunks)))
             interview_doc_count += 1
     
     print(f"Added {interview_doc_count} interview documents")
@@ -73,18 +93,45 @@ def get_all_documents():
     
     return texts, sources, ids
 
+def load_previous_metadata():
+    """Metadata of the index being replaced, so unchanged chunks keep their follow-up questions"""
+    from config import get_index_paths
+    meta_path = get_index_paths()["metadata"]
+    if not os.path.exists(meta_path):
+        return {}
+    try:
+        with open(meta_path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Error loading previous metadata: {e}")
+        return {}
+
 def rebuild_index(progress_callback=None):
-    """Rebuild the complete FAISS index with all documents"""
+    """Rebuild the complete FAISS index with all documents, published as a new snapshot"""
+    snapshot = None
+    started = time.perf_counter()
     try:
         if progress_callback:
             progress_callback(0, "Starting index rebuild...")
         
         # Get all documents
-        texts, sources, ids = get_all_documents()
+        with REBUILD_PHASE_SECONDS.time(phase="load_documents"):
+            texts, sources, ids = get_all_documents()
         
         if not texts:
             raise Exception("No documents found to build index")
         
+        # Near-duplicate chunks are embedded and indexed once, keeping every source as an alias
+        with REBUILD_PHASE_SECONDS.time(phase="dedup"):
+            texts, sources, ids, aliases, signatures, dedup_stats = dedup.collapse(texts, sources, ids)
+        print(f"Collapsed {dedup_stats['duplicates_collapsed']} near-duplicate chunks "
+              f"({dedup_stats['unique_chunks']} unique of {dedup_stats['chunks_seen']})")
+        
+        # Per-row source, type, interview and date columns for filtered search
+        previous_metadata = load_previous_metadata()
+        row_attributes = attributes.build(ids, sources, attributes.interview_documents(load_interviews()),
+                                          previous=previous_metadata)
+        
         if progress_callback:
             progress_callback(20, "Generating embeddings with OpenAI...")
         
@@ -92,27 +139,41 @@ def rebuild_index(progress_callback=None):
         print("Generating embeddings for all documents using OpenAI...")
         embeddings = []
         
-        for i, text in enumerate(texts):
-            if progress_callback and i % 10 == 0:
-                progress = 20 + int((i / len(texts)) * 50)  # 20-70% range
-                progress_callback(progress, f"Embedding document {i+1}/{len(texts)}")
-            
-            response = client.embeddings.create(
-                input=text,
-                model="text-embedding-3-small"
-            )
-            embeddings.append(response.data[0].embedding)
+        with REBUILD_PHASE_SECONDS.time(phase="embedding"):
+            for i, text in enumerate(texts):
+                if progress_callback and i % 10 == 0:
+                    progress = 20 + int((i / len(texts)) * 50)  # 20-70% range
+                    progress_callback(progress, f"Embedding document {i+1}/{len(texts)}")
+                
+                response = upstream.create_embedding(text, model="text-embedding-3-small", lane=upstream.BACKGROUND)
+                embeddings.append(response.data[0].embedding)
         
         embeddings = np.array(embeddings)
         
+        followup_questions = None
+        if followups.FOLLOWUP_PRECOMPUTE:
+            if progress_callback:
+                progress_callback(70, "Generating follow-up questions...")
+            with REBUILD_PHASE_SECONDS.time(phase="followups"):
+                followup_questions = followups.precompute(texts, ids, previous_metadata)
+        
         if progress_callback:
-            progress_callback(70, "Building FAISS index...")
+            progress_callback(78, "Building FAISS index...")
         
         # Build FAISS index
         print("Building FAISS index...")
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(np.array(embeddings))
+        with REBUILD_PHASE_SECONDS.time(phase="build_index"):
+            if shards.INDEX_SHARDS > 1:
+                index = shards.build(embeddings, ids, shards.INDEX_SHARDS)
+            else:
+                index = index_store.build_index(embeddings)
+        
+        if progress_callback:
+            progress_callback(82, "Computing related documents...")
+        
+        # Nearest neighbours of every row, so /corpus/{id}/similar is a lookup
+        with REBUILD_PHASE_SECONDS.time(phase="related"):
+            related_graph = related.build_graph(index, embeddings, full_vectors=embeddings)
         
         if progress_callback:
             progress_callback(85, "Saving index and metadata...")
@@ -121,33 +182,53 @@ def rebuild_index(progress_callback=None):
         from config import get_index_paths
         paths = get_index_paths()
         
-        index_dir = paths["index_dir"]
-        index_path = paths["vector_index"]
-        metadata_path = paths["metadata"]
-        
-        if os.path.exists(index_path):
-            backup_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_index_path = os.path.join(index_dir, f"vector.index.backup_{backup_time}")
-            backup_metadata_path = os.path.join(index_dir, f"metadata.pkl.backup_{backup_time}")
-            
-            print(f"Creating backup: {backup_index_path}")
-            os.rename(index_path, backup_index_path)
-            os.rename(metadata_path, backup_metadata_path)
+        # Everything is written to a new snapshot directory; the index being served (and
+        # earlier snapshots, for rollback) stay untouched until it is published
+        snapshot = snapshots.SnapshotBuilder(paths["index_dir"])
+        target = snapshot.paths
+        index_path = target["vector_index"]
+        metadata_path = target["metadata"]
         
         # Save new index and metadata
-        faiss.write_index(index, index_path)
-        
-        metadata = {
-            "texts": texts,
-            "sources": sources,
-            "ids": ids,
-            "last_rebuilt": datetime.now().isoformat(),
-            "total_documents": len(texts),
-            "embedding_model": "text-embedding-3-small"
-        }
+        with REBUILD_PHASE_SECONDS.time(phase="save"):
+            if isinstance(index, shards.ShardedIndex):
+                shards.write(index, target["snapshot_dir"])
+            else:
+                faiss.write_index(index, index_path)
+            index_store.save_vectors(embeddings, target["vectors"])
+            np.save(target["signatures"], signatures)
+            related.write(related_graph, target["related_graph"])
+            # Sources of collapsed duplicates are suggested too
+            typeahead.write(typeahead.count(texts, sources + [alias["source"] for row in aliases for alias in row]),
+                            target["typeahead"])
+            
+            metadata = {
+                "texts": texts,
+                "sources": sources,
+                "ids": ids,
+                "last_rebuilt": datetime.now().isoformat(),
+                "total_documents": len(texts),
+                "embedding_model": "text-embedding-3-small",
+                "index_mode": index_store.INDEX_MODE,
+                "dimension": int(embeddings.shape[1]),
+                "search_dimensions": int(index.d),
+                "followups": followup_questions,
+                "aliases": aliases,
+                "attributes": row_attributes,
+                "dedup": dedup_stats,
+                "shards": {"count": len(index.shards), "key": "document"} if isinstance(index, shards.ShardedIndex) else None
+            }
+            
+            with open(metadata_path, "wb") as f:
+                pickle.dump(metadata, f)
         
-        with open(metadata_path, "wb") as f:
-            pickle.dump(metadata, f)
+        # Not between an ingest reading the current snapshot and publishing its own on top of it
+        with REBUILD_PHASE_SECONDS.time(phase="publish"), index_write_lock:
+            manifest = snapshot.publish(metadata, kind="rebuild", stats={
+                "build_seconds": round(time.perf_counter() - started, 1),
+                "chunks_seen": dedup_stats["chunks_seen"],
+                "duplicates_collapsed": dedup_stats["duplicates_collapsed"]
+            })
         
         # Save rebuild status
         status_path = paths["rebuild_status"]
@@ -157,6 +238,8 @@ def rebuild_index(progress_callback=None):
             "total_documents": len(texts),
             "original_docs": len(texts) - sum(1 for id in ids if id.startswith("interview_")),
             "interview_docs": sum(1 for id in ids if id.startswith("interview_")),
+            "dedup": dedup_stats,
+            "snapshot": manifest["snapshot"],
             "rebuild_id": str(uuid.uuid4())
         }
         
@@ -168,20 +251,22 @@ def rebuild_index(progress_callback=None):
         
         print(f"Index rebuild completed successfully!")
         print(f"Total documents: {len(texts)}")
-        print(f"Index saved to: {index_path}")
-        print(f"Metadata saved to: {metadata_path}")
+        print(f"Index saved to snapshot: {snapshot.path}")
         
         return {
             "status": "success",
             "total_documents": len(texts),
-            "index_path": index_path,
-            "metadata_path": metadata_path,
+            "snapshot": manifest["snapshot"],
+            "index_path": snapshot.paths["vector_index"],
+            "metadata_path": snapshot.paths["metadata"],
             "rebuild_time": datetime.now().isoformat()
         }
         
     except Exception as e:
         error_msg = f"Index rebuild failed: {str(e)}"
         print(error_msg)
+        if snapshot:
+            snapshot.abort()
         
         # Save error status
         try:
@@ -0,0 +1,199 @@
+import os
+import faiss
+import numpy as np
+import index_store
+
+# Neighbours stored per row in the related-documents graph
+RELATED_K = int(os.getenv("RELATED_K", "10"))
+# Rows searched against the index per FAISS call while building the graph
+RELATED_BATCH_SIZE = int(os.getenv("RELATED_BATCH_SIZE", "1024"))
+# OpenMP threads FAISS uses for each batch while building (0 keeps FAISS's default, one per core)
+RELATED_THREADS = int(os.getenv("RELATED_THREADS", "0"))
+
+def _empty(rows, k):
+    return {
+        "neighbours": np.full((rows, k), -1, dtype="int64"),
+        "distances": np.full((rows, k), np.inf, dtype="float32"),
+        "removed": np.zeros(0, dtype="int64")
+    }
+
+def _search(index, query_vecs, query_rows, k, full_vectors=None, removed=()):
+    """Top-k neighbour rows of each query row, skipping the row itself and removed rows"""
+    removed = set(int(row) for row in removed)
+    # Over-fetch by enough to drop the row itself and every removed row and still have k left
+    fetch = min(index.ntotal, k + 1 + len(removed))
+    distances, labels = index_store.search(index, query_vecs, fetch, full_vectors=full_vectors)
+
+    result = _empty(len(query_rows), k)
+    for i, row in enumerate(query_rows):
+        kept = [(label, distance) for label, distance in zip(labels[i], distances[i])
+                if label >= 0 and label != row and label not in removed][:k]
+        if kept:
+            result["neighbours"][i, :len(kept)] = [label for label, _ in kept]
+            result["distances"][i, :len(kept)] = [distance for _, distance in kept]
+    return result["neighbours"], result["distances"]
+
+def build_graph(index, vectors, k=RELATED_K, full_vectors=None, batch_size=RELATED_BATCH_SIZE):
+    """k-nearest-neighbour graph of every stored row, searching the index against itself in batches"""
+    graph = _empty(len(vectors), k)
+    threads = faiss.omp_get_max_threads()
+    if RELATED_THREADS:
+        faiss.omp_set_num_threads(RELATED_THREADS)
+    try:
+        for start in range(0, len(vectors), batch_size):
+            rows = range(start, min(start + batch_size, len(vectors)))
+            batch = np.asarray(vectors[start:rows.stop], dtype="float32")
+            neighbours, distances = _search(index, batch, rows, k, full_vectors=full_vectors)
+            graph["neighbours"][start:rows.stop] = neighbours
+            graph["distances"][start:rows.stop] = distances
+    finally:
+        faiss.omp_set_num_threads(threads)
+    return graph
+
+def _insert(graph, row, neighbour, distance):
+    """Put neighbour into row's sorted list if it is closer than the current worst entry"""
+    distances = graph["distances"][row]
+    if distance >= distances[-1] or neighbour in graph["neighbours"][row]:
+        return
+    position = int(np.searchsorted(distances, distance))
+    graph["neighbours"][row, position + 1:] = graph["neighbours"][row, position:-1].copy()
+    graph["distances"][row, position + 1:] = distances[position:-1].copy()
+    graph["neighbours"][row, position] = neighbour
+    graph["distances"][row, position] = distance
+
+class _AppendedRows:
+    """Full vectors of the stored rows followed by the appended ones, indexed by row like one array"""
+
+    def __init__(self, stored_vectors, vectors, start_row):
+        self.stored_vectors = stored_vectors
+        self.vectors = vectors
+        self.start_row = start_row
+
+    def __getitem__(self, rows):
+        rows = np.asarray(rows)
+        result = np.empty((len(rows), self.vectors.shape[1]), dtype="float32")
+        stored = rows < self.start_row
+        result[stored] = self.stored_vectors[rows[stored]]
+        result[~stored] = self.vectors[rows[~stored] - self.start_row]
+        return result
+
+def add_rows(graph, index, vectors, start_row, stored_vectors=None, block_rows=10000):
+    """Extend the graph with rows appended to the index from start_row on.
+
+    New rows get their own neighbour lists, and each one is also inserted into the lists of
+    existing rows it is now closer to than their current furthest neighbour. Those are found
+    exactly by streaming stored_vectors (the existing rows' full vectors) when given; otherwise
+    only the existing rows in the new rows' own lists are considered. With stored_vectors, the
+    new rows' lists are re-scored against full vectors too, as build_graph does.
+    """
+    k = graph["neighbours"].shape[1]
+    vectors = np.asarray(vectors, dtype="float32")
+    rows = range(start_row, start_row + len(vectors))
+    full_vectors = None if stored_vectors is None else _AppendedRows(stored_vectors, vectors, start_row)
+    neighbours, distances = _search(index, vectors, rows, k, full_vectors=full_vectors, removed=graph["removed"])
+    graph = {
+        "neighbours": np.concatenate([graph["neighbours"], neighbours]),
+        "distances": np.concatenate([graph["distances"], distances]),
+        "removed": graph["removed"]
+    }
+
+    if stored_vectors is None:
+        for i, row in enumerate(rows):
+            for neighbour, distance in zip(neighbours[i], distances[i]):
+                if 0 <= neighbour < start_row:
+                    _insert(graph, neighbour, row, distance)
+        return graph
+
+    removed = set(int(row) for row in graph["removed"])
+    new_norms = (vectors ** 2).sum(axis=1)
+    for start in range(0, start_row, block_rows):
+        block = np.asarray(stored_vectors[start:min(start + block_rows, start_row)], dtype="float32")
+        # |a - b|^2 = |a|^2 + |b|^2 - 2ab, one matrix product per block
+        block_distances = ((block ** 2).sum(axis=1)[:, None] + new_norms[None, :]
+                           - 2 * block @ vectors.T)
+        worst = graph["distances"][start:start + len(block), -1]
+        for offset, i in zip(*np.nonzero(block_distances < worst[:, None])):
+            if start + offset not in removed:
+                _insert(graph, start + offset, rows[i], block_distances[offset, i])
+    return graph
+
+def remove_rows(graph, rows, index, row_vectors):
+    """Drop rows from the graph; rows that listed them are searched again to refill their lists.
+
+    Deleted documents stay in the index until the next rebuild, so removed rows are remembered
+    and skipped by later searches. row_vectors(rows) returns the stored vectors of those rows.
+    """
+    rows = np.unique(np.asarray(rows, dtype="int64"))
+    graph = {key: value.copy() for key, value in graph.items()}
+    graph["removed"] = np.union1d(graph["removed"], rows)
+    graph["neighbours"][rows] = -1
+    graph["distances"][rows] = np.inf
+
+    affected = np.flatnonzero(np.isin(graph["neighbours"], rows).any(axis=1))
+    if len(affected):
+        k = graph["neighbours"].shape[1]
+        neighbours, distances = _search(index, row_vectors(affected), affected, k, removed=graph["removed"])
+        graph["neighbours"][affected] = neighbours
+        graph["distances"][affected] = distances
+    return graph
+
+def drop_rows(graph, keep):
+    """The graph over the rows set in keep, renumbered to match the compacted index.
+
+    Neighbours that were dropped leave their lists, which close up and are padded with -1.
+    """
+    keep = np.asarray(keep, dtype=bool)
+    new_rows = np.cumsum(keep) - 1
+    neighbours = graph["neighbours"][keep]
+    distances = graph["distances"][keep]
+    valid = neighbours >= 0
+    valid[valid] = keep[neighbours[valid]]
+    # Kept entries move to the front of each list in their existing order
+    order = np.argsort(~valid, axis=1, kind="stable")
+    removed = graph["removed"][keep[graph["removed"]]]
+    return {
+        "neighbours": np.take_along_axis(np.where(valid, new_rows[np.maximum(neighbours, 0)], -1), order, axis=1),
+        "distances": np.take_along_axis(np.where(valid, distances, np.inf), order, axis=1).astype("float32"),
+        "removed": new_rows[removed].astype("int64")
+    }
+
+def write(graph, path):
+    # Through a file handle, since np.savez would add .npz to temp paths
+    with open(path, "wb") as f:
+        np.savez(f, **graph)
+
+def load(path, rows):
+    """The stored graph, or None when it is missing or doesn't cover the index's rows"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as stored:
+        graph = {key: stored[key] for key in ("neighbours", "distances", "removed")}
+    if len(graph["neighbours"]) != rows:
+        print("Stored related-documents graph doesn't match the index rows; ignoring it")
+        return None
+    return graph
+
+def document_id(row_id):
+    """The /corpus id of the document a row belongs to"""
+    if row_id.startswith("interview_"):
+        return row_id.split("#", 1)[0]
+    return f"corpus_{row_id}"
+
+def similar(graph, rows, ids, sources, texts, k=RELATED_K):
+    """Documents whose rows are nearest to any of the given rows, closest first"""
+    own = {document_id(ids[row]) for row in rows}
+    best = {}
+    for row in rows:
+        for neighbour, distance in zip(graph["neighbours"][row], graph["distances"][row]):
+            if neighbour < 0:
+                continue
+            doc_id = document_id(ids[neighbour])
+            if doc_id not in own and (doc_id not in best or distance < best[doc_id][0]):
+                best[doc_id] = (float(distance), int(neighbour))
+    ranked = sorted(best.items(), key=lambda item: item[1][0])[:k]
+    return [{
+        "id": doc_id,
+        "source": sources[neighbour],
+        "distance": round(distance, 6),
+        "preview": " ".join(texts[neighbour].split()[:40])
+    } for doc_id, (distance, neighbour) in ranked]
@@ -0,0 +1,150 @@
+import argparse
+import json
+import pickle
+import time
+import numpy as np
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+from config import get_index_directory
+from tracing import get_trace_path, load_traces
+import index_store
+import shards
+import snapshots
+import upstream
+
+load_dotenv()
+
+class TraceReplay:
+    """Re-run captured /query traces against an index and configuration"""
+
+    def __init__(self, index_dir: str, model: Optional[str] = None, k: int = 3):
+        self.index_dir = index_dir
+        self.model = model
+        self.k = k
+        self.index = None
+        self.full_vectors = None
+        self.ids = []
+
+    def load_index(self):
+        """Load the index and metadata under test (the current snapshot when the directory has them)"""
+        paths = snapshots.file_paths(snapshots.data_dir(self.index_dir))
+        with open(paths["metadata"], "rb") as f:
+            metadata = pickle.load(f)
+        # Loaded the way the server loads it: shards, reduced search dimensions and full vectors for re-ranking
+        self.index = shards.read_index(paths["vector_index"], metadata, reader=index_store.read_index)
+        self.full_vectors = index_store.load_vectors(paths["vectors"]) if index_store.needs_full_vectors(metadata) else None
+        self.ids = metadata.get("ids", [])
+        # Queries are embedded with the model the index was built with unless one is given
+        self.model = self.model or metadata.get("embedding_model", "text-embedding-3-small")
+        print(f"Loaded {len(self.ids)} documents from {self.index_dir}")
+
+    def replay_trace(self, trace: Dict[str, Any]) -> Dict[str, Any]:
+        """Embed and search one captured request, timing each stage"""
+        start = time.perf_counter()
+        # Background lane, so a large replay yields to live traffic under the shared rate limits
+        response = upstream.create_embedding(trace["text"], model=self.model, lane=upstream.BACKGROUND)
+        query_vec = np.array([response.data[0].embedding], dtype="float32")
+        embedding_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        D, I = index_store.search(self.index, query_vec, self.k, full_vectors=self.full_vectors)
+        search_ms = (time.perf_counter() - start) * 1000
+
+        replay_ids = [self.ids[i] for i in I[0] if i >= 0]
+        original_ids = trace.get("retrieved_ids", [])
+        overlap = len(set(original_ids) & set(replay_ids)) / len(original_ids) if original_ids else None
+
+        return {
+            "text": trace["text"],
+            "mode": trace.get("mode"),
+            "original_stages_ms": trace.get("stages_ms", {}),
+            "replay_stages_ms": {"embedding": embedding_ms, "search": search_ms},
+            "original_ids": original_ids,
+            "replay_ids": replay_ids,
+            "replay_distances": D[0].tolist(),
+            "overlap": overlap,
+            "same_order": original_ids == replay_ids
+        }
+
+    def run(self, traces: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self.load_index()
+        results = []
+        for i, trace in enumerate(traces):
+            print(f"Replaying trace {i+1}/{len(traces)}")
+            try:
+                results.append(self.replay_trace(trace))
+            except Exception as e:
+                results.append({"text": trace.get("text"), "error": str(e)})
+
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "index_dir": self.index_dir,
+            "model": self.model,
+            "k": self.k,
+            "trace_count": len(traces),
+            "summary": summarize(results),
+            "results": results
+        }
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compare original vs replayed latency and retrieval per stage"""
+    ok = [r for r in results if "error" not in r]
+    summary = {"replayed": len(ok), "errors": len(results) - len(ok), "stages": {}}
+    for stage in ("embedding", "search"):
+        summary["stages"][stage] = {
+            "original": _percentiles([r["original_stages_ms"][stage] for r in ok if stage in r["original_stages_ms"]]),
+            "replay": _percentiles([r["replay_stages_ms"][stage] for r in ok])
+        }
+    overlaps = [r["overlap"] for r in ok if r["overlap"] is not None]
+    summary["mean_overlap"] = float(np.mean(overlaps)) if overlaps else None
+    summary["same_order_rate"] = float(np.mean([r["same_order"] for r in ok])) if ok else None
+    return summary
+
+def print_summary(report: Dict[str, Any]):
+    summary = report["summary"]
+    print("\n" + "=" * 60)
+    print("TRACE REPLAY RESULTS")
+    print("=" * 60)
+    print(f"Index: {report['index_dir']}  Model: {report['model']}  k={report['k']}")
+    print(f"Replayed: {summary['replayed']}  Errors: {summary['errors']}")
+    print(f"\n{'Stage':<12} {'Orig p50':<10} {'Orig p95':<10} {'Replay p50':<11} {'Replay p95':<10}")
+    print("-" * 55)
+    for stage, values in summary["stages"].items():
+        original, replay = values["original"], values["replay"]
+        print(f"{stage:<12} {original.get('p50', 0):<10.2f} {original.get('p95', 0):<10.2f} "
+              f"{replay.get('p50', 0):<11.2f} {replay.get('p95', 0):<10.2f}")
+    if summary["mean_overlap"] is not None:
+        print(f"\nMean top-k overlap with captured results: {summary['mean_overlap']:.3f}")
+        print(f"Identical ranking rate: {summary['same_order_rate']:.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured /query traces against an index")
+    parser.add_argument("--traces", default=get_trace_path(), help="Trace log (rotated siblings are included)")
+    parser.add_argument("--index-dir", default=get_index_directory(), help="Directory with vector.index and metadata.pkl")
+    parser.add_argument("--model", default=None,
+                        help="Embedding model for replayed queries (default: the one recorded in the index)")
+    parser.add_argument("-k", type=int, default=3, help="Number of results to retrieve")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the most recent N traces")
+    parser.add_argument("--output", default="replay_results.json", help="Where to save the full report")
+    args = parser.parse_args()
+
+    traces = load_traces(args.traces)
+    if args.limit:
+        traces = traces[-args.limit:]
+    print(f"Loaded {len(traces)} traces from {args.traces}")
+
+    report = TraceReplay(args.index_dir, model=args.model, k=args.k).run(traces)
+    print_summary(report)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
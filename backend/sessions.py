@@ -0,0 +1,187 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from config import get_index_paths
+import upstream
+
+load_dotenv()
+
+# Number of raw Q/A turns kept verbatim; older turns are folded into the summary
+RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "3"))
+# Hard caps so prompt size stays constant however long a conversation runs
+SUMMARY_MAX_CHARS = int(os.getenv("SESSION_SUMMARY_MAX_CHARS", "1200"))
+TURN_MAX_CHARS = int(os.getenv("SESSION_TURN_MAX_CHARS", "600"))
+MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+# Modification time of sessions.json when this process last merged it
+_merged_mtime = None
+
+# A single worker keeps summary updates for a session in arrival order
+_summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-summary")
+
+def _sessions_path():
+    return os.path.join(get_index_paths()["index_dir"], "sessions.json")
+
+def _clip(text, limit):
+    text = (text or "").strip()
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+def _live(session):
+    """The session unless it is missing or a deletion marker"""
+    return None if session is None or session.get("deleted") else session
+
+def _merge_sessions():
+    """Fold in sessions other worker processes saved since the last merge; caller must hold _lock.
+
+    Every process keeps its own copy of the store, so a session is merged by its "updated"
+    time: the copy changed last wins, and deletions are kept as markers so they win too.
+    """
+    global _merged_mtime
+    path = _sessions_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return
+    if mtime == _merged_mtime:
+        return
+    try:
+        with open(path, "r") as f:
+            stored = json.load(f)
+    except Exception as e:
+        print(f"Error loading sessions: {e}")
+        return
+    _merged_mtime = mtime
+    for session_id, session in stored.items():
+        current = _sessions.get(session_id)
+        if current is None or session.get("updated", 0) > current.get("updated", 0):
+            _sessions[session_id] = session
+    while len(_sessions) > MAX_SESSIONS:
+        _sessions.popitem(last=False)
+
+def _save_sessions():
+    """Persist sessions compactly (summary + recent turns only), merged with what other workers saved"""
+    global _merged_mtime
+    try:
+        path = _sessions_path()
+        with open(path + ".lock", "w") as lock_file:
+            # One writer at a time, so a save never drops sessions another worker just wrote
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with _lock:
+                _merge_sessions()
+                snapshot = json.dumps(_sessions, separators=(",", ":"))
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(snapshot)
+            os.replace(tmp_path, path)
+            with _lock:
+                _merged_mtime = os.stat(path).st_mtime_ns
+    except Exception as e:
+        print(f"Error saving sessions: {e}")
+
+def _get_or_create(session_id):
+    """Return the live session dict; caller must hold _lock"""
+    _merge_sessions()
+    session = _live(_sessions.get(session_id))
+    if session is None:
+        session = {"summary": "", "turns": []}
+        _sessions[session_id] = session
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    _sessions.move_to_end(session_id)
+    return session
+
+def get_session(session_id):
+    """Get a copy of the summary and recent turns for a conversation, or None if there is none.
+
+    Only record_turn() creates sessions, so lookups for unknown ids don't fill the store.
+    """
+    with _lock:
+        _merge_sessions()
+        session = _live(_sessions.get(session_id))
+        if session is None:
+            return None
+        _sessions.move_to_end(session_id)
+        return {"summary": session["summary"], "turns": list(session["turns"])}
+
+def delete_session(session_id):
+    """Forget a conversation; returns True if it existed"""
+    with _lock:
+        _merge_sessions()
+        existed = _live(_sessions.get(session_id)) is not None
+        if existed:
+            _sessions[session_id] = {"deleted": True, "updated": time.time()}
+    if existed:
+        _save_sessions()
+    return existed
+
+def record_turn(session_id, question, answer_text):
+    """Append a Q/A turn and fold overflow turns into the summary in the background"""
+    turn = {"q": _clip(question, TURN_MAX_CHARS), "a": _clip(answer_text, TURN_MAX_CHARS)}
+    with _lock:
+        session = _get_or_create(session_id)
+        if session["turns"] and session["turns"][-1]["q"] == turn["q"]:
+            # The same question again (a retry, or concurrent duplicates of one request): keep one turn
+            session["turns"][-1] = turn
+            evicted = []
+        else:
+            session["turns"].append(turn)
+            evicted = session["turns"][:-RECENT_TURNS] if RECENT_TURNS > 0 else list(session["turns"])
+            session["turns"] = session["turns"][len(evicted):]
+        session["updated"] = time.time()
+
+    if evicted:
+        _summarizer.submit(_fold_into_summary, session_id, evicted)
+    else:
+        _summarizer.submit(_save_sessions)
+
+def _summarize(previous_summary, turns):
+    """Produce an updated rolling summary from the previous one plus new turns"""
+    transcript = "".join(f"\nQ: {t['q']}\nA: {t['a']}\n" for t in turns)
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key or api_key == "your-openai-api-key-here":
+        # No LLM available: keep the most recent text that fits the budget
+        return " ".join((previous_summary + " " + transcript).split())[-SUMMARY_MAX_CHARS:]
+
+    prompt = f"""
+You maintain a running summary of a conversation.
+
+Current summary:
+{previous_summary or "(empty)"}
+
+New exchanges:
+{transcript}
+
+Rewrite the summary to include the new exchanges. Keep the key topics, terms and questions.
+Use at most {SUMMARY_MAX_CHARS // 6} words.
+"""
+    response = upstream.create_chat_completion([{"role": "user", "content": prompt}], model="gpt-3.5-turbo",
+                                               lane=upstream.BACKGROUND)
+    return response.choices[0].message.content.strip()
+
+def _fold_into_summary(session_id, turns):
+    """Background task: merge evicted turns into the session summary"""
+    with _lock:
+        session = _live(_sessions.get(session_id))
+        previous_summary = session["summary"] if session else ""
+
+    try:
+        summary = _summarize(previous_summary, turns)
+    except Exception as e:
+        print(f"Session summary error for {session_id}: {e}")
+        summary = (previous_summary + " " + " ".join(f"Q: {t['q']} A: {t['a']}" for t in turns)).strip()[-SUMMARY_MAX_CHARS:]
+
+    with _lock:
+        session = _live(_sessions.get(session_id))
+        if session is not None:
+            session["summary"] = _clip(summary, SUMMARY_MAX_CHARS)
+            session["updated"] = time.time()
+
+    _save_sessions()
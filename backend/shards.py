@@ -0,0 +1,167 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from metrics import Histogram
+import index_store
+
+# Shards written by rebuilds (1 keeps the single vector.index layout). Every chunk of a document
+# lands in the same shard, chosen by a hash of the document id.
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "1"))
+# Threads searching shards concurrently; FAISS releases the GIL while it searches
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", "0")) or None
+
+SHARD_SEARCH_SECONDS = Histogram(
+    "sidekick_shard_search_seconds", "Time each shard took to answer a scattered search", labels=("shard",))
+
+_pool = None
+
+def _search_pool(count):
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS or count, thread_name_prefix="shard-search")
+    return _pool
+
+def shard_dir(index_dir):
+    return os.path.join(index_dir, "shards")
+
+def shard_path(index_dir, shard):
+    return os.path.join(shard_dir(index_dir), f"shard_{shard:03d}.index")
+
+def shard_of(row_id, count):
+    """Shard for an index row id; chunks (doc#n) follow their document"""
+    document = row_id.split("#", 1)[0]
+    digest = hashlib.blake2b(document.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % count
+
+def assign(row_ids, count):
+    return np.array([shard_of(row_id, count) for row_id in row_ids], dtype="int32")
+
+class ShardedIndex:
+    """Several FAISS indexes keyed by global row number, searched in parallel and merged into one top-k.
+
+    Offers the parts of the FAISS index interface the rest of the backend uses (search, ntotal,
+    d, reconstruct), so it can stand in for a single index.
+    """
+
+    def __init__(self, shards, index_dir=None):
+        self.shards = shards
+        self.index_dir = index_dir
+        self.d = shards[0].d
+        self._locate()
+
+    def _locate(self):
+        self.ntotal = sum(shard.ntotal for shard in self.shards)
+        self.row_shard = np.full(self.ntotal, -1, dtype="int32")
+        for number, shard in enumerate(self.shards):
+            self.row_shard[self.rows(number)] = number
+
+    def rows(self, shard):
+        """Global row numbers stored in a shard"""
+        return faiss.vector_to_array(self.shards[shard].id_map)
+
+    def _search_shard(self, number, query_vecs, k, params):
+        with SHARD_SEARCH_SECONDS.time(shard=str(number)):
+            return self.shards[number].search(query_vecs, k, params=params)
+
+    def search(self, query_vecs, k, params=None):
+        live = [number for number, shard in enumerate(self.shards) if shard.ntotal]
+        pool = _search_pool(len(self.shards))
+        # Selectors are over global row numbers, which each shard's id map translates
+        futures = [pool.submit(self._search_shard, number, query_vecs, min(k, self.shards[number].ntotal), params)
+                   for number in live]
+        results = [future.result() for future in futures]
+
+        distances = np.full((len(query_vecs), k), np.inf, dtype="float32")
+        labels = np.full((len(query_vecs), k), -1, dtype="int64")
+        if not results:
+            return distances, labels
+        merged_distances = np.concatenate([D for D, _ in results], axis=1)
+        merged_labels = np.concatenate([I for _, I in results], axis=1)
+        order = np.argsort(merged_distances, axis=1, kind="stable")[:, :k]
+        width = order.shape[1]
+        distances[:, :width] = np.take_along_axis(merged_distances, order, axis=1)
+        labels[:, :width] = np.take_along_axis(merged_labels, order, axis=1)
+        return distances, labels
+
+    def reconstruct(self, row):
+        return self.shards[self.row_shard[row]].reconstruct(int(row))
+
+    def add_rows(self, vectors, rows, row_ids):
+        """Add vectors under their global row numbers; returns the shards that changed"""
+        assignment = assign(row_ids, len(self.shards))
+        rows = np.asarray(rows, dtype="int64")
+        touched = sorted(set(int(shard) for shard in assignment))
+        for shard in touched:
+            selected = assignment == shard
+            self.shards[shard].add_with_ids(np.ascontiguousarray(vectors[selected]), rows[selected])
+        self._locate()
+        return touched
+
+    def remove_rows(self, rows):
+        """Remove rows and renumber the ones after them to close the gap, as the metadata rows shift;
+        returns the shards that changed"""
+        rows = np.unique(np.asarray(rows, dtype="int64"))
+        touched = []
+        for number, shard in enumerate(self.shards):
+            stored = faiss.vector_to_array(shard.id_map)
+            if not len(stored) or stored.max() < rows[0]:
+                continue
+            shard.remove_ids(rows)
+            stored = faiss.vector_to_array(shard.id_map)
+            faiss.copy_array_to_vector(stored - np.searchsorted(rows, stored), shard.id_map)
+            shard.construct_rev_map()
+            touched.append(number)
+        self._locate()
+        return touched
+
+def build(embeddings, row_ids, count, mode=None, dimensions=None):
+    """One index per shard over its rows' embeddings, each keyed by global row number"""
+    assignment = assign(row_ids, count)
+    # One training sample for every shard, so their quantized distances are comparable when merged
+    sample = embeddings[:index_store.TRAIN_SAMPLE_SIZE]
+    shards = []
+    for shard in range(count):
+        rows = np.flatnonzero(assignment == shard)
+        shards.append(index_store.build_index(embeddings[rows], mode=mode, dimensions=dimensions, ids=rows,
+                                              train_sample=sample))
+    return ShardedIndex(shards)
+
+def write(sharded, index_dir):
+    os.makedirs(shard_dir(index_dir), exist_ok=True)
+    for number, shard in enumerate(sharded.shards):
+        faiss.write_index(shard, shard_path(index_dir, number))
+    # Shards left over from a build with more of them
+    number = len(sharded.shards)
+    while os.path.exists(shard_path(index_dir, number)):
+        os.remove(shard_path(index_dir, number))
+        number += 1
+
+def read_index(index_path, metadata, reader=faiss.read_index, writable=()):
+    """The index described by the metadata: the single file at index_path, or its shards.
+
+    Shards listed in writable are read fully into memory so rows can be added to them; the
+    rest (and a single-file index) are loaded with reader.
+    """
+    count = (metadata.get("shards") or {}).get("count")
+    if not count:
+        return reader(index_path)
+    index_dir = os.path.dirname(index_path)
+    shards = [faiss.read_index(shard_path(index_dir, number)) if number in writable
+              else reader(shard_path(index_dir, number)) for number in range(count)]
+    return ShardedIndex(shards, index_dir=index_dir)
+
+def rebuild_shard(index_dir, target_dir, shard, metadata, full_vectors):
+    """Rebuild one shard from the stored full-precision vectors of its rows (no re-embedding),
+    writing it to target_dir"""
+    # Keep the index referenced while its id map is copied out
+    current = index_store.read_index(shard_path(index_dir, shard))
+    rows = np.sort(faiss.vector_to_array(current.id_map))
+    if full_vectors is None:
+        raise ValueError("Full-precision vectors are missing; rebuild the whole index")
+    rebuilt = index_store.build_index(full_vectors[rows], mode=metadata.get("index_mode"),
+                                      dimensions=metadata.get("search_dimensions"), ids=rows,
+                                      train_sample=full_vectors[:index_store.TRAIN_SAMPLE_SIZE])
+    faiss.write_index(rebuilt, shard_path(target_dir, shard))
+    return len(rows)
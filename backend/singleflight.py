@@ -0,0 +1,83 @@
+import threading
+from metrics import CACHE_HITS, CACHE_MISSES
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one upstream call"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, *args, timeout=None, **kwargs):
+        """Run fn once per in-flight key; concurrent callers wait and share its result.
+
+        A caller that has waited `timeout` seconds for the shared call stops waiting and runs fn itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            CACHE_HITS.inc(cache=f"inflight_{self.name}")
+            if not call.event.wait(timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return fn(*args, **kwargs)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        CACHE_MISSES.inc(cache=f"inflight_{self.name}")
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "wait_timeouts": self.timeouts,
+                "in_flight": len(self._calls)
+            }
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+def get_group(name):
+    """Get (or create) the named coalescing group"""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = SingleFlight(name)
+            _groups[name] = group
+        return group
+
+def get_stats():
+    """Per-group call and coalesced-request counts"""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
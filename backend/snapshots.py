@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+from datetime import datetime
+
+# Published snapshots kept on disk, newest first (the current one is always kept as well)
+SNAPSHOT_RETAIN = int(os.getenv("SNAPSHOT_RETAIN", "3"))
+# Re-hash every file against the manifest when loading; sizes and row counts are always checked
+SNAPSHOT_VERIFY_CHECKSUMS = os.getenv("SNAPSHOT_VERIFY_CHECKSUMS", "0") == "1"
+# Unpublished snapshot directories older than this were left by a crashed build and are removed
+SNAPSHOT_STALE_SECONDS = float(os.getenv("SNAPSHOT_STALE_SECONDS", "3600"))
+
+MANIFEST = "manifest.json"
+# Files that make up an index; a snapshot holds whichever of them its index uses, plus shards/
+DATA_FILES = ("vector.index", "metadata.pkl", "vectors.npy", "minhash.npy", "related.npz", "typeahead.pkl")
+SHARDS_DIR = "shards"
+
+def snapshots_dir(index_dir):
+    return os.path.join(index_dir, "snapshots")
+
+def snapshot_path(index_dir, snapshot_id):
+    return os.path.join(snapshots_dir(index_dir), snapshot_id)
+
+def _pointer(index_dir):
+    return os.path.join(index_dir, "CURRENT")
+
+def current_id(index_dir):
+    """Id of the published snapshot, or None for an index_dir still using the flat layout"""
+    try:
+        with open(_pointer(index_dir)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def data_dir(index_dir):
+    """Directory holding the index files: the current snapshot, or index_dir itself before the first one"""
+    snapshot_id = current_id(index_dir)
+    return snapshot_path(index_dir, snapshot_id) if snapshot_id else index_dir
+
+def file_paths(directory):
+    """Paths of the index files in a snapshot (or flat index) directory"""
+    return {
+        "snapshot_dir": directory,
+        "vector_index": os.path.join(directory, "vector.index"),
+        "metadata": os.path.join(directory, "metadata.pkl"),
+        "vectors": os.path.join(directory, "vectors.npy"),
+        "signatures": os.path.join(directory, "minhash.npy"),
+        "related_graph": os.path.join(directory, "related.npz"),
+        "typeahead": os.path.join(directory, "typeahead.pkl")
+    }
+
+def _data_files(directory):
+    """Relative paths of the index files present in directory"""
+    files = [name for name in DATA_FILES if os.path.isfile(os.path.join(directory, name))]
+    shard_dir = os.path.join(directory, SHARDS_DIR)
+    if os.path.isdir(shard_dir):
+        files.extend(os.path.join(SHARDS_DIR, name) for name in sorted(os.listdir(shard_dir))
+                     if name.endswith(".index"))
+    return files
+
+def _checksum(path, block_bytes=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_bytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def load_manifest(directory):
+    """The snapshot's manifest, or None for a flat index directory"""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def validate(directory, manifest, checksums=False):
+    """Raise ValueError unless every file listed in the manifest is present with its recorded size
+    (and, with checksums=True, its recorded content)"""
+    problems = []
+    for name, entry in manifest["files"].items():
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            problems.append(f"{name} is missing")
+        elif os.path.getsize(path) != entry["bytes"]:
+            problems.append(f"{name} is {os.path.getsize(path)} bytes, expected {entry['bytes']}")
+        elif checksums and _checksum(path) != entry["sha256"]:
+            problems.append(f"{name} checksum mismatch")
+    if problems:
+        raise ValueError(f"Snapshot {manifest['snapshot']} is damaged: {'; '.join(problems)}")
+
+def check_loaded(manifest, rows, vectors):
+    """Raise ValueError unless the loaded metadata rows and index vectors match the manifest"""
+    if rows != manifest["documents"] or vectors != manifest["documents"]:
+        raise ValueError(f"Snapshot {manifest['snapshot']} lists {manifest['documents']} documents, "
+                         f"but {rows} metadata rows and {vectors} index vectors were loaded")
+
+class SnapshotBuilder:
+    """A new snapshot being written; readers don't see it until publish() swaps the CURRENT pointer.
+
+    parent_dir is the directory of the index being extended (ingest, shard rebuilds): index files
+    not written to the builder are hard-linked from it at publish time. Files are never modified
+    in place once published, so snapshots can share them.
+    """
+
+    def __init__(self, index_dir, parent_dir=None):
+        self.index_dir = index_dir
+        self.parent_dir = parent_dir
+        self.snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        self.path = snapshot_path(index_dir, self.snapshot_id) + ".tmp"
+        os.makedirs(os.path.join(self.path, SHARDS_DIR))
+        self.paths = file_paths(self.path)
+
+    def _carry_parent_files(self):
+        for name in _data_files(self.parent_dir):
+            target = os.path.join(self.path, name)
+            if os.path.exists(target):
+                continue
+            try:
+                os.link(os.path.join(self.parent_dir, name), target)
+            except OSError:
+                shutil.copy2(os.path.join(self.parent_dir, name), target)
+
+    def publish(self, metadata=None, kind="rebuild", stats=None):
+        """Write the manifest, move the snapshot into place and make it current; returns the manifest.
+
+        metadata summarizes the snapshot in the manifest; it is read from the snapshot when not given.
+        """
+        if self.parent_dir:
+            self._carry_parent_files()
+        if metadata is None:
+            with open(self.paths["metadata"], "rb") as f:
+                metadata = pickle.load(f)
+
+        parent = load_manifest(self.parent_dir) if self.parent_dir else None
+        parent_files = parent["files"] if parent else {}
+        files = {}
+        for name in _data_files(self.path):
+            path = os.path.join(self.path, name)
+            size = os.path.getsize(path)
+            if name in parent_files and os.path.samefile(path, os.path.join(self.parent_dir, name)):
+                # Hard-linked from the parent, which already hashed it
+                files[name] = parent_files[name]
+                continue
+            _fsync(path)
+            files[name] = {"bytes": size, "sha256": _checksum(path)}
+
+        manifest = {
+            "snapshot": self.snapshot_id,
+            "created_at": datetime.now().isoformat(),
+            "kind": kind,
+            "parent": parent["snapshot"] if parent else None,
+            "documents": len(metadata.get("texts", [])),
+            "dimension": metadata.get("dimension"),
+            "search_dimensions": metadata.get("search_dimensions"),
+            "embedding_model": metadata.get("embedding_model", "text-embedding-3-small"),
+            "index_mode": metadata.get("index_mode", "flat"),
+            "shards": (metadata.get("shards") or {}).get("count"),
+            "files": files,
+            "stats": stats or {}
+        }
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+
+        final_path = snapshot_path(self.index_dir, self.snapshot_id)
+        os.rename(self.path, final_path)
+        _fsync(snapshots_dir(self.index_dir))
+        self.path = final_path
+        self.paths = file_paths(final_path)
+        _point_to(self.index_dir, self.snapshot_id)
+        prune(self.index_dir)
+        return manifest
+
+    def abort(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def _point_to(index_dir, snapshot_id):
+    # Readers see either the old pointer or the new one, never a partial write
+    tmp_path = _pointer(index_dir) + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(snapshot_id + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _pointer(index_dir))
+    _fsync(index_dir)
+
+def activate(index_dir, snapshot_id, checksums=True):
+    """Make an existing snapshot current (e.g. to roll back) after validating it; returns its manifest"""
+    directory = snapshot_path(index_dir, snapshot_id)
+    # Only published snapshots, and only names inside the snapshots directory
+    published = os.path.basename(directory) == snapshot_id and not snapshot_id.endswith(".tmp")
+    manifest = load_manifest(directory) if published else None
+    if manifest is None:
+        raise LookupError(f"Snapshot {snapshot_id} not found")
+    validate(directory, manifest, checksums=checksums)
+    _point_to(index_dir, snapshot_id)
+    return manifest
+
+def list_snapshots(index_dir):
+    """Published snapshots, newest first"""
+    root = snapshots_dir(index_dir)
+    if not os.path.isdir(root):
+        return []
+    current = current_id(index_dir)
+    result = []
+    for name in sorted(os.listdir(root), reverse=True):
+        manifest = None if name.endswith(".tmp") else load_manifest(os.path.join(root, name))
+        if manifest is None:
+            continue
+        result.append({
+            "snapshot": name,
+            "current": name == current,
+            "created_at": manifest["created_at"],
+            "kind": manifest["kind"],
+            "parent": manifest["parent"],
+            "documents": manifest["documents"],
+            "embedding_model": manifest["embedding_model"],
+            "index_mode": manifest["index_mode"],
+            "shards": manifest["shards"],
+            "bytes": sum(entry["bytes"] for entry in manifest["files"].values()),
+            "stats": manifest["stats"]
+        })
+    return result
+
+def prune(index_dir, keep=SNAPSHOT_RETAIN):
+    """Remove snapshots beyond the newest `keep` (never the current one), stale unpublished ones,
+    and backup copies left by rebuilds from before snapshots; returns the snapshot ids removed"""
+    root = snapshots_dir(index_dir)
+    current = current_id(index_dir)
+    # Ids are timestamps, so name order is age order
+    published = sorted((name for name in os.listdir(root) if not name.endswith(".tmp")), reverse=True)
+    retained = set(published[:max(keep, 1)]) | {current}
+    removed = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.endswith(".tmp"):
+            if time.time() - os.path.getmtime(path) > SNAPSHOT_STALE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        elif name not in retained:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+    for name in os.listdir(index_dir):
+        if name.startswith(("vector.index.backup_", "metadata.pkl.backup_")):
+            os.remove(os.path.join(index_dir, name))
+    if removed:
+        print(f"Removed {len(removed)} old index snapshots: {', '.join(sorted(removed))}")
+    return removed
@@ -0,0 +1,71 @@
+import os
+import pickle
+import sys
+import faiss
+import numpy as np
+import pytest
+
+# Backend modules import each other by name, and upstream creates its API client at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+import attributes
+import config
+import dedup
+import index_store
+import related
+import shards
+import snapshots
+import typeahead
+
+DIMENSION = 32
+
+def random_vectors(count, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def documents(count, start=0):
+    """Distinct texts, sources and ids; every other document is an interview document"""
+    texts = [f"document {n} covers topic{n} with words alpha{n} beta{n} gamma{n} delta{n}" for n in range(start, start + count)]
+    sources = [f"Source {n % 3}" for n in range(start, start + count)]
+    ids = [f"interview_{n}#0" if n % 2 else f"doc{n}" for n in range(start, start + count)]
+    return texts, sources, ids
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    """An empty serving index directory on a temporary persistent disk"""
+    monkeypatch.setenv("PERSISTENT_DISK_PATH", str(tmp_path))
+    return config.get_index_directory()
+
+@pytest.fixture
+def build_index(index_dir):
+    """Publish an index of `count` documents with every artifact a build writes; returns its vectors"""
+    def build(count=20, shard_count=None):
+        texts, sources, ids = documents(count)
+        vectors = random_vectors(count)
+        if shard_count:
+            index = shards.build(vectors, ids, shard_count, mode="flat")
+        else:
+            index = index_store.build_index(vectors, mode="flat")
+
+        snapshot = snapshots.SnapshotBuilder(index_dir)
+        if shard_count:
+            shards.write(index, snapshot.paths["snapshot_dir"])
+        else:
+            faiss.write_index(index, snapshot.paths["vector_index"])
+        index_store.save_vectors(vectors, snapshot.paths["vectors"])
+        np.save(snapshot.paths["signatures"], dedup.signatures(texts))
+        related.write(related.build_graph(index, vectors, k=5, full_vectors=vectors), snapshot.paths["related_graph"])
+        typeahead.write(typeahead.count(texts, sources), snapshot.paths["typeahead"])
+        metadata = {"texts": texts, "sources": sources, "ids": ids, "total_documents": count,
+                    "followups": [[f"question {n}?"] for n in range(count)],
+                    "aliases": [[] for _ in range(count)],
+                    "index_mode": "flat", "dimension": DIMENSION, "search_dimensions": DIMENSION,
+                    "dedup": dedup.make_stats(count, count),
+                    "attributes": attributes.build(ids, sources, {}),
+                    "shards": {"count": shard_count, "key": "document"} if shard_count else None}
+        with open(snapshot.paths["metadata"], "wb") as f:
+            pickle.dump(metadata, f)
+        snapshot.publish(metadata, kind="build")
+        return vectors
+    return build
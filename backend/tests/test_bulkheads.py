@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import pytest
+import bulkheads
+import deadlines
+
+@pytest.fixture
+def pool():
+    pool = bulkheads.Bulkhead("test", 1)
+    yield pool
+    pool._executor.shutdown(wait=False)
+
+@pytest.fixture
+def busy(pool):
+    """Occupy the pool's only thread, with tasks known to take about a second each"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+    pool.service_seconds = 1.0
+    pool.completed = 1
+    future = pool.submit(block)
+    assert started.wait(5)
+    yield pool
+    release.set()
+    future.result(5)
+
+def test_idle_pool_has_no_wait(pool):
+    assert pool.estimated_wait() == 0.0
+
+def test_busy_pool_estimates_queue_wait(busy):
+    assert busy.estimated_wait() == pytest.approx(1.0)
+    busy.queued += 1
+    try:
+        assert busy.estimated_wait() == pytest.approx(2.0)
+    finally:
+        busy.queued -= 1
+
+def test_admit_without_deadline(busy):
+    bulkheads.admit(busy)
+
+def test_admit_with_time_to_spare(busy):
+    token = deadlines.start(5)
+    try:
+        bulkheads.admit(busy)
+    finally:
+        deadlines.reset(token)
+
+def test_admit_sheds_when_the_wait_outlasts_the_deadline(busy):
+    shed = bulkheads.REQUESTS_SHED._values.get(("test",), 0)
+    token = deadlines.start(0.5)
+    try:
+        with pytest.raises(bulkheads.Overloaded) as raised:
+            bulkheads.admit(busy)
+    finally:
+        deadlines.reset(token)
+    assert raised.value.pool == "test"
+    assert raised.value.estimated_wait == pytest.approx(1.0)
+    assert bulkheads.REQUESTS_SHED._values[("test",)] == shed + 1
+
+def test_idle_pool_admits_even_a_short_deadline(pool):
+    token = deadlines.start(0.01)
+    try:
+        bulkheads.admit(pool)
+    finally:
+        deadlines.reset(token)
+
+def test_submit_carries_the_deadline_to_the_pool_thread(pool):
+    token = deadlines.start(5)
+    try:
+        left = pool.submit(deadlines.remaining).result(5)
+    finally:
+        deadlines.reset(token)
+    assert 4.5 < left <= 5
+    assert pool.submit(deadlines.remaining).result(5) is None
+
+def test_run_in_applies_admission(busy):
+    @bulkheads.run_in(busy, admission=True)
+    def endpoint():
+        return "ran"
+
+    async def call(seconds):
+        token = deadlines.start(seconds)
+        try:
+            return await endpoint()
+        finally:
+            deadlines.reset(token)
+
+    with pytest.raises(bulkheads.Overloaded):
+        asyncio.run(call(0.5))
@@ -0,0 +1,84 @@
+import time
+import pytest
+import deadlines
+
+@pytest.fixture
+def deadline():
+    """Start a deadline `seconds` from now for the rest of the test"""
+    tokens = []
+
+    def start(seconds):
+        tokens.append(deadlines.start(seconds))
+    yield start
+    for token in reversed(tokens):
+        deadlines.reset(token)
+
+@pytest.mark.parametrize("value, expected", [
+    ("1500", 1.5),
+    ("250.5", 0.2505),
+    (None, 3.0),
+    ("soon", 3.0),
+    ("0", 3.0),
+    ("-100", 3.0)
+])
+def test_from_header(value, expected):
+    assert deadlines.from_header(value, default=3.0) == pytest.approx(expected)
+
+def test_no_deadline():
+    assert deadlines.remaining() is None
+    deadlines.check("retrieval")
+
+def test_start_and_reset():
+    token = deadlines.start(2)
+    try:
+        assert 1.9 < deadlines.remaining() <= 2
+    finally:
+        deadlines.reset(token)
+    assert deadlines.remaining() is None
+
+def test_check_raises_once_the_deadline_passes(deadline):
+    deadline(10)
+    deadlines.check("retrieval")
+
+    deadline(-0.001)
+    with pytest.raises(deadlines.DeadlineExceeded) as raised:
+        deadlines.check("completion")
+    assert raised.value.stage == "completion"
+    assert deadlines.DEADLINES_EXCEEDED._values[("completion",)] >= 1
+
+def test_reserve_moves_the_deadline_earlier(deadline):
+    with deadlines.reserve(1):
+        assert deadlines.remaining() is None
+
+    deadline(5)
+    with deadlines.reserve(1):
+        assert 3.9 < deadlines.remaining() <= 4
+        with deadlines.reserve(10):
+            with pytest.raises(deadlines.DeadlineExceeded):
+                deadlines.check("completion")
+    assert 4.9 < deadlines.remaining() <= 5
+
+def test_own_never_extends_the_current_deadline(deadline):
+    with deadlines.own(3):
+        assert 2.9 < deadlines.remaining() <= 3
+    assert deadlines.remaining() is None
+
+    deadline(1)
+    with deadlines.own(3):
+        assert deadlines.remaining() <= 1
+    with deadlines.own(0.5):
+        assert deadlines.remaining() <= 0.5
+    assert 0.5 < deadlines.remaining() <= 1
+
+def test_detached_has_no_deadline(deadline):
+    deadline(-1)
+    with deadlines.detached():
+        assert deadlines.remaining() is None
+        deadlines.check("background")
+    assert deadlines.remaining() < 0
+
+def test_remaining_counts_down(deadline):
+    deadline(1)
+    before = deadlines.remaining()
+    time.sleep(0.01)
+    assert deadlines.remaining() < before
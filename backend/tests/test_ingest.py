@@ -0,0 +1,153 @@
+import json
+import os
+import pickle
+import numpy as np
+import pytest
+from conftest import documents, random_vectors
+import attributes
+import config
+import dedup
+import ingest
+import related
+import shards
+import snapshots
+import typeahead
+
+def load_index():
+    """Everything the serving index reads, from the current snapshot"""
+    paths = config.get_index_paths()
+    with open(paths["metadata"], "rb") as f:
+        metadata = pickle.load(f)
+    rows = len(metadata["texts"])
+    return {
+        "metadata": metadata,
+        "index": shards.read_index(paths["vector_index"], metadata),
+        "vectors": np.load(paths["vectors"]),
+        "signatures": np.load(paths["signatures"]),
+        "graph": related.load(paths["related_graph"], rows),
+        "counts": typeahead.load_counts(paths["typeahead"])
+    }
+
+def assert_aligned(state):
+    """Every row-aligned artifact describes the same rows, in the same order"""
+    metadata = state["metadata"]
+    rows = len(metadata["texts"])
+    for key in ("sources", "ids", "followups", "aliases"):
+        assert len(metadata[key]) == rows, key
+    assert metadata["total_documents"] == rows
+    for key in ("doc_type", "source", "interview", "added_at"):
+        assert len(metadata["attributes"][key]) == rows, key
+    interview_rows = [row_id.startswith("interview_") for row_id in metadata["ids"]]
+    assert list(metadata["attributes"]["doc_type"]) == [attributes.DOC_TYPES.index("interview" if interview else "corpus")
+                                                        for interview in interview_rows]
+    assert [metadata["attributes"]["source_vocab"][code] for code in metadata["attributes"]["source"]] == metadata["sources"]
+
+    assert state["index"].ntotal == rows
+    assert len(state["vectors"]) == rows
+    np.testing.assert_array_equal(np.vstack([state["index"].reconstruct(row) for row in range(rows)]), state["vectors"])
+    np.testing.assert_array_equal(state["signatures"], dedup.signatures(metadata["texts"]))
+
+    # The graph kept up incrementally matches one built from scratch over the same rows
+    expected = related.build_graph(state["index"], state["vectors"], k=5, full_vectors=state["vectors"])
+    np.testing.assert_array_equal(state["graph"]["neighbours"], expected["neighbours"])
+    np.testing.assert_allclose(state["graph"]["distances"], expected["distances"], rtol=1e-5, atol=1e-6)
+
+    alias_sources = [alias["source"] for entries in metadata["aliases"] for alias in entries]
+    expected_counts = typeahead.count(metadata["texts"], metadata["sources"] + alias_sources)
+    assert +state["counts"]["terms"] == expected_counts["terms"]
+    assert +state["counts"]["sources"] == expected_counts["sources"]
+
+@pytest.fixture(params=[None, 3], ids=["single", "sharded"])
+def shard_count(request):
+    return request.param
+
+def append(count, start, vectors_seed):
+    texts, sources, ids = documents(count, start=start)
+    vectors = random_vectors(count, seed=vectors_seed)
+    staged = ingest.IndexAppend(texts, sources, ids, vectors, signatures=dedup.signatures(texts),
+                                followups=[[] for _ in texts], interview_id="interview_new",
+                                added_at="2026-01-01T00:00:00")
+    staged.commit()
+    return texts, ids, vectors
+
+def test_append_keeps_rows_aligned(build_index, shard_count):
+    original = build_index(20, shard_count=shard_count)
+
+    texts, ids, vectors = append(6, start=20, vectors_seed=1)
+
+    state = load_index()
+    assert_aligned(state)
+    metadata = state["metadata"]
+    assert metadata["ids"][20:] == ids
+    assert metadata["texts"][20:] == texts
+    np.testing.assert_array_equal(state["vectors"], np.vstack([original, vectors]))
+    assert metadata["followups"][:20] == [[f"question {n}?"] for n in range(20)]
+    assert metadata["dedup"] == dedup.make_stats(26, 26)
+    manifest = snapshots.load_manifest(snapshots.data_dir(config.get_index_directory()))
+    assert manifest["kind"] == "ingest" and manifest["documents"] == 26
+
+    with open(config.get_index_paths()["rebuild_status"]) as f:
+        status = json.load(f)
+    assert status["total_documents"] == 26
+    assert status["snapshot"] == manifest["snapshot"]
+
+def test_append_records_duplicates_as_aliases(build_index):
+    build_index(20)
+    texts, sources, ids = documents(2, start=20)
+    # A re-upload of row 3 under a new id, plus one new document
+    existing_texts, _, _ = documents(20)
+    texts[0] = existing_texts[3]
+
+    keep, signatures, aliases = ingest.plan_dedup(texts, sources, ids)
+    assert keep == [1]
+    assert aliases == {3: [{"id": ids[0], "source": sources[0]}]}
+    staged = ingest.IndexAppend([texts[1]], [sources[1]], [ids[1]], random_vectors(1, seed=2),
+                                signatures=signatures, aliases=aliases, chunks_seen=len(texts))
+    staged.commit()
+
+    state = load_index()
+    assert_aligned(state)
+    assert state["metadata"]["aliases"][3] == aliases[3]
+    assert state["metadata"]["dedup"] == dedup.make_stats(22, 21)
+
+def test_removal_keeps_rows_aligned(build_index, shard_count):
+    original = build_index(20, shard_count=shard_count)
+    _, _, ids = documents(20)
+    removed = [0, 7, 8, 19]
+
+    removal = ingest.IndexRemoval(removed)
+    removal.commit()
+
+    state = load_index()
+    assert_aligned(state)
+    keep = np.ones(20, dtype=bool)
+    keep[removed] = False
+    assert state["metadata"]["ids"] == [row_id for row_id, kept in zip(ids, keep) if kept]
+    assert state["metadata"]["followups"] == [[f"question {n}?"] for n in range(20) if keep[n]]
+    np.testing.assert_array_equal(state["vectors"], original[keep])
+    assert state["metadata"]["dedup"] == dedup.make_stats(16, 16)
+    manifest = snapshots.load_manifest(snapshots.data_dir(config.get_index_directory()))
+    assert manifest["kind"] == "delete" and manifest["stats"] == {"rows_removed": 4}
+
+def test_append_then_removal(build_index, shard_count):
+    build_index(20, shard_count=shard_count)
+    append(6, start=20, vectors_seed=1)
+
+    ingest.IndexRemoval([2, 21, 25]).commit()
+
+    state = load_index()
+    assert_aligned(state)
+    assert len(state["metadata"]["ids"]) == 23
+
+def test_abort_leaves_current_snapshot(build_index):
+    build_index(20)
+    index_dir = config.get_index_directory()
+    current = snapshots.current_id(index_dir)
+    texts, sources, ids = documents(2, start=20)
+
+    ingest.IndexAppend(texts, sources, ids, random_vectors(2, seed=1)).abort()
+    ingest.IndexRemoval([1]).abort()
+
+    assert snapshots.current_id(index_dir) == current
+    assert os.listdir(snapshots.snapshots_dir(index_dir)) == [current]
+    assert_aligned(load_index())
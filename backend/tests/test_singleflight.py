@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from singleflight import SingleFlight, get_group
+
+def blocking_call():
+    """fn for SingleFlight.do that blocks until released and counts its runs"""
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def fn(value):
+        runs.append(value)
+        started.set()
+        assert release.wait(5)
+        return value * 2
+    return fn, started, release, runs
+
+def wait_for_waiters(flight, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while flight.stats()["coalesced"] < count:
+        assert time.monotonic() < deadline, "callers never joined the in-flight call"
+        time.sleep(0.001)
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight("test")
+    fn, started, release, runs = blocking_call()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flight.do, "key", fn, 21)
+        assert started.wait(5)
+        waiters = [pool.submit(flight.do, "key", fn, 21) for _ in range(3)]
+        wait_for_waiters(flight, 3)
+        assert flight.stats()["in_flight"] == 1
+        release.set()
+        results = [leader.result(5)] + [waiter.result(5) for waiter in waiters]
+
+    assert results == [42] * 4
+    assert runs == [21]
+    assert flight.stats() == {"calls": 1, "coalesced": 3, "wait_timeouts": 0, "in_flight": 0}
+
+def test_different_keys_run_separately():
+    flight = SingleFlight("test")
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    # A finished key runs again rather than returning the old result
+    assert flight.do("a", lambda: 3) == 3
+    assert flight.stats()["calls"] == 3
+
+def test_error_is_shared_with_waiters():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        assert release.wait(5)
+        raise RuntimeError("upstream failed")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", fail)
+        assert started.wait(5)
+        waiter = pool.submit(flight.do, "key", fail)
+        wait_for_waiters(flight, 1)
+        release.set()
+        for future in (leader, waiter):
+            with pytest.raises(RuntimeError, match="upstream failed"):
+                future.result(5)
+    assert flight.stats()["in_flight"] == 0
+
+def test_waiter_past_timeout_runs_the_call_itself():
+    flight = SingleFlight("test")
+    fn, started, release, runs = blocking_call()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(flight.do, "key", fn, 1)
+        assert started.wait(5)
+        # The leader is still blocked, so the waiter stops waiting and runs its own call
+        assert flight.do("key", lambda: "own", timeout=0.01) == "own"
+        assert not leader.done()
+        release.set()
+        assert leader.result(5) == 2
+
+    assert runs == [1]
+    assert flight.stats() == {"calls": 1, "coalesced": 1, "wait_timeouts": 1, "in_flight": 0}
+
+def test_get_group_returns_one_group_per_name():
+    assert get_group("test-group") is get_group("test-group")
+    assert get_group("test-group") is not get_group("other-group")
@@ -0,0 +1,115 @@
+import os
+import pickle
+import time
+import pytest
+import snapshots
+
+def publish(index_dir, payload, parent_dir=None, kind="rebuild"):
+    """Publish a snapshot whose metadata has one row per character of payload"""
+    builder = snapshots.SnapshotBuilder(index_dir, parent_dir=parent_dir)
+    metadata = {"texts": list(payload)}
+    with open(builder.paths["metadata"], "wb") as f:
+        pickle.dump(metadata, f)
+    with open(builder.paths["vector_index"], "wb") as f:
+        f.write(payload.encode("utf-8"))
+    return builder.publish(metadata, kind=kind)
+
+def test_publish_makes_snapshot_current(index_dir):
+    assert snapshots.current_id(index_dir) is None
+    assert snapshots.data_dir(index_dir) == index_dir
+
+    manifest = publish(index_dir, "abc")
+
+    assert snapshots.current_id(index_dir) == manifest["snapshot"]
+    directory = snapshots.data_dir(index_dir)
+    assert directory == snapshots.snapshot_path(index_dir, manifest["snapshot"])
+    assert manifest["documents"] == 3
+    assert set(manifest["files"]) == {"vector.index", "metadata.pkl"}
+    assert snapshots.load_manifest(directory) == manifest
+    snapshots.validate(directory, manifest, checksums=True)
+    assert not [name for name in os.listdir(snapshots.snapshots_dir(index_dir)) if name.endswith(".tmp")]
+
+def test_child_snapshot_links_unchanged_parent_files(index_dir):
+    parent = publish(index_dir, "abc")
+    parent_dir = snapshots.data_dir(index_dir)
+
+    builder = snapshots.SnapshotBuilder(index_dir, parent_dir=parent_dir)
+    metadata = {"texts": list("abcd")}
+    with open(builder.paths["metadata"], "wb") as f:
+        pickle.dump(metadata, f)
+    child = builder.publish(metadata, kind="ingest")
+
+    child_dir = snapshots.data_dir(index_dir)
+    assert child["parent"] == parent["snapshot"]
+    assert os.path.samefile(os.path.join(child_dir, "vector.index"), os.path.join(parent_dir, "vector.index"))
+    assert child["files"]["vector.index"] == parent["files"]["vector.index"]
+    assert child["files"]["metadata.pkl"] != parent["files"]["metadata.pkl"]
+    snapshots.validate(child_dir, child, checksums=True)
+
+def test_activate_rolls_back(index_dir):
+    first = publish(index_dir, "abc")
+    second = publish(index_dir, "abcd")
+    assert snapshots.current_id(index_dir) == second["snapshot"]
+
+    manifest = snapshots.activate(index_dir, first["snapshot"])
+
+    assert manifest == first
+    assert snapshots.current_id(index_dir) == first["snapshot"]
+    listed = snapshots.list_snapshots(index_dir)
+    assert [entry["snapshot"] for entry in listed] == [second["snapshot"], first["snapshot"]]
+    assert [entry["current"] for entry in listed] == [False, True]
+
+def test_activate_refuses_unknown_and_unpublished_snapshots(index_dir):
+    current = publish(index_dir, "abc")
+    builder = snapshots.SnapshotBuilder(index_dir)
+
+    for snapshot_id in ("missing", os.path.basename(builder.path), "../index"):
+        with pytest.raises(LookupError):
+            snapshots.activate(index_dir, snapshot_id)
+    assert snapshots.current_id(index_dir) == current["snapshot"]
+
+def test_damaged_snapshot_fails_validation(index_dir):
+    first = publish(index_dir, "abc")
+    second = publish(index_dir, "xyz")
+    directory = snapshots.snapshot_path(index_dir, first["snapshot"])
+
+    # Same size, different content: only the checksum catches it
+    with open(os.path.join(directory, "vector.index"), "wb") as f:
+        f.write(b"abd")
+    snapshots.validate(directory, first)
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        snapshots.activate(index_dir, first["snapshot"])
+
+    os.remove(os.path.join(directory, "vector.index"))
+    with pytest.raises(ValueError, match="vector.index is missing"):
+        snapshots.validate(directory, first)
+    assert snapshots.current_id(index_dir) == second["snapshot"]
+
+def test_check_loaded(index_dir):
+    manifest = publish(index_dir, "abc")
+    snapshots.check_loaded(manifest, 3, 3)
+    with pytest.raises(ValueError):
+        snapshots.check_loaded(manifest, 3, 2)
+
+def test_prune_keeps_newest_and_current(index_dir):
+    published = [publish(index_dir, "a" * (n + 1))["snapshot"] for n in range(4)]
+    # publish() prunes down to SNAPSHOT_RETAIN (3) as it goes
+    assert [entry["snapshot"] for entry in snapshots.list_snapshots(index_dir)] == published[::-1][:3]
+
+    snapshots.activate(index_dir, published[1])
+    removed = snapshots.prune(index_dir, keep=1)
+
+    assert removed == [published[2]]
+    assert {entry["snapshot"] for entry in snapshots.list_snapshots(index_dir)} == {published[1], published[3]}
+
+def test_prune_removes_stale_unpublished_snapshots(index_dir):
+    publish(index_dir, "abc")
+    stale = snapshots.SnapshotBuilder(index_dir)
+    fresh = snapshots.SnapshotBuilder(index_dir)
+    old = time.time() - snapshots.SNAPSHOT_STALE_SECONDS - 60
+    os.utime(stale.path, (old, old))
+
+    snapshots.prune(index_dir)
+
+    assert not os.path.exists(stale.path)
+    assert os.path.exists(fresh.path)
@@ -0,0 +1,114 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from config import get_index_paths
+from metrics import QUERY_STAGE_SECONDS
+import deadlines
+
+# Fraction of /query requests captured in full (opt-in, 0 disables sampling)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# Requests slower than this are always captured (0 disables slow capture)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "3000"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+
+_current_trace = contextvars.ContextVar("sidekick_trace", default=None)
+_logger = None
+
+def get_trace_path():
+    """Trace log location; rotated files get .1, .2, ... suffixes"""
+    trace_dir = os.getenv("TRACE_DIR") or os.path.join(get_index_paths()["index_dir"], "traces")
+    os.makedirs(trace_dir, exist_ok=True)
+    return os.path.join(trace_dir, "query_traces.jsonl")
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        logger = logging.getLogger("sidekick.traces")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(get_trace_path(), maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+def start_trace(text, mode, **fields):
+    """Begin collecting a trace for the current request"""
+    trace = {
+        "timestamp": datetime.now().isoformat(),
+        "text": text,
+        "mode": mode,
+        "stages_ms": {},
+        "_start": time.perf_counter()
+    }
+    trace.update(fields)
+    return _current_trace.set(trace)
+
+def annotate(**fields):
+    """Attach fields (retrieved ids, token counts, ...) to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+@contextmanager
+def stage(name, enforce_deadline=True):
+    """Time a query pipeline stage into the metrics histogram and the current trace.
+
+    Stage boundaries are also where a request past its deadline stops, except for
+    fallback stages that exist to answer late requests.
+    """
+    if enforce_deadline:
+        deadlines.check(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        QUERY_STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace["stages_ms"][name] = round(elapsed * 1000, 3)
+
+def finish_trace(token, error=None):
+    """Close the current trace and write it if it was sampled or slow"""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return
+
+    total_ms = (time.perf_counter() - trace.pop("_start")) * 1000
+    slow = TRACE_SLOW_MS > 0 and total_ms >= TRACE_SLOW_MS
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if not (slow or sampled):
+        return
+
+    trace["total_ms"] = round(total_ms, 3)
+    trace["slow"] = slow
+    if error is not None:
+        trace["error"] = f"{type(error).__name__}: {error}"
+
+    try:
+        _get_logger().info(json.dumps(trace))
+    except Exception as e:
+        print(f"Error writing query trace: {e}")
+
+def load_traces(path):
+    """Read a trace log and its rotated siblings, oldest first"""
+    paths = [f"{path}.{i}" for i in range(TRACE_BACKUP_COUNT, 0, -1)] + [path]
+    traces = []
+    for trace_path in paths:
+        if not os.path.exists(trace_path):
+            continue
+        with open(trace_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    traces.append(json.loads(line))
+    return traces
@@ -0,0 +1,119 @@
+import bisect
+import os
+import pickle
+import re
+from collections import Counter
+import numpy as np
+from metrics import Histogram
+from extractive import STOPWORDS
+
+# Completions returned by /suggest unless the request asks for fewer
+TYPEAHEAD_LIMIT = int(os.getenv("TYPEAHEAD_LIMIT", "8"))
+# Terms must appear in at least this many chunks to be suggested (drops typos and extraction noise)
+TYPEAHEAD_MIN_COUNT = int(os.getenv("TYPEAHEAD_MIN_COUNT", "2"))
+# Trailing words of the input matched against source titles
+TYPEAHEAD_MAX_WORDS = int(os.getenv("TYPEAHEAD_MAX_WORDS", "3"))
+
+TERM = "term"
+SOURCE = "source"
+
+SUGGEST_SECONDS = Histogram(
+    "sidekick_suggest_seconds", "Time to rank /suggest completions",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01))
+
+_TERM = re.compile(r"[a-z][a-z0-9]*(?:-[a-z0-9]+)*")
+_WORD_START = re.compile(r"\w+")
+
+def terms(text):
+    """Distinct suggestable words of a text"""
+    return {word for word in _TERM.findall(text.lower()) if len(word) >= 3 and word not in STOPWORDS}
+
+def count(texts, sources, counts=None):
+    """Chunk counts per term and per source, added to counts ({"terms", "sources"}) when given"""
+    if counts is None:
+        counts = {"terms": Counter(), "sources": Counter()}
+    for text in texts:
+        counts["terms"].update(terms(text))
+    counts["sources"].update(sources)
+    return counts
+
+def discount(texts, sources, counts):
+    """counts with removed chunks taken out again; terms and sources left in no chunk are dropped"""
+    for text in texts:
+        counts["terms"].subtract(terms(text))
+    counts["sources"].subtract(sources)
+    # Unary + keeps only positive counts
+    return {"terms": +counts["terms"], "sources": +counts["sources"]}
+
+def write(counts, path):
+    with open(path, "wb") as f:
+        pickle.dump(counts, f)
+
+def load_counts(path):
+    """Stored counts, or None for indexes built before typeahead existed"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+class _SortedKeys:
+    """Completion keys in one sorted array; a prefix is the key range between two binary searches"""
+
+    def __init__(self, entries):
+        entries = sorted(entries)
+        self.keys = [key for key, _, _ in entries]
+        self.texts = [text for _, text, _ in entries]
+        self.scores = np.array([score for _, _, score in entries], dtype="int64")
+
+    def top(self, prefix, limit):
+        """Highest-scoring (text, score) pairs whose key starts with prefix"""
+        lo = bisect.bisect_left(self.keys, prefix)
+        # Every key starting with prefix sorts before prefix with its last character incremented
+        hi = bisect.bisect_left(self.keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
+        rows = np.arange(lo, hi)
+        if len(rows) > limit:
+            rows = lo + np.argpartition(-self.scores[lo:hi], limit)[:limit]
+        return [(self.texts[row], int(self.scores[row])) for row in rows]
+
+class Typeahead:
+    """Prefix index of corpus terms and sources, ranked by the number of chunks they appear in.
+
+    Sources are keyed by every suffix starting at a word, so "decoding" finds
+    "Sequoia: ... Speculative Decoding".
+    """
+
+    def __init__(self, counts, min_count=TYPEAHEAD_MIN_COUNT):
+        self.terms = _SortedKeys((term, term, n) for term, n in counts["terms"].items() if n >= min_count)
+        source_keys = []
+        for source, n in counts["sources"].items():
+            lowered = " ".join(source.lower().split())
+            source_keys.extend((lowered[match.start():], source, n) for match in _WORD_START.finditer(lowered))
+        self.sources = _SortedKeys(source_keys)
+
+    def __len__(self):
+        return len(self.terms.keys) + len(self.sources.keys)
+
+    def suggest(self, query, limit=TYPEAHEAD_LIMIT):
+        """Ranked completions of the text being typed.
+
+        Terms complete its last word; sources match its last one to TYPEAHEAD_MAX_WORDS words as a
+        phrase. Each completion says how many trailing words it replaces; longer matches rank first.
+        """
+        words = query.lower().split()
+        if not words:
+            return []
+        candidates = [(1, text, score, TERM) for text, score in self.terms.top(words[-1], limit)]
+        for size in range(1, min(TYPEAHEAD_MAX_WORDS, len(words)) + 1):
+            phrase = " ".join(words[-size:])
+            # A source can match at several of its words, so fetch extra before de-duplicating
+            candidates.extend((size, text, score, SOURCE) for text, score in self.sources.top(phrase, limit * 2))
+
+        suggestions, seen = [], set()
+        for size, text, score, kind in sorted(candidates, key=lambda c: (-c[0], -c[2], len(c[1]), c[1])):
+            if (kind, text) in seen:
+                continue
+            seen.add((kind, text))
+            suggestions.append({"text": text, "kind": kind, "score": score, "words": size})
+            if len(suggestions) == limit:
+                break
+        return suggestions
@@ -0,0 +1,248 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openai
+from openai import OpenAI
+from dotenv import load_dotenv
+from metrics import Counter, Histogram, UPSTREAM_ERRORS
+import deadlines
+
+load_dotenv()
+
+# Retries are handled here (with priority-aware limits), so the SDK's own retries are off
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# Priority lanes: interactive traffic (/query, /transcribe) always goes ahead of background work
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Share of each bucket background work may not touch, so interactive bursts never wait on a rebuild
+BACKGROUND_RESERVE = float(os.getenv("UPSTREAM_BACKGROUND_RESERVE", "0.2"))
+MAX_RETRIES = {
+    INTERACTIVE: int(os.getenv("UPSTREAM_INTERACTIVE_RETRIES", "2")),
+    BACKGROUND: int(os.getenv("UPSTREAM_BACKGROUND_RETRIES", "8"))
+}
+RETRY_BASE_SECONDS = float(os.getenv("UPSTREAM_RETRY_BASE_SECONDS", "0.5"))
+RETRY_MAX_SECONDS = float(os.getenv("UPSTREAM_RETRY_MAX_SECONDS", "30"))
+# Send a duplicate interactive request when the first one runs past the observed p95
+HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE", "0") == "1"
+HEDGE_MIN_SAMPLES = 20
+
+UPSTREAM_SECONDS = Histogram(
+    "sidekick_upstream_seconds", "Latency of individual OpenAI calls", labels=("operation",))
+LIMITER_WAIT_SECONDS = Histogram(
+    "sidekick_upstream_limiter_wait_seconds", "Time spent waiting for rate-limit capacity", labels=("operation", "lane"))
+UPSTREAM_RETRIES = Counter(
+    "sidekick_upstream_retries_total", "Retried OpenAI calls", labels=("operation",))
+UPSTREAM_HEDGES = Counter(
+    "sidekick_upstream_hedges_total", "Hedged duplicate OpenAI calls", labels=("operation", "winner"))
+
+class RateLimiter:
+    """Token buckets for requests/minute and tokens/minute with two priority lanes"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None):
+        self.capacity = {"requests": float(requests_per_minute)}
+        if tokens_per_minute:
+            self.capacity["tokens"] = float(tokens_per_minute)
+        self.available = dict(self.capacity)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._interactive_waiting = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        for kind, capacity in self.capacity.items():
+            self.available[kind] = min(capacity, self.available[kind] + elapsed * capacity / 60)
+
+    def _try_take(self, cost, lane):
+        if lane == BACKGROUND and self._interactive_waiting:
+            return False
+        reserve = BACKGROUND_RESERVE if lane == BACKGROUND else 0.0
+        for kind, amount in cost.items():
+            if self.available[kind] - amount < self.capacity[kind] * reserve:
+                return False
+        for kind, amount in cost.items():
+            self.available[kind] -= amount
+        return True
+
+    def _cost(self, tokens):
+        cost = {"requests": 1.0}
+        if "tokens" in self.capacity:
+            # A single call larger than the bucket would otherwise never fit
+            cost["tokens"] = float(min(tokens, self.capacity["tokens"] * (1 - BACKGROUND_RESERVE)))
+        return cost
+
+    def try_acquire(self, tokens=0, lane=INTERACTIVE):
+        with self._cond:
+            self._refill()
+            return self._try_take(self._cost(tokens), lane)
+
+    def acquire(self, tokens=0, lane=INTERACTIVE, timeout=None):
+        """Block until capacity is available in the given lane; False if the timeout passes first"""
+        cost = self._cost(tokens)
+        give_up = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            # Waiting interactive callers hold back the background lane entirely
+            if lane == INTERACTIVE:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if self._try_take(cost, lane):
+                        return True
+                    wait_seconds = 0.05
+                    if give_up is not None:
+                        wait_seconds = min(wait_seconds, give_up - time.monotonic())
+                        if wait_seconds <= 0:
+                            return False
+                    self._cond.wait(timeout=wait_seconds)
+            finally:
+                if lane == INTERACTIVE:
+                    self._interactive_waiting -= 1
+                self._cond.notify_all()
+
+class LatencyTracker:
+    """Rolling window of recent call latencies"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self):
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+_limiters = {
+    "embedding": RateLimiter(int(os.getenv("OPENAI_EMBEDDING_RPM", "3000")), int(os.getenv("OPENAI_EMBEDDING_TPM", "1000000"))),
+    "chat": RateLimiter(int(os.getenv("OPENAI_CHAT_RPM", "3500")), int(os.getenv("OPENAI_CHAT_TPM", "160000"))),
+    "transcription": RateLimiter(int(os.getenv("OPENAI_AUDIO_RPM", "50")))
+}
+_latency = {operation: LatencyTracker() for operation in _limiters}
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="upstream-hedge")
+
+def _is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def _retry_delay(error, attempt):
+    """Full-jitter exponential backoff, honouring Retry-After when the API sends one"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)))
+
+def _timed(operation, fn, kwargs):
+    start = time.perf_counter()
+    result = fn(**kwargs)
+    elapsed = time.perf_counter() - start
+    UPSTREAM_SECONDS.observe(elapsed, operation=operation)
+    _latency[operation].record(elapsed)
+    return result
+
+def _hedged(operation, fn, kwargs, tokens):
+    """Run the call; if it outlives the recent p95, race a duplicate and take the first success"""
+    threshold = _latency[operation].p95()
+    if threshold is None:
+        return _timed(operation, fn, kwargs)
+
+    primary = _hedge_pool.submit(_timed, operation, fn, kwargs)
+    done, _ = wait([primary], timeout=threshold)
+    if done or not _limiters[operation].try_acquire(tokens, INTERACTIVE):
+        return primary.result()
+
+    hedge = _hedge_pool.submit(_timed, operation, fn, kwargs)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                UPSTREAM_HEDGES.inc(operation=operation, winner="hedge" if future is hedge else "primary")
+                return future.result()
+            error = future.exception()
+    raise error
+
+def call(operation, fn, lane=INTERACTIVE, tokens=0, hedge=False, **kwargs):
+    """Rate-limit, retry and optionally hedge one OpenAI call, within the request's deadline if it has one"""
+    limiter = _limiters[operation]
+    attempt = 0
+    while True:
+        deadlines.check(operation)
+        start = time.perf_counter()
+        acquired = limiter.acquire(tokens, lane, timeout=deadlines.remaining())
+        LIMITER_WAIT_SECONDS.observe(time.perf_counter() - start, operation=operation, lane=lane)
+        if not acquired:
+            deadlines.expire(operation)
+
+        left = deadlines.remaining()
+        if left is not None:
+            # The SDK gives up when the caller would have
+            kwargs["timeout"] = left
+        try:
+            if hedge and HEDGE_ENABLED and lane == INTERACTIVE:
+                return _hedged(operation, fn, kwargs, tokens)
+            return _timed(operation, fn, kwargs)
+        except Exception as e:
+            left = deadlines.remaining()
+            if left is not None and left <= 0:
+                # Timed out because the request ran out of budget, not because the call failed on its own
+                UPSTREAM_ERRORS.inc(operation=operation)
+                deadlines.expire(operation)
+            if attempt >= MAX_RETRIES[lane] or not _is_retryable(e):
+                UPSTREAM_ERRORS.inc(operation=operation)
+                raise
+            delay = _retry_delay(e, attempt)
+            if left is not None and delay >= left:
+                # A retry could not finish before the deadline
+                UPSTREAM_ERRORS.inc(operation=operation)
+                raise
+            UPSTREAM_RETRIES.inc(operation=operation)
+            print(f"Retrying {operation} call in {delay:.2f}s after error: {e}")
+            time.sleep(delay)
+            attempt += 1
+
+def _estimate_tokens(value):
+    """Rough token estimate (~4 characters per token) for limiter accounting"""
+    if isinstance(value, str):
+        return len(value) // 4 + 1
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_tokens(item) for item in value)
+    if isinstance(value, dict):
+        return _estimate_tokens(value.get("content", ""))
+    return 1
+
+def create_embedding(input, model="text-embedding-3-small", lane=INTERACTIVE):
+    """Embeddings API call through the shared limiter/retry layer"""
+    return call("embedding", client.embeddings.create, lane=lane, tokens=_estimate_tokens(input),
+                hedge=True, input=input, model=model)
+
+def create_chat_completion(messages, model="gpt-3.5-turbo", lane=INTERACTIVE):
+    """Chat completion through the shared limiter/retry layer"""
+    return call("chat", client.chat.completions.create, lane=lane, tokens=_estimate_tokens(messages),
+                hedge=True, messages=messages, model=model)
+
+def create_transcription(file, model="whisper-1", response_format="text", lane=INTERACTIVE):
+    """Whisper transcription; not hedged, since the upload stream can only be read once"""
+    def send(**kwargs):
+        # Rewind so a retried attempt uploads the whole file again
+        file.seek(0)
+        return client.audio.transcriptions.create(file=file, **kwargs)
+
+    return call("transcription", send, lane=lane, model=model, response_format=response_format)
@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 
-export default function QueryBox({ conversationHistory, onAddToConversation }) {
+export default function QueryBox({ conversationId, conversationHistory, onAddToConversation }) {
   const [input, setInput] = useState("");
   const [mode, setMode] = useState("explain");
   const [response, setResponse] = useState("");
@@ -9,6 +9,7 @@ export default function QueryBox({ conversationHistory, onAddToConversation }) {
   const [isRecording, setIsRecording] = useState(false);
   const [selectedSource, setSelectedSource] = useState(null);
   const [corpus, setCorpus] = useState(null);
+  const [suggestions, setSuggestions] = useState([]);
   
   const history = conversationHistory || [];
 
@@ -28,6 +29,40 @@ export default function QueryBox({ conversationHistory, onAddToConversation }) {
     }
   };
 
+  // Typeahead for the word being typed; cleared once it is finished with a space
+  useEffect(() => {
+    if (!input.trim() || /\s$/.test(input)) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const res = await fetch(`http://localhost:8000/suggest?q=${encodeURIComponent(input)}`, {
+          signal: controller.signal,
+        });
+        if (res.ok) {
+          const data = await res.json();
+          setSuggestions(data.suggestions || []);
+        }
+      } catch (err) {
+        if (err.name !== "AbortError") console.error("Error fetching suggestions:", err);
+      }
+    }, 80);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [input]);
+
+  const applySuggestion = (suggestion) => {
+    // Each suggestion completes the last `words` words of the input
+    const words = input.trim().split(/\s+/);
+    words.splice(-suggestion.words, suggestion.words, suggestion.text);
+    setInput(words.join(" ") + " ");
+    setSuggestions([]);
+  };
+
   const findDocumentBySource = (sourceName) => {
     if (!corpus?.documents) return null;
     return corpus.documents.find(doc => 
@@ -115,7 +150,8 @@ export default function QueryBox({ conversationHistory, onAddToConversation }) {
     const res = await fetch("http://localhost:8000/query", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ text: query, mode }),
+      // The backend keeps the conversation summary, so only the id and new text are sent
+      body: JSON.stringify({ text: query, mode, conversation_id: conversationId }),
     });
 
     const data = await res.json();
@@ -204,6 +240,28 @@ export default function QueryBox({ conversationHistory, onAddToConversation }) {
           onChange={(e) => setInput(e.target.value)}
         />
 
+        {suggestions.length > 0 && (
+          <div style={{ display: "flex", flexWrap: "wrap", gap: "0.5rem", marginTop: "-0.5rem", marginBottom: "1rem" }}>
+            {suggestions.map((s) => (
+              <button
+                key={`${s.kind}:${s.text}`}
+                onClick={() => applySuggestion(s)}
+                title={s.kind === "source" ? "Source" : "Term"}
+                style={{
+                  padding: "0.25rem 0.75rem",
+                  borderRadius: "999px",
+                  border: "1px solid #ddd",
+                  background: s.kind === "source" ? "#f5f5ff" : "#f7f7f7",
+                  fontSize: "0.85rem",
+                  cursor: "pointer",
+                }}
+              >
+                {s.text}
+              </button>
+            ))}
+          </div>
+        )}
+
         {/* Row with toggle on the left, big submit button on the right */}
         <div
           style={{
@@ -153,6 +153,7 @@ export default function Home() {
         {currentView === 'chat' ? (
           <QueryBox 
             key={currentConversationId} // Force re-render when conversation changes
+            conversationId={currentConversationId}
             conversationHistory={conversations.find(conv => conv.id === currentConversationId)?.history || []}
             onAddToConversation={addToCurrentConversation}
           />